@@ -0,0 +1,77 @@
+import os
+import json
+from collections import namedtuple
+
+# Request and result files live here by default
+BATCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batches')
+
+# Endpoint every line of a request file targets
+BATCH_URL = '/chat/completions'
+
+# One line of a results file. Exactly one of `content` / `error` is set.
+BatchResult = namedtuple('BatchResult', ['custom_id', 'content', 'finish_reason', 'error'])
+
+
+def make_custom_id(kind, source, key):
+    """Stable id of one prompt: what it generates, the source file it came from, and its content hash."""
+    return f"{kind}:{source}:{key}"
+
+
+def split_custom_id(custom_id):
+    """(kind, source, key) of a custom_id; source names may themselves contain colons."""
+    kind, rest = custom_id.split(':', 1)
+    source, key = rest.rsplit(':', 1)
+    return kind, source, key
+
+
+def write_requests(path, items):
+    """Write (custom_id, request) pairs as a batch-API request file; return the number of lines.
+
+    The file is written to a temporary name and renamed, so a partial file
+    is never left behind for upload.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for custom_id, request in items:
+            f.write(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': BATCH_URL, 'body': request},
+                               ensure_ascii=False) + '\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def _result(line):
+    custom_id = line.get('custom_id')
+    if line.get('error'):
+        error = line['error']
+        return BatchResult(custom_id, None, None, error.get('message', str(error)) if isinstance(error, dict) else str(error))
+    response = line.get('response') or {}
+    body = response.get('body') or {}
+    if response.get('status_code', 200) != 200 or body.get('error'):
+        return BatchResult(custom_id, None, None, f"HTTP {response.get('status_code')}: {body.get('error', body)}")
+    choices = body.get('choices') or []
+    if not choices:
+        return BatchResult(custom_id, None, None, 'no choices in response')
+    content = (choices[0].get('message') or {}).get('content')
+    if not content:
+        return BatchResult(custom_id, None, None, 'empty completion')
+    return BatchResult(custom_id, content, choices[0].get('finish_reason'), None)
+
+
+def iter_results(path):
+    """Stream the BatchResults of a batch-API results (or error) file, one line at a time."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                line = json.loads(line)
+            except ValueError:
+                print(f"⚠️  {os.path.basename(path)}:{line_number}: not JSON, skipped")
+                continue
+            if not line.get('custom_id'):
+                print(f"⚠️  {os.path.basename(path)}:{line_number}: no custom_id, skipped")
+                continue
+            yield _result(line)
@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+from fake_services import FakeChatServer, FakeLLMProfile, load_canned_mcqs
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baseline.json')
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+STAGES = ('factoids', 'mcqs', 'db')
+
+# Relative change in throughput, p95 latency or peak RSS reported as a regression
+DEFAULT_TOLERANCE = 0.15
+
+# Fine latency buckets (1 ms to ~2 min, 10% apart) so percentiles are within a few percent
+FINE_BUCKETS = tuple(0.001 * 1.1 ** i for i in range(125))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _latency(name):
+    """p50/p95/p99 in ms over every observation of a telemetry histogram."""
+    from telemetry import metrics, Histogram
+    merged = Histogram(FINE_BUCKETS)
+    for entry in metrics.snapshot()['histograms']:
+        if entry['name'] == name:
+            histogram = Histogram.from_dict(entry['value'])
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.count += histogram.count
+            merged.sum += histogram.sum
+    quantile = lambda q: None if not merged.count else round(merged.quantile(q) * 1000, 1)
+    return merged.count, {'p50_ms': quantile(0.5), 'p95_ms': quantile(0.95), 'p99_ms': quantile(0.99)}
+
+
+def _llm_requests():
+    from telemetry import metrics
+    return sum(entry['value'] for entry in metrics.snapshot()['counters']
+               if entry['name'] == 'llm_requests_total' and entry['labels'].get('finish_reason') != 'cached')
+
+
+def bench_factoids(config, canned):
+    """Transcript chunks → factoids through generate_factoids."""
+    from transcribe_pdf import format_page
+    from generate_factoids import chunk_transcript, generate_factoids_for_chunks
+
+    rng = random.Random(config['seed'])
+    explanations = [mcq.get('explanation', '') for mcq in canned.values()]
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as f:
+        for page in range(config['pages']):
+            f.write(format_page(page, '\n\n'.join(rng.sample(explanations, min(30, len(explanations))))))
+        transcript = f.name
+    try:
+        started = time.perf_counter()
+        results = generate_factoids_for_chunks(chunk_transcript(transcript))
+        elapsed = time.perf_counter() - started
+    finally:
+        os.unlink(transcript)
+    return elapsed, sum(len(r) for r in results if r), _latency('llm_request_seconds')[1]
+
+
+def bench_mcqs(config, canned):
+    """Factoids → MCQs through generate_mcqs (batched requests, then individual retries)."""
+    from generate_mcqs import generate_mcqs_for_factoids
+
+    factoids = random.Random(config['seed']).sample(list(canned), min(config['factoids'], len(canned)))
+    started = time.perf_counter()
+    mcqs = generate_mcqs_for_factoids(factoids)
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(1 for mcq in mcqs if mcq), _latency('llm_request_seconds')[1]
+
+
+def bench_db(config, canned):
+    """Import every canned MCQ into the in-memory mcqs collection, then re-sync it unchanged a few times."""
+    from db_utils import get_db
+    from mcq_sync import sync_mcqs
+
+    collection = get_db()['mcqs']
+    by_source = {}
+    for mcq in canned.values():
+        by_source.setdefault(mcq.get('source_file') or 'unknown', []).append(mcq)
+    started = time.perf_counter()
+    written = 0
+    for _ in range(config['db_rounds']):
+        for source_file, mcqs in by_source.items():
+            result = sync_mcqs(collection, mcqs, source_file, source_file.lower())
+            written += result.inserted + result.updated + result.unchanged
+    elapsed = time.perf_counter() - started
+    return elapsed, written, _latency('db_write_seconds')[1]
+
+
+BENCHMARKS = {'factoids': bench_factoids, 'mcqs': bench_mcqs, 'db': bench_db}
+
+
+def _run_stage(stage, config, results):
+    """Child process body: one stage against the fake services, so peak RSS is the stage's own."""
+    from fake_services import use_memory_mongo
+    use_memory_mongo()
+    import telemetry
+    for name in ('llm_request_seconds', 'db_write_seconds'):
+        telemetry.BUCKETS[name] = FINE_BUCKETS
+
+    canned = load_canned_mcqs()
+    devnull = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, devnull  # The pipeline's per-item prints would dominate the timing
+    try:
+        elapsed, items, latency = BENCHMARKS[stage](config, canned)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    requests = _llm_requests()
+    results.put({
+        'stage': stage,
+        'seconds': round(elapsed, 3),
+        'requests': requests,
+        'requests_per_sec': round(requests / elapsed, 2) if requests else None,
+        'items': items,
+        'items_per_min': round(items / elapsed * 60, 1),
+        'latency': latency,
+        'peak_rss_mb': peak_rss_mb(),
+    })
+
+
+def run_benchmarks(config, stages=STAGES):
+    """Run each stage in its own process against one fake chat server; return per-stage results."""
+    profile = FakeLLMProfile(**config['profile'])
+    server = FakeChatServer(profile, seed=config['seed']).start()
+    os.environ.update({
+        'AZURE_OPENAI_ENDPOINT': server.endpoint,
+        'AZURE_OPENAI_API_KEY': 'benchmark',
+        'AZURE_OPENAI_DEPLOYMENT_NAME': 'benchmark',
+        'MONGO_DB_NAME': 'benchmark',
+        'LLM_CACHE_BYPASS': '1',
+        'LLM_CONCURRENCY': str(config['concurrency']),
+    })
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        for stage in stages:
+            print(f"⏱️  Benchmarking {stage}...")
+            queue = context.Queue()
+            process = context.Process(target=_run_stage, args=(stage, config, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0 or queue.empty():
+                print(f"❌ {stage} benchmark failed (exit code {process.exitcode})")
+                continue
+            results[stage] = queue.get()
+    finally:
+        server.stop()
+    return {'config': config, 'server': server.stats, 'stages': results,
+            'created': datetime.utcnow().isoformat() + 'Z'}
+
+
+def compare(run, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regression messages for stages that got slower or bigger than the baseline allows."""
+    if baseline['config'] != run['config']:
+        print("⚠️  Baseline was recorded with different settings; comparison may not be meaningful")
+    regressions = []
+    for stage, current in run['stages'].items():
+        base = baseline['stages'].get(stage)
+        if base is None:
+            continue
+        for field in ('requests_per_sec', 'items_per_min'):
+            if base.get(field) and current.get(field) is not None and current[field] < base[field] * (1 - tolerance):
+                regressions.append(f"{stage}: {field} {current[field]} < baseline {base[field]}")
+        base_p95, p95 = base['latency'].get('p95_ms'), current['latency'].get('p95_ms')
+        if base_p95 and p95 is not None and p95 > base_p95 * (1 + tolerance):
+            regressions.append(f"{stage}: p95 latency {p95} ms > baseline {base_p95} ms")
+        if current['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{stage}: peak RSS {current['peak_rss_mb']} MB > baseline {base['peak_rss_mb']} MB")
+    return regressions
+
+
+def print_results(run):
+    print("\n📊 Benchmark results")
+    print(f"{'stage':<10}{'req/s':>9}{'items/min':>12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RSS MB':>9}")
+    for stage, r in run['stages'].items():
+        latency = r['latency']
+        cells = [r['requests_per_sec'], r['items_per_min'], latency['p50_ms'], latency['p95_ms'],
+                 latency['p99_ms'], r['peak_rss_mb']]
+        print(f"{stage:<10}" + ''.join(f"{'-' if c is None else c:>{w}}" for c, w in zip(cells, (9, 12, 9, 9, 9, 9))))
+    server = run['server']
+    print(f"   Fake LLM: {server['requests']} requests, {server['throttled']} throttled, {server['malformed']} malformed")
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure pipeline throughput offline against a fake chat-completions server and in-memory MongoDB')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"comma-separated subset of {', '.join(STAGES)}")
+    parser.add_argument('--factoids', type=int, default=200, help='factoids sent to the MCQ stage')
+    parser.add_argument('--pages', type=int, default=40, help='transcript pages for the factoid stage')
+    parser.add_argument('--db-rounds', type=int, default=10, help='passes over the canned MCQs in the db stage')
+    parser.add_argument('--concurrency', type=int, default=8, help='LLM requests in flight')
+    parser.add_argument('--latency-median', type=float, default=0.2, help='median fake LLM latency in seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='log-normal spread of the latency')
+    parser.add_argument('--per-token-ms', type=float, default=0.0, help='extra latency per completion token')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='share of MCQ completions that are malformed')
+    parser.add_argument('--retry-after', type=float, default=0.5, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative change treated as a regression')
+    parser.add_argument('--save-baseline', action='store_true', help=f"store this run as {BASELINE_PATH}")
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = [s for s in stages if s not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    config = {
+        'factoids': args.factoids, 'pages': args.pages, 'db_rounds': args.db_rounds, 'concurrency': args.concurrency, 'seed': args.seed,
+        'profile': {
+            'latency_median': args.latency_median, 'latency_sigma': args.latency_sigma,
+            'per_token_seconds': args.per_token_ms / 1000, 'rate_429': args.rate_429,
+            'malformed_rate': args.malformed_rate, 'retry_after': args.retry_after,
+        },
+    }
+
+    run = run_benchmarks(config, stages)
+    print_results(run)
+    results_path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    write_json(results_path, run)
+    print(f"\n💾 Results written to {results_path}")
+
+    if args.save_baseline:
+        write_json(BASELINE_PATH, run)
+        print(f"📌 Saved as the baseline ({BASELINE_PATH})")
+        return 0
+    if not os.path.exists(BASELINE_PATH):
+        print("ℹ️  No baseline yet; rerun with --save-baseline to record one")
+        return 0
+    with open(BASELINE_PATH) as f:
+        regressions = compare(run, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"❌ Regression: {regression}")
+    if not regressions:
+        print("✅ No regressions against the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
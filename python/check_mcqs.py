@@ -1,49 +1,139 @@
-from pymongo import MongoClient
-import os
-from dotenv import load_dotenv
-from pprint import pprint
-
-# Load environment variables
-load_dotenv()
-
-# MongoDB Configuration
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
-
-def check_mcqs():
-    # Initialize MongoDB client
-    client = MongoClient(MONGODB_URI)
-    db = client[MONGO_DB_NAME]
-    mcqs_collection = db['mcqs']
-    
+import sys
+import json
+import argparse
+from db_utils import get_db
+from mcq_parser import CHOICE_COUNT
+
+def _non_empty_string(field):
+    return {'$cond': [
+        {'$eq': [{'$type': field}, 'string']},
+        {'$gt': [{'$strLenCP': {'$trim': {'input': field}}}, 0]},
+        False
+    ]}
+
+# One pass over the mcqs collection: per-bank question counts, choice counts,
+# correct-answer positions and malformed MCQs
+MCQ_REPORT_PIPELINE = [
+    {'$project': {
+        'source_file': 1,
+        'bank_id': 1,
+        'question': 1,
+        'choices': {'$cond': [{'$isArray': '$answerChoices'}, {'$size': '$answerChoices'}, 0]},
+        # Index of the first correct choice, -1 when none is marked correct
+        'correct_position': {'$cond': [
+            {'$isArray': '$answerChoices'},
+            {'$indexOfArray': [{'$map': {'input': '$answerChoices', 'in': '$$this.correct'}}, True]},
+            -1
+        ]},
+        'correct_count': {'$size': {'$filter': {
+            'input': {'$cond': [{'$isArray': '$answerChoices'}, '$answerChoices', []]},
+            'cond': {'$eq': ['$$this.correct', True]}
+        }}},
+        'has_text': {'$and': [_non_empty_string('$question'), _non_empty_string('$explanation')]}
+    }},
+    {'$addFields': {'malformed': {'$cond': [
+        {'$and': [
+            '$has_text',
+            {'$eq': ['$choices', CHOICE_COUNT]},
+            {'$eq': ['$correct_count', 1]}
+        ]}, 0, 1
+    ]}}},
+    {'$group': {
+        '_id': {'source_file': '$source_file', 'position': '$correct_position'},
+        'bank_id': {'$first': '$bank_id'},
+        'sample': {'$first': '$question'},
+        'count': {'$sum': 1},
+        'choices': {'$sum': '$choices'},
+        'malformed': {'$sum': '$malformed'}
+    }},
+    {'$sort': {'_id.position': 1}},
+    {'$group': {
+        '_id': '$_id.source_file',
+        'bank_id': {'$first': '$bank_id'},
+        'sample': {'$first': '$sample'},
+        'questions': {'$sum': '$count'},
+        'choices': {'$sum': '$choices'},
+        'malformed': {'$sum': '$malformed'},
+        'positions': {'$push': {'position': '$_id.position', 'count': '$count'}}
+    }},
+    {'$facet': {
+        'banks': [{'$sort': {'_id': 1}}],
+        'totals': [{'$group': {
+            '_id': None,
+            'banks': {'$sum': 1},
+            'questions': {'$sum': '$questions'},
+            'malformed': {'$sum': '$malformed'}
+        }}]
+    }}
+]
+
+def build_report(db):
+    """Collection sizes plus per-bank MCQ stats, from one aggregation over mcqs."""
+    collections = {name: db[name].estimated_document_count() for name in db.list_collection_names()}
+    result = next(db['mcqs'].aggregate(MCQ_REPORT_PIPELINE, allowDiskUse=True), {'banks': [], 'totals': []})
+
+    banks = []
+    for bank in result['banks']:
+        banks.append({
+            'source_file': bank['_id'],
+            'bank_id': bank.get('bank_id'),
+            'questions': bank['questions'],
+            'avg_choices': round(bank['choices'] / bank['questions'], 2),
+            # Position (0 = A) -> count; "none" counts questions with no correct choice
+            'correct_positions': {
+                ('none' if p['position'] < 0 else str(p['position'])): p['count'] for p in bank['positions']
+            },
+            'malformed': bank['malformed'],
+            'sample_question': str(bank.get('sample') or '')[:100]
+        })
+    totals = result['totals'][0] if result['totals'] else {'banks': 0, 'questions': 0, 'malformed': 0}
+    totals.pop('_id', None)
+    return {'collections': collections, 'totals': totals, 'banks': banks}
+
+def print_report(report):
     print("\n📊 MCQ Database Summary:")
     print("------------------------")
-    
-    # Show all collections first
+
     print("\n📁 Collections in Database:")
-    collections = db.list_collection_names()
-    for collection in collections:
-        count = db[collection].count_documents({})
-        print(f"- {collection}: {count} documents")
-    
-    # Show all unique source files and their counts
+    for collection, count in report['collections'].items():
+        print(f"- {collection}: ~{count} documents")
+
     print("\n🔍 All MCQ Source Files:")
     print("------------------------")
-    all_sources = mcqs_collection.distinct('source_file')
-    
-    if not all_sources:
+    if not report['banks']:
         print("No MCQs found in database!")
+        return
+
+    for bank in report['banks']:
+        source = bank['source_file']
+        positions = ', '.join(
+            f"{chr(ord('A') + int(p)) if p != 'none' else 'none'}: {count}"
+            for p, count in bank['correct_positions'].items()
+        )
+        print(f"\n📚 Source: {source} (bank {bank['bank_id']})")
+        print(f"   Questions: {bank['questions']}")
+        print(f"   Average choices: {bank['avg_choices']}")
+        print(f"   Correct answer positions: {positions}")
+        if bank['malformed']:
+            print(f"   ⚠️  Malformed MCQs: {bank['malformed']}")
+        print(f"   Sample Question: {bank['sample_question']}...")
+        escaped = source.replace(':', '\\:') if source else source
+        print(f"   Source File Pattern: {escaped}")  # Show exact pattern to match
+
+    totals = report['totals']
+    print(f"\n✅ {totals['questions']} questions in {totals['banks']} banks, {totals['malformed']} malformed")
+
+def check_mcqs(as_json=False):
+    """Print the report; return True when there are MCQs and none are malformed."""
+    report = build_report(get_db())
+    if as_json:
+        print(json.dumps(report, indent=2, default=str))
     else:
-        for source in all_sources:
-            count = mcqs_collection.count_documents({'source_file': source})
-            print(f"\n📚 Source: {source}")
-            print(f"   Questions: {count}")
-            
-            # Show a sample question from each source
-            if count > 0:
-                sample = mcqs_collection.find_one({'source_file': source})
-                print(f"   Sample Question: {sample['question'][:100]}...")
-                print(f"   Source File Pattern: {source.replace(':', '\\:')}") # Show exact pattern to match
+        print_report(report)
+    return report['totals']['questions'] > 0 and report['totals']['malformed'] == 0
 
 if __name__ == "__main__":
-    check_mcqs() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Summarize the MCQ banks stored in MongoDB')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON (for health checks)')
+    args = parser.parse_args()
+    sys.exit(0 if check_mcqs(as_json=args.json) else 1)
@@ -1,21 +1,219 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from bson import ObjectId
 import os
+import time
+import queue
+import atexit
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
+import telemetry
 
 load_dotenv()
 
+# Connections kept by the process-wide client
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+
+# Write-behind buffers flush this many documents at once, or after this many seconds
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_SECONDS = float(os.getenv("DB_WRITE_FLUSH_SECONDS", "1.0"))
+
+# Documents a buffer holds before add() blocks until the writer catches up
+WRITE_QUEUE_SIZE = int(os.getenv("DB_WRITE_QUEUE_SIZE", "10000"))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide MongoClient; its connection pool is shared by every caller and thread."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(os.getenv('MONGODB_URI'), maxPoolSize=MONGO_MAX_POOL_SIZE)
+    return _client
+
 def get_db():
-    client = MongoClient(os.getenv('MONGODB_URI'))
-    return client[os.getenv('MONGO_DB_NAME')]
+    return get_client()[os.getenv('MONGO_DB_NAME')]
+
+# Queue markers for the writer thread
+_FLUSH = object()
+_STOP = object()
+
+class WriteBehindBuffer:
+    """Collects documents and writes them from a background thread in batches.
+
+    `write(items)` is called with up to batch_size items whenever the batch
+    fills, flush_seconds pass, flush() is called, or the process exits.
+    Callers return as soon as the item is queued. A full queue makes add()
+    wait for the writer instead of growing without bound. Failed batches are
+    reported and counted, not retried.
+    """
+
+    def __init__(self, write, name, batch_size=None, flush_seconds=None, max_queue=None):
+        self.name = name
+        self.batch_size = batch_size or WRITE_BATCH_SIZE
+        self.flush_seconds = WRITE_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.written = 0
+        self.failed = 0
+        self.last_error = None
+        self._write = write
+        self._queue = queue.Queue(max_queue or WRITE_QUEUE_SIZE)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, item, on_written=None):
+        """Queue one item. `on_written(items)` is called from the writer thread once it is stored."""
+        if self._closed:
+            raise RuntimeError(f"{self.name} write buffer is closed")
+        try:
+            self._queue.put_nowait((item, on_written))
+        except queue.Full:
+            print(f"⚠️  {self.name} write buffer is full; waiting for the database to catch up")
+            self._queue.put((item, on_written))
+
+    def flush(self):
+        """Write everything queued so far and wait until it is stored (or has failed)."""
+        if not self._closed:
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        """Flush remaining items and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(deadline - time.monotonic(), 0)
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # The oldest item in the batch has waited flush_seconds
+                self._write_batch(batch)
+                batch = []
+                continue
+
+            if entry is _FLUSH or entry is _STOP:
+                self._write_batch(batch)
+                batch = []
+                self._queue.task_done()
+                if entry is _STOP:
+                    return
+                continue
+
+            if not batch:
+                deadline = time.monotonic() + self.flush_seconds
+            batch.append(entry)
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = []
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        try:
+            self._write(items)
+            self.written += len(items)
+        except Exception as e:
+            self.failed += len(items)
+            self.last_error = e
+            print(f"❌ {self.name}: failed to write {len(items)} documents: {str(e)}")
+        else:
+            callbacks = {}
+            for item, on_written in batch:
+                if on_written is not None:
+                    callbacks.setdefault(on_written, []).append(item)
+            for on_written, written in callbacks.items():
+                try:
+                    on_written(written)
+                except Exception as e:
+                    print(f"❌ {self.name}: post-write callback failed: {str(e)}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'written': self.written, 'failed': self.failed}
+
+_answer_buffer = None
+_answer_buffer_lock = threading.Lock()
+
+def _insert_incorrect_answers(answers):
+    with telemetry.timed('db_write_seconds', collection='incorrect_answers'):
+        get_db()['incorrect_answers'].insert_many(answers, ordered=False)
+    telemetry.increment('db_documents_written_total', len(answers), collection='incorrect_answers')
+
+def get_answer_buffer():
+    global _answer_buffer
+    if _answer_buffer is None:
+        with _answer_buffer_lock:
+            if _answer_buffer is None:
+                _answer_buffer = WriteBehindBuffer(_insert_incorrect_answers, 'incorrect_answers')
+    return _answer_buffer
 
 def log_incorrect_answer(mcq_id, factoid, user_id):
-    db = get_db()
-    collection = db['incorrect_answers']
-    
-    collection.insert_one({
+    """Queue an incorrect answer; it reaches MongoDB with the next batched insert."""
+    get_answer_buffer().add({
         'mcq_id': mcq_id,
         'factoid': factoid,
         'userId': user_id,
         'timestamp': datetime.utcnow()
-    })
\ No newline at end of file
+    })
+
+# Newest-first listing, overall and per user; (timestamp, _id) makes the order total
+INCORRECT_ANSWER_INDEXES = [
+    [('timestamp', DESCENDING), ('_id', DESCENDING)],
+    [('userId', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+]
+
+INCORRECT_ANSWER_FIELDS = ['mcq_id', 'factoid', 'userId', 'timestamp']
+
+# SM-2 review cards (see review_scheduler.py), loaded per user
+REVIEW_COLLECTION = 'review_schedule'
+REVIEW_INDEXES = [
+    [('userId', ASCENDING), ('due', ASCENDING)],
+]
+
+def ensure_indexes():
+    """Create the indexes the API queries rely on; a no-op when they already exist."""
+    collection = get_db()['incorrect_answers']
+    for keys in INCORRECT_ANSWER_INDEXES:
+        collection.create_index(keys)
+    for keys in REVIEW_INDEXES:
+        get_db()[REVIEW_COLLECTION].create_index(keys)
+
+def iter_incorrect_answers(user_id=None, after=None, limit=100, fields=None):
+    """Yield incorrect answers newest first, one page at a time from an index.
+
+    `after` is the (timestamp, _id) of the last answer on the previous page.
+    Up to limit + 1 documents are yielded so callers can tell whether
+    another page follows.
+    """
+    query = {}
+    if user_id is not None:
+        query['userId'] = user_id
+    if after is not None:
+        timestamp, last_id = after
+        query['$or'] = [
+            {'timestamp': {'$lt': timestamp}},
+            {'timestamp': timestamp, '_id': {'$lt': ObjectId(last_id)}}
+        ]
+    projection = {field: 1 for field in (fields or INCORRECT_ANSWER_FIELDS)}
+    projection['timestamp'] = 1
+    cursor = get_db()['incorrect_answers'].find(query, projection) \
+        .sort([('timestamp', DESCENDING), ('_id', DESCENDING)]) \
+        .limit(limit + 1) \
+        .batch_size(min(limit + 1, 500))
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
@@ -0,0 +1,124 @@
+import os
+import re
+import hashlib
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Factoids whose shingle sets have at least this Jaccard similarity are duplicates
+DEDUP_THRESHOLD = float(os.getenv("FACTOID_DEDUP_THRESHOLD", "0.8"))
+
+NUM_PERM = 64
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+ENUMERATION = re.compile(r'^\s*(?:\(?\d+[.)]|[-*•])\s+')
+NON_WORD = re.compile(r'[^\w\s]')
+WHITESPACE = re.compile(r'\s+')
+
+
+def _permutations(num_perm, seed=1):
+    """Deterministic (a, b) pairs for the universal hashes (a*x + b) mod p."""
+    params = []
+    for i in range(num_perm):
+        digest = hashlib.blake2b(f"{seed}:{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], 'little') % (_MERSENNE_PRIME - 1) + 1
+        b = int.from_bytes(digest[8:], 'little') % _MERSENNE_PRIME
+        params.append((a, b))
+    return params
+
+
+_PERMUTATIONS = _permutations(NUM_PERM)
+
+
+def clean_factoid(factoid):
+    """Strip leading enumeration or bullets ("1. ", "- ") and surrounding whitespace."""
+    return ENUMERATION.sub('', factoid).strip()
+
+
+def shingles(factoid):
+    """Character shingles of the normalized factoid text."""
+    text = WHITESPACE.sub(' ', NON_WORD.sub(' ', clean_factoid(factoid).lower())).strip()
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little')
+              for s in shingle_set]
+    return [min([(a * h + b) % _MERSENNE_PRIME for h in hashes]) & _MAX_HASH for a, b in _PERMUTATIONS]
+
+
+def choose_bands(threshold, num_perm=NUM_PERM, recall=0.95):
+    """Pick the most selective (bands, rows) split that still finds pairs at the threshold.
+
+    A pair with similarity s shares at least one bucket with probability
+    1 - (1 - s**rows)**bands. Candidates are verified with exact Jaccard, so a
+    looser split only costs extra comparisons while a tighter one would miss
+    duplicates.
+    """
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    for bands, rows in options:
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            return bands, rows
+    return options[-1]
+
+
+class NearDuplicateFilter:
+    """Incrementally keeps the first of each group of near-duplicate factoids.
+
+    Each factoid's MinHash signature is split into bands. Only factoids that
+    share a band bucket are compared exactly, so the cost grows roughly
+    linearly with the number of factoids.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = DEDUP_THRESHOLD if threshold is None else threshold
+        self.bands, self.rows = choose_bands(self.threshold)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._kept_shingles = []
+        self.kept = 0
+        self.dropped = 0
+
+    def add(self, factoid):
+        """Return the cleaned factoid if it is new, or None if it duplicates one already kept."""
+        cleaned = clean_factoid(factoid)
+        if not cleaned:
+            self.dropped += 1
+            return None
+        shingle_set = shingles(cleaned)
+        signature = minhash(shingle_set)
+        keys = [tuple(signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+        candidates = set()
+        for bucket, key in zip(self._buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        for candidate in candidates:
+            other = self._kept_shingles[candidate]
+            if len(shingle_set & other) / len(shingle_set | other) >= self.threshold:
+                self.dropped += 1
+                return None
+
+        index = len(self._kept_shingles)
+        self._kept_shingles.append(shingle_set)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(index)
+        self.kept += 1
+        return cleaned
+
+
+def dedupe_factoids(factoids, threshold=None):
+    """Clean factoids and drop near-duplicates, keeping first occurrences in order.
+
+    Returns (kept_factoids, dropped_count).
+    """
+    dedup_filter = NearDuplicateFilter(threshold)
+    kept = [cleaned for cleaned in map(dedup_filter.add, factoids) if cleaned is not None]
+    if dedup_filter.dropped:
+        print(f"🧹 Dropped {dedup_filter.dropped}/{len(factoids)} duplicate or near-duplicate factoids "
+              f"(threshold {dedup_filter.threshold})")
+    return kept, dedup_filter.dropped
@@ -0,0 +1,316 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import threading
+import http.server
+from collections import namedtuple
+from mcq_bank import iter_bank
+
+# Canned responses come from the finished banks shipped with the repo
+CANNED_BANK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'COMPLETED_MCQS')
+
+# Factoid lines returned for one transcript chunk
+FACTOIDS_PER_CHUNK = 40
+
+# How the fake chat-completions server behaves; latency is log-normal around latency_median
+FakeLLMProfile = namedtuple('FakeLLMProfile', [
+    'latency_median', 'latency_sigma', 'per_token_seconds', 'rate_429', 'malformed_rate', 'retry_after'
+])
+DEFAULT_PROFILE = FakeLLMProfile(latency_median=0.2, latency_sigma=0.5, per_token_seconds=0.0,
+                                 rate_429=0.0, malformed_rate=0.0, retry_after=0.5)
+
+NUMBERED_FACTOID = re.compile(r'^\d+\.\s+"(.*)"$', re.MULTILINE)
+SINGLE_FACTOID = re.compile(r'Factoid:\s+"(.*)"', re.DOTALL)
+
+
+def load_canned_mcqs(bank_dir=None):
+    """Every MCQ in the canned banks, keyed by factoid."""
+    bank_dir = bank_dir or CANNED_BANK_DIR
+    mcqs = {}
+    for name in sorted(os.listdir(bank_dir)):
+        if name.endswith(('_mcqs.json', '_mcqs.jsonl')):
+            for mcq in iter_bank(os.path.join(bank_dir, name)):
+                if mcq.get('factoid') and mcq.get('question'):
+                    mcqs.setdefault(mcq['factoid'], mcq)
+    return mcqs
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class FakeChatServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for the Azure OpenAI chat completions endpoint.
+
+    Factoid prompts get factoid lines and MCQ prompts (single or numbered
+    batches) get MCQs, both replayed from the canned banks. Each response is
+    delayed by a sampled latency; a share of requests is answered with 429
+    and Retry-After, and a share of MCQ completions is truncated or wrapped
+    in prose, as the real model sometimes does. Point AZURE_OPENAI_ENDPOINT
+    at `endpoint` to use it.
+    """
+    daemon_threads = True
+
+    def __init__(self, profile=DEFAULT_PROFILE, canned=None, seed=None, port=0):
+        super().__init__(('127.0.0.1', port), FakeChatHandler)
+        self.profile = profile
+        self.canned = canned if canned is not None else load_canned_mcqs()
+        self.factoids = list(self.canned)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'throttled': 0, 'malformed': 0}
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-llm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def draw(self):
+        """(throttle, malformed, latency seconds) for one request."""
+        profile = self.profile
+        with self.lock:
+            self.stats['requests'] += 1
+            throttle = self.rng.random() < profile.rate_429
+            malformed = self.rng.random() < profile.malformed_rate
+            latency = profile.latency_median * math.exp(profile.latency_sigma * self.rng.gauss(0, 1))
+            if throttle:
+                self.stats['throttled'] += 1
+            return throttle, malformed, latency
+
+    def mcq_for(self, factoid):
+        mcq = self.canned.get(factoid)
+        if mcq is None:
+            with self.lock:
+                mcq = self.canned[self.rng.choice(self.factoids)]
+        mcq = {key: mcq[key] for key in ('question', 'answerChoices', 'explanation') if key in mcq}
+        return dict(mcq, factoid=factoid)
+
+    def complete(self, messages, malformed):
+        """(content, finish_reason) for a chat request."""
+        system = messages[0].get('content', '') if messages else ''
+        prompt = messages[-1].get('content', '') if messages else ''
+        if 'multiple choice questions' not in system:
+            with self.lock:
+                factoids = self.rng.sample(self.factoids, min(FACTOIDS_PER_CHUNK, len(self.factoids)))
+            return '\n'.join(f"- {factoid}" for factoid in factoids), 'stop'
+
+        batch = NUMBERED_FACTOID.findall(prompt)
+        if batch:
+            content = json.dumps([dict(self.mcq_for(factoid), index=i) for i, factoid in enumerate(batch, 1)],
+                                 indent=2)
+        else:
+            match = SINGLE_FACTOID.search(prompt)
+            content = json.dumps(self.mcq_for(match.group(1) if match else ''), indent=2)
+        if not malformed:
+            return content, 'stop'
+        with self.lock:
+            self.stats['malformed'] += 1
+            truncate = self.rng.random() < 0.5
+        if truncate:
+            return content[:len(content) * 2 // 3], 'length'
+        return f"Here is the MCQ you asked for:\n{content.replace('},', '}')}", 'stop'
+
+
+class FakeChatHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        server = self.server
+        throttle, malformed, latency = server.draw()
+        if throttle:
+            retry_after = server.profile.retry_after
+            return self.send_json(429, {'error': {'code': '429', 'message': 'Rate limit exceeded (fake)'}}, [
+                ('Retry-After', str(max(1, math.ceil(retry_after)))),
+                ('retry-after-ms', str(int(retry_after * 1000))),
+            ])
+
+        messages = request.get('messages', [])
+        content, finish_reason = server.complete(messages, malformed)
+        prompt_tokens = sum(_estimate_tokens(m.get('content', '')) for m in messages)
+        completion_tokens = _estimate_tokens(content)
+        time.sleep(latency + completion_tokens * server.profile.per_token_seconds)
+        self.send_json(200, {
+            'id': f"chatcmpl-fake-{server.stats['requests']}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': finish_reason
+            }],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens}
+        })
+
+
+def _matches(doc, query):
+    """The subset of MongoDB query semantics the pipeline and server use."""
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(_matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(condition, dict) and any(op.startswith('$') for op in condition):
+            for op, operand in condition.items():
+                if op == '$in' and value not in operand:
+                    return False
+                if op == '$lt' and not (value is not None and value < operand):
+                    return False
+                if op == '$gt' and not (value is not None and value > operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    return {key: doc[key] for key in set(projection) | {'_id'} if key in doc}
+
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self._docs.sort(key=lambda doc: (doc.get(key) is not None, doc.get(key)), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self._docs = self._docs[:n] if n else self._docs
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter(self._docs)
+
+
+class MemoryCollection:
+    """Dict-backed collection supporting the calls made by db_utils, mcq_sync and review_scheduler."""
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _new_id(self):
+        self._next_id += 1
+        return f"{self._next_id:024x}"
+
+    def find(self, query=None, projection=None):
+        with self._lock:
+            docs = [_project(doc, projection) for doc in self.docs.values() if _matches(doc, query or {})]
+        return MemoryCursor(docs)
+
+    def insert_many(self, documents, ordered=True):
+        with self._lock:
+            for doc in documents:
+                doc.setdefault('_id', self._new_id())
+                self.docs[doc['_id']] = dict(doc)
+
+    def bulk_write(self, operations, ordered=True):
+        # pymongo's write models keep their arguments in _filter / _doc / _upsert
+        with self._lock:
+            for op in operations:
+                kind = type(op).__name__
+                if kind == 'InsertOne':
+                    doc = dict(op._doc)
+                    doc.setdefault('_id', self._new_id())
+                    self.docs[doc['_id']] = doc
+                elif kind in ('UpdateOne', 'ReplaceOne'):
+                    target = next((doc for doc in self.docs.values() if _matches(doc, op._filter)), None)
+                    if target is None and not op._upsert:
+                        continue
+                    if kind == 'ReplaceOne':
+                        doc = dict(op._doc)
+                        doc.setdefault('_id', target['_id'] if target else op._filter.get('_id', self._new_id()))
+                    else:
+                        doc = dict(target or {'_id': op._filter.get('_id', self._new_id())})
+                        doc.update(op._doc.get('$set', {}))
+                    self.docs[doc['_id']] = doc
+                elif kind == 'DeleteMany':
+                    for doc_id in [i for i, doc in self.docs.items() if _matches(doc, op._filter)]:
+                        del self.docs[doc_id]
+                else:
+                    raise NotImplementedError(f"{kind} is not supported by the in-memory collection")
+
+    def create_index(self, keys, **kwargs):
+        return '_'.join(f"{key}_{direction}" for key, direction in keys)
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def list_collection_names(self):
+        return list(self._collections)
+
+
+class MemoryClient:
+    """In-process stand-in for MongoClient; install it with use_memory_mongo()."""
+
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase()
+        return self._databases[name]
+
+    def close(self):
+        pass
+
+
+def use_memory_mongo():
+    """Make db_utils.get_db() return an in-memory database for this process.
+
+    Call it before importing modules that bind collections at import time
+    (generate_mcqs).
+    """
+    import db_utils
+    db_utils._client = MemoryClient()
+    return db_utils._client
@@ -1,21 +1,29 @@
 import os
-from openai import AzureOpenAI
+import argparse
 from dotenv import load_dotenv
 import json
 from datetime import datetime
+from llm_executor import build_request, run_prompts
+from llm_cache import print_cache_stats, get_cache, make_cache_key, CACHE_BYPASS
+from batch_api import make_custom_id, split_custom_id, write_requests, iter_results, BATCH_DIR
+from pipeline_manifest import hash_text
+from text_chunker import iter_chunks
+from factoid_dedup import dedupe_factoids
+import telemetry
 
 # Load environment variables
 load_dotenv()
 
-# Azure OpenAI Configuration
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-15-preview",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
-
+# Azure OpenAI Configuration (requests are sent through llm_executor)
 DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 
+# Token budget per transcript chunk, and how much of each chunk is repeated in the next
+CHUNK_TOKENS = int(os.getenv("FACTOID_CHUNK_TOKENS", "24000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("FACTOID_CHUNK_OVERLAP_TOKENS", "200"))
+
+# Maximum number of factoids kept per source file across all chunks
+MAX_FACTOIDS = 100
+
 # System message prompt (persistent instructions)
 SYSTEM_MESSAGE = {
     "role": "system",
@@ -29,72 +37,168 @@ SYSTEM_MESSAGE = {
     )
 }
 
+def build_factoid_request(chunk):
+    """Build the chat completion request for one chunk of transcript text."""
+    user_prompt = {
+        "role": "user",
+        "content": (
+            "Below is a block of text extracted from a resource who has curated a high-yield document for a given subject for student preparation for the USMLE STEP 1 exam. The author has already done a great job at only including high yield information, so now I want to have a way of actively engaging with the material via MCQs. To do so, I need to effectively convert this document into testable chunks of information that I can reasonably go through and convert into MCQs. I don't want to be doing thousands of questions per document, I would like to keep it at hundreds max. "
+            "Please convert all testable information into a list of factoids as described in the instructions -- Avoid redundancy but the entirety of the document should be covered and addressed accordingly.\n\n"
+            f"[BEGIN TEXT]\n{chunk}\n[END TEXT]"
+        )
+    }
+    return build_request(SYSTEM_MESSAGE, user_prompt, model=DEPLOYMENT_NAME, temperature=0.0)
+
+def parse_factoid_completion(completion):
+    """Split a factoid completion into cleaned factoid lines."""
+    chunk_factoids = []
+    for line in completion.split('\n'):
+        line = line.strip()
+        # Remove bullet points and other markers
+        line = line.lstrip('- ').lstrip('* ').lstrip('• ')
+        if line and not line.startswith(('Note:', 'Example:', 'Remember:')):
+            chunk_factoids.append(line)
+    return chunk_factoids
+
+def chunk_transcript(file_path):
+    """Token-packed, page-aligned chunks of a transcript file."""
+    return list(iter_chunks(file_path, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS))
+
+def generate_factoids_for_chunks(chunks):
+    """Generate factoids for each chunk concurrently.
+
+    Returns a list aligned with `chunks` holding each chunk's factoids, or
+    None for chunks whose request failed.
+    """
+    print(f"Processing {len(chunks)} chunks concurrently...")
+    with telemetry.stage('factoids'):
+        results = run_prompts([build_factoid_request(chunk.text) for chunk in chunks])
+    for chunk, result in zip(chunks, results):
+        if result.error is not None:
+            print(f"❌ Chunk {chunk.index + 1} (pages {chunk.start_page}–{chunk.end_page}) failed: {str(result.error)}")
+    return [parse_factoid_completion(r.content) if r.content else None for r in results]
+
+def write_factoids_file(file_path, output_dir, factoids):
+    """Write the factoids JSON for a transcript, capped at MAX_FACTOIDS, and return its path."""
+    output_file = os.path.join(
+        output_dir,
+        f"{os.path.splitext(os.path.basename(file_path))[0]}_factoids.json"
+    )
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            "source_file": os.path.basename(file_path),
+            "factoids": factoids[:MAX_FACTOIDS]
+        }, f, indent=2, ensure_ascii=False)
+
+    return output_file
+
 def process_text_file(file_path, output_dir):
     """Process a single text file and generate factoids."""
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text_content = f.read()
+        chunks = chunk_transcript(file_path)
 
-        # Split text into chunks of roughly 100k characters
-        chunk_size = 100000
-        chunks = [text_content[i:i + chunk_size] for i in range(0, len(text_content), chunk_size)]
-        
         all_factoids = []
-        for i, chunk in enumerate(chunks):
-            print(f"Processing chunk {i+1}/{len(chunks)}...")
-            
-            user_prompt = {
-                "role": "user",
-                "content": (
-                    "Below is a block of text extracted from a resource who has curated a high-yield document for a given subject for student preparation for the USMLE STEP 1 exam. The author has already done a great job at only including high yield information, so now I want to have a way of actively engaging with the material via MCQs. To do so, I need to effectively convert this document into testable chunks of information that I can reasonably go through and convert into MCQs. I don't want to be doing thousands of questions per document, I would like to keep it at hundreds max. "
-                    "Please convert all testable information into a list of factoids as described in the instructions -- Avoid redundancy but the entirety of the document should be covered and addressed accordingly.\n\n"
-                    f"[BEGIN TEXT]\n{chunk}\n[END TEXT]"
-                )
-            }
-
-            response = client.chat.completions.create(
-                model=DEPLOYMENT_NAME,
-                messages=[SYSTEM_MESSAGE, user_prompt],
-                max_tokens=2048,
-                temperature=0.0,
-                top_p=1.0
-            )
-
-            # Extract and clean the factoids from this chunk
-            completion = response.choices[0].message.content
-            
-            # Split by newlines and clean up
-            chunk_factoids = []
-            for line in completion.split('\n'):
-                line = line.strip()
-                # Remove bullet points and other markers
-                line = line.lstrip('- ').lstrip('* ').lstrip('• ')
-                if line and not line.startswith(('Note:', 'Example:', 'Remember:')):
-                    chunk_factoids.append(line)
-            
-            all_factoids.extend(chunk_factoids)
+        for chunk_factoids in generate_factoids_for_chunks(chunks):
+            if chunk_factoids:
+                all_factoids.extend(chunk_factoids)
+
+        # Drop near-duplicates, then limit to maximum 100 factoids from all chunks combined
+        all_factoids, _ = dedupe_factoids(all_factoids)
+        all_factoids = all_factoids[:MAX_FACTOIDS]
 
-        # Limit to maximum 100 factoids from all chunks combined
-        all_factoids = all_factoids[:100]
-        
         # Save to JSON file
-        output_file = os.path.join(
-            output_dir,
-            f"{os.path.splitext(os.path.basename(file_path))[0]}_factoids.json"
-        )
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                "source_file": os.path.basename(file_path),
-                "factoids": all_factoids
-            }, f, indent=2, ensure_ascii=False)
-        
+        write_factoids_file(file_path, output_dir, all_factoids)
+
         return all_factoids
 
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
         return None
 
+def chunk_custom_id(text_file, chunk):
+    """Batch custom_id of a transcript chunk: the transcript file plus a hash of the chunk text."""
+    return make_custom_id('factoids', text_file, hash_text(chunk.text)[:24])
+
+def _factoids_current(file_path, output_dir):
+    output_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(file_path))[0]}_factoids.json")
+    return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(file_path)
+
+def export_factoid_batch(batch_path, input_dir="python/transcribed", output_dir="python/factoids"):
+    """Write a batch-API request file with one line per pending transcript chunk.
+
+    Chunks whose completion is already in the LLM cache are skipped; with the
+    cache bypassed, so are transcripts whose factoids file is newer.
+    """
+    cache = None if CACHE_BYPASS else get_cache()
+
+    def pending():
+        for text_file in sorted(f for f in os.listdir(input_dir) if f.endswith('.txt')):
+            file_path = os.path.join(input_dir, text_file)
+            if cache is None and _factoids_current(file_path, output_dir):
+                continue
+            for chunk in chunk_transcript(file_path):
+                request = build_factoid_request(chunk.text)
+                if cache is None or cache.get(make_cache_key(request)) is None:
+                    yield chunk_custom_id(text_file, chunk), request
+
+    count = write_requests(batch_path, pending())
+    print(f"📤 Wrote {count} factoid requests to {batch_path}")
+    return count
+
+def ingest_factoid_batch(results_path, input_dir="python/transcribed", output_dir="python/factoids"):
+    """Build factoids files from a batch-API results file, matching lines to chunks by custom_id.
+
+    Valid completions are also stored in the LLM cache, so a later export
+    only asks again for the chunks that failed and a live run reuses them.
+    Returns the paths of the factoids files written.
+    """
+    cache = None if CACHE_BYPASS else get_cache()
+    by_source = {}
+    failed = 0
+    for result in iter_results(results_path):
+        try:
+            kind, text_file, key = split_custom_id(result.custom_id)
+        except ValueError:
+            kind = None
+        if kind != 'factoids':
+            continue
+        factoids = parse_factoid_completion(result.content) if result.content else []
+        if not factoids:
+            print(f"❌ {result.custom_id}: {result.error or 'no factoids in completion'}")
+            failed += 1
+            continue
+        by_source.setdefault(text_file, {})[key] = (result.content, factoids)
+
+    written = []
+    for text_file, results in by_source.items():
+        file_path = os.path.join(input_dir, text_file)
+        if not os.path.exists(file_path):
+            print(f"❌ {text_file}: transcript not found in {input_dir}, results skipped")
+            continue
+        all_factoids = []
+        missing = 0
+        for chunk in chunk_transcript(file_path):
+            request = build_factoid_request(chunk.text)
+            content, chunk_factoids = results.get(hash_text(chunk.text)[:24], (None, None))
+            if content is not None and cache is not None:
+                cache.put(make_cache_key(request), content)
+            elif content is None:
+                cached = cache.get(make_cache_key(request)) if cache is not None else None
+                chunk_factoids = parse_factoid_completion(cached) if cached else None
+            if chunk_factoids is None:
+                missing += 1
+                continue
+            all_factoids.extend(chunk_factoids)
+
+        all_factoids, _ = dedupe_factoids(all_factoids)
+        written.append(write_factoids_file(file_path, output_dir, all_factoids))
+        print(f"✅ {text_file}: {len(all_factoids[:MAX_FACTOIDS])} factoids"
+              + (f" ({missing} chunks still missing; export again to retry them)" if missing else ""))
+    if failed:
+        print(f"❌ {failed} results failed")
+    return written
+
 def save_factoids(filename, factoids):
     """Save factoids to a JSON file with timestamp."""
     output_dir = "2_factoids"
@@ -125,12 +229,26 @@ def main(input_dir="python/transcribed", output_dir="python/factoids"):
     for text_file in text_files:
         print(f"\nProcessing {text_file}...")
         file_path = os.path.join(input_dir, text_file)
-        factoids = process_text_file(file_path, output_dir)
+        with telemetry.run(os.path.splitext(text_file)[0]):
+            factoids = process_text_file(file_path, output_dir)
         
         if factoids:
             print(f"✅ Successfully generated factoids for {text_file}")
         else:
             print(f"❌ Failed to generate factoids for {text_file}")
 
+    print_cache_stats()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate factoids from transcribed text files.")
+    parser.add_argument('--batch-export', metavar='PATH', nargs='?', const=os.path.join(BATCH_DIR, 'factoids_requests.jsonl'),
+                        help="write pending chunk prompts as a batch-API request file instead of calling the API")
+    parser.add_argument('--batch-ingest', metavar='PATH',
+                        help="build factoids files from a batch-API results file")
+    args = parser.parse_args()
+    if args.batch_export:
+        export_factoid_batch(args.batch_export)
+    elif args.batch_ingest:
+        ingest_factoid_batch(args.batch_ingest)
+    else:
+        main() 
\ No newline at end of file
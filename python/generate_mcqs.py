@@ -1,34 +1,42 @@
 import os
 import json
 import uuid
-from openai import AzureOpenAI
+import argparse
 from dotenv import load_dotenv
-from datetime import datetime
-import time
 import requests
-from pymongo import MongoClient
+from db_utils import get_db, WriteBehindBuffer
+from llm_executor import build_request, run_prompts
+from llm_cache import print_cache_stats, forget_request
+from mcq_parser import parse_mcq, parse_mcq_array, print_parse_stats, FailureReason
+from mcq_journal import MCQJournal, factoid_hash
+from factoid_dedup import dedupe_factoids
+from mcq_sync import sync_mcqs
+from mcq_bank import BankWriter, sync_bank, is_jsonl, iter_bank, derive_bank_id
+from batch_api import make_custom_id, split_custom_id, write_requests, iter_results, BATCH_DIR
+from search_index import update_search_index
+import telemetry
 
 # Load environment variables
 load_dotenv()
 
-# MongoDB Configuration
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
+# MongoDB collection, on the process-wide pooled client
+mcqs_collection = get_db()['mcqs']
 
-# Initialize MongoDB client
-client = MongoClient(MONGODB_URI)
-db = client[MONGO_DB_NAME]
-mcqs_collection = db['mcqs']
-
-# Azure OpenAI Configuration
-azure_client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-15-preview",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
+# Background writer for MCQs generated in batches; created on first use
+_mcq_writer = None
 
+# Azure OpenAI Configuration (requests are sent through llm_executor)
 DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "Notes_Test_1")
 
+# Number of factoids generated concurrently before each database save
+MCQ_BATCH_SIZE = int(os.getenv("MCQ_BATCH_SIZE", "50"))
+
+# Factoids sent in one completion request (1 = one request per factoid)
+FACTOIDS_PER_REQUEST = int(os.getenv("MCQ_FACTOIDS_PER_REQUEST", "5"))
+
+# Completion tokens budgeted per MCQ in a batched request
+TOKENS_PER_MCQ = 700
+
 # System message (instructions)
 SYSTEM_MESSAGE = {
     "role": "system",
@@ -60,135 +68,262 @@ SYSTEM_MESSAGE = {
     )
 }
 
+# Batched requests reuse the same instructions and ask for an array back
+BATCH_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": SYSTEM_MESSAGE["content"] + (
+        "\n\nWhen given several numbered factoids, respond with a JSON array containing exactly one MCQ "
+        "object per factoid, in the same order as the factoids, and nothing else. Each object must also "
+        "have an 'index' field holding its factoid's number, and its 'factoid' field must repeat that "
+        "factoid exactly."
+    )
+}
+
+def build_mcq_request(factoid, max_tokens=2048):
+    """Build the chat completion request for a single factoid."""
+    user_message = {
+        "role": "user",
+        "content": f'Create a single MCQ based on the following factoid:\n\nFactoid: "{factoid}"'
+    }
+    return build_request(SYSTEM_MESSAGE, user_message, model=DEPLOYMENT_NAME, max_tokens=max_tokens, temperature=0.7)
+
+def build_mcq_batch_request(factoids):
+    """Build one chat completion request asking for an MCQ per factoid."""
+    numbered = "\n".join(f'{i}. "{factoid}"' for i, factoid in enumerate(factoids, 1))
+    user_message = {
+        "role": "user",
+        "content": (
+            f"Create one MCQ for each of the following {len(factoids)} factoids. "
+            f"Return a JSON array of {len(factoids)} MCQ objects in the same order:\n\n{numbered}"
+        )
+    }
+    return build_request(BATCH_SYSTEM_MESSAGE, user_message, model=DEPLOYMENT_NAME,
+                         max_tokens=TOKENS_PER_MCQ * len(factoids), temperature=0.7)
+
+def parse_mcq_batch_completion(completion, count):
+    """Parse a batched completion into `count` ParseResults, validating each item on its own."""
+    results = parse_mcq_array(completion, count)
+    print(f"  📦 Batch returned {sum(1 for r in results if r.mcq)}/{count} valid MCQs")
+    for i, result in enumerate(results, 1):
+        if result.reason:
+            print(f"  ❌ Item {i}: {result.reason.value} {result.detail}")
+    return results
+
+def _normalize_factoid(text):
+    return ' '.join(str(text or '').lower().split()).strip('"')
+
+def match_batch_items(factoids, parsed):
+    """Line batch items up with the factoids they answer, using each item's echoed index and factoid.
+
+    Returns a list aligned with `factoids` holding the MCQ or None. An item
+    is accepted only if its 'index' points at a factoid its 'factoid' field
+    matches (or, without a usable index, if that text matches exactly one
+    factoid); skipped, reordered or mislabelled items are left for the
+    individual retry instead of being filed under the wrong factoid.
+    """
+    matched = [None] * len(factoids)
+    by_text = {}
+    for i, factoid in enumerate(factoids):
+        by_text.setdefault(_normalize_factoid(factoid), []).append(i)
+    mismatched = 0
+    for item in parsed:
+        if not item.mcq:
+            continue
+        mcq = dict(item.mcq)
+        index = mcq.pop('index', None)
+        echoed = _normalize_factoid(mcq.get('factoid'))
+        if isinstance(index, int) and 1 <= index <= len(factoids):
+            target = index - 1 if _normalize_factoid(factoids[index - 1]) == echoed else None
+        else:
+            candidates = by_text.get(echoed, [])
+            target = candidates[0] if len(candidates) == 1 else None
+        if target is None or matched[target] is not None:
+            mismatched += 1
+            continue
+        matched[target] = mcq
+    if mismatched:
+        print(f"  ⚠️  {mismatched} batch items didn't match their factoid; retrying those individually")
+    return matched
+
+def parse_mcq_completion(completion):
+    """Parse, repair and validate an MCQ completion into a ParseResult."""
+    print(f"  📝 Got response: {(completion or '')[:100]}...")  # Show first 100 chars
+    result = parse_mcq(completion)
+    if result.mcq:
+        print("  ✅ Successfully validated MCQ format")
+    else:
+        print(f"  ❌ Invalid MCQ ({result.reason.value}): {result.detail}")
+    return result
+
+def generate_mcqs_for_factoids(factoids, concurrency=None, on_mcq=None, factoids_per_request=None):
+    """Generate MCQs for many factoids concurrently.
+
+    With factoids_per_request > 1, factoids are first sent in groups that
+    return a JSON array; each item is validated on its own and only the
+    factoids whose item was missing or invalid are retried one per request.
+    Completions cut off by max_tokens get one more try with a larger budget.
+    Unusable completions are dropped from the LLM cache so reruns ask again.
+
+    Returns a list aligned with `factoids` holding the MCQ dict or None for
+    factoids that failed. `on_mcq(index, mcq)` is called as each one completes.
+    """
+    per_request = factoids_per_request or FACTOIDS_PER_REQUEST
+    print(f"  🔄 Generating {len(factoids)} MCQs (rate governor paces the requests in flight)...")
+    mcqs = [None] * len(factoids)
+
+    def accept(index, mcq):
+        mcqs[index] = mcq
+        if on_mcq:
+            on_mcq(index, mcq)
+
+    retry = list(range(len(factoids)))
+    if per_request > 1 and len(factoids) > 1:
+        groups = [retry[i:i + per_request] for i in range(0, len(factoids), per_request)]
+        requests = [build_mcq_batch_request([factoids[i] for i in group]) for group in groups]
+
+        def handle_group(result):
+            group = groups[result.index]
+            if result.error is not None:
+                print(f"  ❌ Error processing factoids {group[0] + 1}–{group[-1] + 1}: {str(result.error)}")
+                return
+            parsed = parse_mcq_batch_completion(result.content, len(group))
+            matched = match_batch_items([factoids[i] for i in group], parsed)
+            for index, mcq in zip(group, matched):
+                if mcq:
+                    accept(index, mcq)
+            if not all(matched):
+                forget_request(requests[result.index])
+
+        run_prompts(requests, concurrency=concurrency, on_result=handle_group)
+        retry = [i for i in retry if mcqs[i] is None]
+        if retry:
+            print(f"  🔁 Retrying {len(retry)} factoids individually...")
+
+    def run_single(indices, max_tokens):
+        """Generate one MCQ per request; return the indices whose completion was truncated."""
+        requests = [build_mcq_request(factoids[i], max_tokens) for i in indices]
+        truncated = []
+
+        def handle_result(result):
+            index = indices[result.index]
+            if result.error is not None:
+                print(f"  ❌ Error processing factoid {index + 1}: {str(result.error)}")
+                return
+            parsed = parse_mcq_completion(result.content)
+            if parsed.mcq:
+                accept(index, parsed.mcq)
+                return
+            forget_request(requests[result.index])
+            if parsed.reason == FailureReason.TRUNCATED:
+                truncated.append(index)
+
+        run_prompts(requests, concurrency=concurrency, on_result=handle_result)
+        return truncated
+
+    truncated = run_single(retry, 2048) if retry else []
+    if truncated:
+        print(f"  🔁 Retrying {len(truncated)} truncated MCQs with a larger token budget...")
+        run_single(truncated, 4096)
+    return mcqs
+
 def process_factoid(factoid):
     """Process a single factoid and generate an MCQ."""
-    try:
-        print(f"  🔄 Processing factoid: {factoid[:100]}...")  # Show first 100 chars
-        
-        user_message = {
-            "role": "user",
-            "content": f'Create a single MCQ based on the following factoid:\n\nFactoid: "{factoid}"'
-        }
-
-        response = azure_client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=[SYSTEM_MESSAGE, user_message],
-            max_tokens=2048,
-            temperature=0.7,
-            top_p=1.0
-        )
+    print(f"  🔄 Processing factoid: {factoid[:100]}...")  # Show first 100 chars
+    return generate_mcqs_for_factoids([factoid])[0]
 
-        # Extract and validate the completion
-        completion = response.choices[0].message.content
-        print(f"  📝 Got response: {completion[:100]}...")  # Show first 100 chars
-        
-        # Ensure the response is valid JSON
-        try:
-            mcq = json.loads(completion)
-            # Validate MCQ structure
-            required_fields = ['question', 'answerChoices', 'explanation', 'factoid']
-            if not all(field in mcq for field in required_fields):
-                print("  ❌ Missing required fields in MCQ")
-                raise ValueError("Missing required fields in MCQ")
-            print("  ✅ Successfully validated MCQ format")
-            return mcq
-        except json.JSONDecodeError:
-            # If not valid JSON, try to extract JSON portion
-            print("  ⚠️ Invalid JSON format, attempting to extract JSON portion...")
-            import re
-            json_match = re.search(r'\{.*\}', completion, re.DOTALL)
-            if json_match:
-                mcq = json.loads(json_match.group())
-                if all(field in mcq for field in required_fields):
-                    print("  ✅ Successfully extracted and validated MCQ")
-                    return mcq
-            print("  ❌ Failed to extract valid JSON")
-            raise ValueError("Invalid MCQ format")
+def _write_mcq_batch(items):
+    """Store (source_file, factoid, mcq) items, one bulk write per source file."""
+    by_source = {}
+    for source_file, _, mcq in items:
+        by_source.setdefault(source_file, []).append(mcq)
+    for source_file, mcqs in by_source.items():
+        bank_id = mcqs[0].get('bank_id') or derive_bank_id(source_file)
+        sync_mcqs(mcqs_collection, mcqs, source_file, bank_id, delete_missing=False)
 
-    except Exception as e:
-        print(f"  ❌ Error processing factoid: {str(e)}")
-        return None
+def get_mcq_writer():
+    global _mcq_writer
+    if _mcq_writer is None:
+        _mcq_writer = WriteBehindBuffer(_write_mcq_batch, 'mcqs')
+    return _mcq_writer
 
-def save_checkpoint(source_file, current_batch, total_batches):
-    """Save progress to a checkpoint file."""
-    checkpoint = {
-        'source_file': source_file,
-        'last_completed_batch': current_batch,
-        'total_batches': total_batches,
-        'timestamp': datetime.now().isoformat()
-    }
-    
-    with open('python/checkpoint.json', 'w') as f:
-        json.dump(checkpoint, f, indent=2)
-    print(f"\n💾 Checkpoint saved: Batch {current_batch}/{total_batches}")
+def save_journaled_mcqs(journal, factoids, source_file):
+    """Queue journaled MCQs for `factoids` for the database; they are marked saved once written.
 
-def load_checkpoint(source_file):
-    """Load the last checkpoint if it exists."""
-    try:
-        if os.path.exists('python/checkpoint.json'):
-            with open('python/checkpoint.json', 'r') as f:
-                checkpoint = json.load(f)
-                
-            if checkpoint['source_file'] == source_file:
-                print(f"\n📋 Found checkpoint for {source_file}")
-                print(f"Last completed batch: {checkpoint['last_completed_batch']}")
-                print(f"Total batches: {checkpoint['total_batches']}")
-                return checkpoint['last_completed_batch']
-    except Exception as e:
-        print(f"Error loading checkpoint: {e}")
-    
-    return 0  # Start from beginning if no valid checkpoint found
+    Returns the number of MCQs queued.
+    """
+    done = [f for f in factoids if journal.is_done(f)]
+    mark_saved = lambda items: journal.mark_saved([factoid for _, factoid, _ in items])
+    writer = get_mcq_writer()
+    for factoid in done:
+        writer.add((source_file, factoid, journal.mcqs_for([factoid])[0]), on_written=mark_saved)
+    return len(done)
 
-def process_factoids_in_batches(factoids, source_file, batch_size=5):
-    """Process factoids in small batches with improved error handling."""
-    total_batches = (len(factoids) + batch_size - 1) // batch_size
-    
-    for batch_num in range(0, len(factoids), batch_size):
-        batch = factoids[batch_num:batch_num + batch_size]
+def process_factoids_in_batches(factoids, source_file, batch_size=MCQ_BATCH_SIZE):
+    """Generate MCQs batch by batch, handing each batch to the database writer as it completes.
+
+    Factoids within a batch are generated concurrently; `batch_size` only
+    controls how often results are queued for MongoDB. Writes happen on a
+    background thread while the next batch is generated. Progress is
+    journaled per factoid, so a rerun skips everything already generated and
+    only saves MCQs that never reached the database.
+    """
+    journal = MCQJournal(source_file)
+
+    # Save anything generated by a previous run that crashed before its database write
+    unsaved = journal.unsaved(factoids)
+    if unsaved:
+        print(f"\n📋 Resuming: saving {len(unsaved)} MCQs generated by a previous run...")
+        save_journaled_mcqs(journal, unsaved, source_file)
+
+    pending = journal.pending(factoids)
+    if len(pending) < len(factoids):
+        print(f"\n📋 Resuming from journal: {len(factoids) - len(pending)}/{len(factoids)} factoids already done")
+
+    total_batches = (len(pending) + batch_size - 1) // batch_size
+
+    for batch_num in range(0, len(pending), batch_size):
+        batch = pending[batch_num:batch_num + batch_size]
         current_batch = (batch_num // batch_size) + 1
-        
+
         print(f"\n🔄 Processing batch {current_batch}/{total_batches}")
-        print(f"Factoids in this batch: {len(batch)}")
-        
-        batch_mcqs = []
-        for i, factoid in enumerate(batch, 1):
-            print(f"\n  Processing factoid {i}/{len(batch)}")
-            mcq = process_factoid(factoid)
-            
-            if mcq:
-                print("  ✅ MCQ generated successfully")
-                batch_mcqs.append(mcq)
-            else:
-                print("  ❌ Failed to generate MCQ")
-        
-        if batch_mcqs:
-            print(f"\n📤 Saving batch {current_batch} to database...")
-            save_mcqs_to_db(batch_mcqs, source_file)
-            print(f"✅ Successfully saved batch {current_batch} with {len(batch_mcqs)} MCQs")
-        
-        print(f"\n💾 Checkpoint saved: Batch {current_batch}/{total_batches}")
-        time.sleep(1)  # Rate limiting
+        print(f"📝 Factoids in this batch: {len(batch)}")
+
+        with telemetry.stage('mcqs'):
+            results = generate_mcqs_for_factoids(
+                batch,
+                on_mcq=lambda i, mcq, batch=batch: journal.record(batch[i], mcq)
+            )
+        batch_done = [f for f, mcq in zip(batch, results) if mcq]
+        failed = len(batch) - len(batch_done)
+        if failed:
+            print(f"  ❌ Failed to generate {failed} MCQs in this batch")
+
+        if batch_done:
+            queued = save_journaled_mcqs(journal, batch_done, source_file)
+            print(f"\n📤 Queued batch {current_batch} ({queued} MCQs) for the database")
+
+    # Wait for the writer so the journal knows what reached the database
+    writer = get_mcq_writer()
+    writer.flush()
+    unsaved = journal.unsaved(factoids)
+    if unsaved:
+        print(f"❌ {len(unsaved)} MCQs were not saved to the database (last error: {writer.last_error}); "
+              f"rerun to retry them")
+    return journal.mcqs_for(factoids)
 
 def save_mcqs_to_db(mcqs, source_file):
-    """Save MCQs to MongoDB."""
+    """Save MCQs to MongoDB.
+
+    MCQs are keyed by their stable content id, so saving the same batch twice
+    (e.g. after resuming from the journal) writes nothing the second time.
+    Other MCQs already stored for the bank are left alone.
+    """
     try:
-        # Prepare the documents
-        documents = []
-        for mcq in mcqs:
-            doc = {
-                'source_file': source_file,
-                'question': mcq['question'],
-                'answerChoices': mcq['answerChoices'],
-                'explanation': mcq['explanation'],
-                'factoid': mcq['factoid'],
-                'created_at': datetime.utcnow()
-            }
-            documents.append(doc)
-        
-        # Insert the documents
-        if documents:
-            result = mcqs_collection.insert_many(documents)
-            print(f"✅ Successfully saved {len(result.inserted_ids)} MCQs to database")
+        if mcqs:
+            bank_id = mcqs[0].get('bank_id') or derive_bank_id(source_file)
+            result = sync_mcqs(mcqs_collection, mcqs, source_file, bank_id, delete_missing=False)
+            print(f"✅ Successfully saved {result.inserted + result.updated} MCQs to database "
+                  f"({result.unchanged} already stored)")
             return True
             
     except Exception as e:
@@ -265,55 +400,176 @@ def process_factoids_file(file_path):
             data = json.load(f)
             
         source_file = data.get('source_file')
-        factoids = data.get('factoids', [])
+        factoids, _ = dedupe_factoids(data.get('factoids', []))
         
         print(f"📊 Found {len(factoids)} factoids")
         print(f"📄 Source file: {source_file}")
         
         # Process factoids in batches
-        batch_size = 5
-        total_batches = (len(factoids) + batch_size - 1) // batch_size
-        
-        all_mcqs = []
-        for batch_num in range(0, len(factoids), batch_size):
-            batch = factoids[batch_num:batch_num + batch_size]
-            current_batch = (batch_num // batch_size) + 1
-            
-            print(f"\n🔄 Processing batch {current_batch}/{total_batches}")
-            print(f"📝 Factoids in this batch: {len(batch)}")
-            
-            batch_mcqs = []
-            for i, factoid in enumerate(batch, 1):
-                print(f"\n  Processing factoid {i}/{len(batch)}")
-                mcq = process_factoid(factoid)
-                
-                if mcq:
-                    print("  ✅ MCQ generated successfully")
-                    batch_mcqs.append(mcq)
-                else:
-                    print("  ❌ Failed to generate MCQ")
-            
-            if batch_mcqs:
-                all_mcqs.extend(batch_mcqs)
-                print(f"\n💾 Saving batch {current_batch} with {len(batch_mcqs)} MCQs...")
-                save_mcqs_to_db(batch_mcqs, source_file)
-                print(f"✅ Successfully saved batch {current_batch}")
-            
-            print(f"\n⏳ Waiting before next batch...")
-            time.sleep(1)  # Rate limiting
-        
-        return all_mcqs
+        mcqs = process_factoids_in_batches(factoids, source_file)
+        print_parse_stats()
+        return mcqs
         
     except Exception as e:
         print(f"❌ Error processing file: {str(e)}")
         return None
 
+def write_mcqs_file(output_path, source_name, mcqs):
+    """Tag MCQs with their source and bank and write the bank file.
+
+    A .jsonl path is written as a JSONL bank with an offset index (see
+    mcq_bank); anything else as a single {source_file, mcqs} JSON document.
+    """
+    if is_jsonl(output_path):
+        sync_bank(output_path, source_name, derive_bank_id(source_name), mcqs)
+        return
+
+    # Add metadata to each MCQ
+    for mcq in mcqs:
+        mcq['source_file'] = source_name
+        mcq['bank_id'] = derive_bank_id(source_name)
+
+    # Save MCQs
+    output_data = {
+        'source_file': source_name,
+        'mcqs': mcqs
+    }
+
+    with open(output_path, 'w') as f:
+        json.dump(output_data, f, indent=2)
+
+def generate_mcqs_file(input_path, output_path):
+    """Generate the MCQ bank for one factoids file and write it to output_path.
+
+    Only factoids missing from the source's journal are sent to the LLM. A
+    .jsonl bank is appended to as each MCQ is produced.
+    """
+    source_name = os.path.basename(input_path).replace('_factoids.json', '')
+
+    # Read factoids
+    with open(input_path, 'r') as f:
+        factoids_data = json.load(f)
+
+    print(f"Found {len(factoids_data['factoids'])} factoids")
+
+    # Drop near-duplicates so they never cost a request
+    factoids, _ = dedupe_factoids(factoids_data['factoids'])
+
+    # Generate MCQs concurrently for the factoids not yet in the journal
+    journal = MCQJournal(source_name)
+    pending = journal.pending(factoids)
+    if len(pending) < len(factoids):
+        print(f"📋 Resuming from journal: {len(factoids) - len(pending)}/{len(factoids)} factoids already done")
+    bank = BankWriter(output_path, source_name, derive_bank_id(source_name)) if is_jsonl(output_path) else None
+
+    def on_mcq(i, mcq):
+        journal.record(pending[i], mcq)
+        if bank:
+            bank.append(mcq)
+
+    try:
+        with telemetry.stage('mcqs'):
+            generate_mcqs_for_factoids(pending, on_mcq=on_mcq)
+    finally:
+        if bank:
+            bank.close()
+    mcqs = journal.mcqs_for(factoids)
+
+    write_mcqs_file(output_path, source_name, mcqs)
+
+    print(f"✅ Successfully generated {len(mcqs)} MCQs for {source_name}")
+    return mcqs
+
+def factoid_custom_id(source_name, factoid):
+    """Batch custom_id of a factoid's MCQ prompt: the source name plus the factoid hash."""
+    return make_custom_id('mcq', source_name, factoid_hash(factoid))
+
+def _default_dirs(input_dir, output_dir):
+    return (input_dir or os.path.join(os.path.dirname(__file__), 'factoids'),
+            output_dir or os.path.join(os.path.dirname(__file__), 'mcqs'))
+
+def _read_factoids(input_path):
+    with open(input_path, 'r', encoding='utf-8') as f:
+        factoids, _ = dedupe_factoids(json.load(f)['factoids'])
+    return factoids
+
+def export_mcq_batch(batch_path, input_dir=None):
+    """Write a batch-API request file with one single-factoid prompt per factoid not yet in its journal."""
+    input_dir, _ = _default_dirs(input_dir, None)
+
+    def pending():
+        for factoid_file in sorted(f for f in os.listdir(input_dir) if f.endswith('_factoids.json')):
+            source_name = factoid_file.replace('_factoids.json', '')
+            factoids = _read_factoids(os.path.join(input_dir, factoid_file))
+            for factoid in MCQJournal(source_name).pending(factoids):
+                yield factoid_custom_id(source_name, factoid), build_mcq_request(factoid)
+
+    count = write_requests(batch_path, pending())
+    print(f"📤 Wrote {count} MCQ requests to {batch_path}")
+    return count
+
+def ingest_mcq_batch(results_path, input_dir=None, output_dir=None):
+    """Stream a batch-API results file through MCQ validation, the journal, the bank and the database.
+
+    Lines are matched to factoids by custom_id. Invalid or failed results
+    leave their factoid pending, so the next export asks for it again.
+    Returns the number of MCQs accepted.
+    """
+    input_dir, output_dir = _default_dirs(input_dir, output_dir)
+    sources = {}  # source name → (factoids, factoid by hash, journal), or None if its factoids file is gone
+    accepted = failed = 0
+    for result in iter_results(results_path):
+        try:
+            kind, source_name, key = split_custom_id(result.custom_id)
+        except ValueError:
+            kind = None
+        if kind != 'mcq':
+            continue
+        if source_name not in sources:
+            input_path = os.path.join(input_dir, f"{source_name}_factoids.json")
+            if os.path.exists(input_path):
+                factoids = _read_factoids(input_path)
+                sources[source_name] = (factoids, {factoid_hash(f): f for f in factoids}, MCQJournal(source_name))
+            else:
+                print(f"❌ {source_name}: no factoids file in {input_dir}, results skipped")
+                sources[source_name] = None
+        if sources[source_name] is None:
+            continue
+        _, by_hash, journal = sources[source_name]
+        factoid = by_hash.get(key)
+        if factoid is None or journal.is_done(factoid):
+            continue
+        if result.error:
+            print(f"  ❌ {result.custom_id}: {result.error}")
+            failed += 1
+            continue
+        parsed = parse_mcq_completion(result.content)
+        if parsed.mcq:
+            journal.record(factoid, parsed.mcq)
+            accepted += 1
+        else:
+            failed += 1
+
+    os.makedirs(output_dir, exist_ok=True)
+    for source_name, state in sources.items():
+        if state is None:
+            continue
+        factoids, _, journal = state
+        output_path = os.path.join(output_dir, f"{source_name}_mcqs.jsonl")
+        write_mcqs_file(output_path, source_name, journal.mcqs_for(factoids))
+        save_mcqs_to_db(list(iter_bank(output_path)), f"{source_name}_factoids.json")
+        pending = len(journal.pending(factoids))
+        print(f"✅ {source_name}: {len(factoids) - pending}/{len(factoids)} MCQs"
+              + (f" ({pending} still pending; export again to retry them)" if pending else ""))
+    print(f"📥 Accepted {accepted} MCQs from {results_path}" + (f", {failed} failed" if failed else ""))
+    if sources:
+        update_search_index()
+    print_parse_stats()
+    return accepted
+
 def main(input_dir=None, output_dir=None):
     """Generate MCQs from factoids files."""
-    if input_dir is None:
-        input_dir = os.path.join(os.path.dirname(__file__), 'factoids')
-    if output_dir is None:
-        output_dir = os.path.join(os.path.dirname(__file__), 'mcqs')  # Changed from COMPLETED_MCQS
+    input_dir, output_dir = _default_dirs(input_dir, output_dir)
 
     print(f"Reading factoids from: {input_dir}")
     print(f"Writing MCQs to: {output_dir}")
@@ -332,51 +588,32 @@ def main(input_dir=None, output_dir=None):
     for factoid_file in factoid_files:
         source_name = factoid_file.replace('_factoids.json', '')
         input_path = os.path.join(input_dir, factoid_file)
-        output_path = os.path.join(output_dir, f"{source_name}_mcqs.json")
+        output_path = os.path.join(output_dir, f"{source_name}_mcqs.jsonl")
         
         print(f"\nProcessing {factoid_file}...")
         
         try:
-            # Read factoids
-            with open(input_path, 'r') as f:
-                factoids_data = json.load(f)
-            
-            print(f"Found {len(factoids_data['factoids'])} factoids")
-            
-            # Generate MCQs for each factoid
-            mcqs = []
-            for factoid in factoids_data['factoids']:
-                print(f"Generating MCQ for: {factoid[:50]}...")
-                mcq = process_factoid(factoid)
-                if mcq:
-                    mcqs.append(mcq)
-            
-            # Add metadata to each MCQ
-            for mcq in mcqs:
-                mcq['source_file'] = source_name
-                mcq['bank_id'] = source_name.replace('_factoids.json', '').lower()
-                if mcq['bank_id'].startswith('mehlman '):
-                    mcq['bank_id'] = 'mehlman-' + mcq['bank_id'].replace('mehlman ', '')
-                elif mcq['bank_id'] == 'biochemistry':
-                    mcq['bank_id'] = 'mehlman-biochemistry'
-                elif mcq['bank_id'] == 'psychology':
-                    mcq['bank_id'] = 'mehlman-psychology'
-            
-            # Save MCQs
-            output_data = {
-                'source_file': source_name,
-                'mcqs': mcqs
-            }
-            
-            with open(output_path, 'w') as f:
-                json.dump(output_data, f, indent=2)
-            
-            print(f"✅ Successfully generated {len(mcqs)} MCQs for {source_name}")
-            
+            with telemetry.run(source_name):
+                generate_mcqs_file(input_path, output_path)
         except Exception as e:
             print(f"❌ Error processing {factoid_file}: {str(e)}")
             import traceback
             traceback.print_exc()
 
+    update_search_index()
+    print_parse_stats()
+    print_cache_stats()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate MCQs from factoids files.")
+    parser.add_argument('--batch-export', metavar='PATH', nargs='?', const=os.path.join(BATCH_DIR, 'mcq_requests.jsonl'),
+                        help="write pending factoid prompts as a batch-API request file instead of calling the API")
+    parser.add_argument('--batch-ingest', metavar='PATH',
+                        help="validate and save MCQs from a batch-API results file")
+    args = parser.parse_args()
+    if args.batch_export:
+        export_mcq_batch(args.batch_export)
+    elif args.batch_ingest:
+        ingest_mcq_batch(args.batch_ingest)
+    else:
+        main()
\ No newline at end of file
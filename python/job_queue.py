@@ -0,0 +1,357 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Queue location (override through the environment)
+QUEUE_PATH = os.getenv(
+    "JOB_QUEUE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job_queue.sqlite3')
+)
+
+# A lease not renewed by a heartbeat for this long is presumed dead and the job is leased again
+LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+# Leases (including ones lost to a dead worker) before a job is marked failed
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# A failed job waits RETRY_BASE_SECONDS * 2**(attempts - 1) seconds, capped, before it is leased again
+RETRY_BASE_SECONDS = 30
+RETRY_CAP_SECONDS = 600
+
+# Window the status command measures throughput over
+THROUGHPUT_WINDOW_SECONDS = 300
+
+Job = namedtuple('Job', ['id', 'source', 'stage', 'start', 'end', 'payload', 'attempts'])
+
+# A job to add: whole-source jobs use start = end = 0; then_stage is the whole-source job
+# queued once every job of this (source, stage) is done or has failed for good
+JobSpec = namedtuple('JobSpec', ['source', 'stage', 'start', 'end', 'payload', 'then_stage'],
+                     defaults=(0, 0, None, None))
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """SQLite-backed queue of (source, stage, range) jobs leased to worker processes.
+
+    A worker leases the ready job with the highest priority, renews the
+    lease with heartbeats while it runs, and completes or fails it. A lease
+    that expires without a heartbeat belongs to a dead worker, so the job is
+    leased again, up to MAX_ATTEMPTS times. Completing a job adds its
+    follow-up jobs in the same transaction, and the last job of a
+    (source, stage) to finish or fail for good can add a whole-source job
+    (`then_stage`), whose payload lists the failed ranges under
+    payload['failed'][stage], so fan-out and fan-in survive crashes. Safe to share between processes;
+    each process opens its own JobQueue. `priorities` maps a stage to its
+    lease priority (higher first).
+    """
+
+    def __init__(self, path=QUEUE_PATH, priorities=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 clock=time.time):
+        self.path = path
+        self.priorities = priorities or {}
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " range_start INTEGER NOT NULL DEFAULT 0,"
+            " range_end INTEGER NOT NULL DEFAULT 0,"
+            " payload TEXT NOT NULL DEFAULT '{}',"
+            " then_stage TEXT,"
+            " priority INTEGER NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " available_at REAL NOT NULL DEFAULT 0,"
+            " worker TEXT,"
+            " lease_expires REAL,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " result TEXT,"
+            " error TEXT,"
+            " UNIQUE (source, stage, range_start, range_end))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, available_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)")
+
+    @contextmanager
+    def _transaction(self):
+        """Serialize a read-modify-write against every other process using the queue."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _insert(self, conn, spec, now):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO jobs (source, stage, range_start, range_end, payload, then_stage, priority, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (spec.source, spec.stage, spec.start, spec.end, json.dumps(spec.payload or {}), spec.then_stage,
+             self.priorities.get(spec.stage, 0), now)
+        )
+        return cursor.rowcount
+
+    def _fan_in(self, conn, source, stage, now):
+        """Queue the then_stage job of (source, stage) once none of its jobs is pending or leased."""
+        rows = conn.execute(
+            "SELECT status, range_start, range_end, payload, then_stage FROM jobs"
+            " WHERE source = ? AND stage = ? ORDER BY range_start",
+            (source, stage)
+        ).fetchall()
+        if not rows or not rows[0][4] or any(row[0] not in ('done', 'failed') for row in rows):
+            return
+        payload = json.loads(rows[0][3])
+        failed = [[start, end] for status, start, end, _, _ in rows if status == 'failed']
+        if failed:
+            payload['failed'] = dict(payload.get('failed', {}), **{stage: failed})
+        self._insert(conn, JobSpec(source, rows[0][4], payload=payload), now)
+
+    def enqueue(self, specs):
+        """Add jobs, skipping ones already queued for the same (source, stage, range); return how many were added."""
+        with self._transaction() as conn:
+            now = self._clock()
+            return sum(self._insert(conn, spec, now) for spec in specs)
+
+    def lease(self, worker=None):
+        """Lease the next ready job to `worker`, or return None when nothing is ready."""
+        worker = worker or worker_name()
+        with self._transaction() as conn:
+            now = self._clock()
+            # Expired leases that used up their attempts belong to jobs that keep killing workers
+            dead = conn.execute(
+                "SELECT DISTINCT source, stage FROM jobs WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall()
+            if dead:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', worker = NULL, finished_at = ?,"
+                    " error = COALESCE(error, 'lease expired') || ' (gave up after ' || attempts || ' attempts)'"
+                    " WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (now, now, self.max_attempts)
+                )
+                for source, stage in dead:
+                    self._fan_in(conn, source, stage, now)
+            row = conn.execute(
+                "SELECT id, source, stage, range_start, range_end, payload, attempts, status FROM jobs"
+                " WHERE (status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires < ?)"
+                " ORDER BY priority DESC, id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[7] == 'leased':
+                conn.execute("UPDATE jobs SET error = 'lease expired' WHERE id = ?", (row[0],))
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1,"
+                " started_at = ? WHERE id = ?",
+                (worker, now + self.lease_seconds, now, row[0])
+            )
+        return Job(row[0], row[1], row[2], row[3], row[4], json.loads(row[5]), row[6] + 1)
+
+    def heartbeat(self, job, worker=None):
+        """Extend a lease; False means it expired and the job now belongs to another worker."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (self._clock() + self.lease_seconds, job.id, worker or worker_name())
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job, result=None, follow_ups=(), worker=None):
+        """Mark a leased job done, add its follow-up jobs, and fan in to its then_stage job when the
+        last of its (source, stage) siblings finishes or fails. Returns False if the lease was lost."""
+        with self._transaction() as conn:
+            now = self._clock()
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', worker = NULL, lease_expires = NULL, finished_at = ?,"
+                " result = ?, error = NULL WHERE id = ? AND worker = ? AND status = 'leased'",
+                (now, json.dumps(result), job.id, worker or worker_name())
+            )
+            if cursor.rowcount != 1:
+                return False
+            for spec in follow_ups:
+                self._insert(conn, spec, now)
+            self._fan_in(conn, job.source, job.stage, now)
+        return True
+
+    def fail(self, job, error, worker=None):
+        """Give a job back after an error: retried later with backoff, or failed for good after max_attempts."""
+        with self._transaction() as conn:
+            now = self._clock()
+            give_up = job.attempts >= self.max_attempts
+            delay = min(RETRY_CAP_SECONDS, RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_expires = NULL, available_at = ?,"
+                " finished_at = ?, error = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                ('failed' if give_up else 'pending', now + delay, now if give_up else None, str(error)[:2000],
+                 job.id, worker or worker_name())
+            )
+            # A chunk that failed for good is dropped, as the other pipelines do, so the source still finishes
+            if give_up and cursor.rowcount == 1:
+                self._fan_in(conn, job.source, job.stage, now)
+        return cursor.rowcount == 1
+
+    def results(self, source, stage):
+        """Results of a source's finished jobs for one stage, in range order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM jobs WHERE source = ? AND stage = ? AND status = 'done' ORDER BY range_start",
+                (source, stage)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def source_jobs(self, source):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT stage, status, payload FROM jobs WHERE source = ? ORDER BY id", (source,)
+            ).fetchall()
+
+    def reset_source(self, source):
+        """Forget every job of a source so it can be queued from scratch."""
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM jobs WHERE source = ?", (source,)).rowcount
+
+    def retry_failed(self):
+        """Put failed jobs back in the queue with fresh attempts.
+
+        A stage whose whole-source job already ran without them is not
+        collected again; requeue the source (enqueue --force) for that.
+        """
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, available_at = 0, finished_at = NULL"
+                " WHERE status = 'failed'"
+            ).rowcount
+
+    def has_work(self):
+        """True while any job is pending or leased (a running job may still add follow-ups)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM jobs WHERE status IN ('pending', 'leased') LIMIT 1"
+            ).fetchone() is not None
+
+    def status(self, window=THROUGHPUT_WINDOW_SECONDS):
+        """Queue depth by stage, live workers, throughput over the last `window` seconds, and failures."""
+        now = self._clock()
+        with self._lock:
+            conn = self._conn
+            counts = conn.execute("SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status").fetchall()
+            workers = conn.execute(
+                "SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'leased' AND lease_expires >= ?", (now,)
+            ).fetchone()[0]
+            expired = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND lease_expires < ?", (now,)
+            ).fetchone()[0]
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = 'pending'"
+            ).fetchone()[0]
+            recent = conn.execute(
+                "SELECT stage, COUNT(*), AVG(finished_at - started_at) FROM jobs"
+                " WHERE status = 'done' AND finished_at >= ? GROUP BY stage",
+                (now - window,)
+            ).fetchall()
+            sources = conn.execute(
+                "SELECT source, SUM(status = 'done'), COUNT(*), SUM(status = 'failed') FROM jobs GROUP BY source"
+            ).fetchall()
+            failures = conn.execute(
+                "SELECT source, stage, range_start, range_end, error FROM jobs WHERE status = 'failed'"
+                " ORDER BY finished_at DESC LIMIT 10"
+            ).fetchall()
+        stages = {}
+        for stage, status, count in counts:
+            stages.setdefault(stage, {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0})[status] = count
+        return {
+            'stages': stages,
+            'workers': workers,
+            'expired_leases': expired,
+            'oldest_pending_seconds': now - oldest if oldest else None,
+            'window_seconds': window,
+            'throughput': {stage: {'done': done, 'per_min': done * 60 / window, 'avg_seconds': avg}
+                           for stage, done, avg in recent},
+            'sources': {source: {'done': done, 'total': total, 'failed': failed}
+                        for source, done, total, failed in sources},
+            'failures': failures,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Heartbeat:
+    """Renews a job's lease from a background thread while the job runs."""
+
+    def __init__(self, queue, job, worker=None, interval=None):
+        self.queue = queue
+        self.job = job
+        self.worker = worker or worker_name()
+        self.interval = interval or queue.lease_seconds / 4
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{job.id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.heartbeat(self.job, self.worker):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def print_status(status):
+    print("\n📋 Job queue")
+    print(f"{'stage':<18}{'pending':>9}{'leased':>9}{'done':>9}{'failed':>9}")
+    for stage, counts in status['stages'].items():
+        print(f"{stage:<18}" + ''.join(f"{counts[s]:>9}" for s in ('pending', 'leased', 'done', 'failed')))
+
+    depth = sum(c['pending'] + c['leased'] for c in status['stages'].values())
+    print(f"\n   Depth: {depth} jobs waiting or running, {status['workers']} live workers"
+          + (f", {status['expired_leases']} expired leases awaiting re-lease" if status['expired_leases'] else ''))
+    if status['oldest_pending_seconds'] is not None:
+        print(f"   Oldest pending job queued {status['oldest_pending_seconds'] / 60:.1f} min ago")
+
+    minutes = status['window_seconds'] / 60
+    throughput = status['throughput']
+    total = sum(t['done'] for t in throughput.values())
+    print(f"   Throughput (last {minutes:.0f} min): {total * 60 / status['window_seconds']:.1f} jobs/min")
+    for stage, t in throughput.items():
+        print(f"     {stage:<16}{t['per_min']:>6.1f}/min, {t['avg_seconds']:.1f}s per job")
+
+    sources = status['sources']
+    if sources:
+        finished = sum(1 for s in sources.values() if s['done'] == s['total'])
+        print(f"   Sources: {finished}/{len(sources)} with every job done")
+    for source, stage, start, end, error in status['failures']:
+        span = f" [{start}:{end}]" if end else ''
+        print(f"   ❌ {source} {stage}{span}: {error}")
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Cache location and limits (override through the environment)
+CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.llm_cache', 'completions.sqlite3')
+)
+CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024)
+CACHE_MAX_AGE_SECONDS = int(float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600)
+
+# Set LLM_CACHE_BYPASS=1 to neither read from nor write to the cache
+CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+# Run an eviction pass every this many stores
+EVICT_EVERY = 200
+
+
+def make_cache_key(request):
+    """Hash the parts of a request that determine its completion."""
+    messages = request['messages']
+    system_message = next((m['content'] for m in messages if m['role'] == 'system'), '')
+    user_messages = [m['content'] for m in messages if m['role'] != 'system']
+    payload = json.dumps([
+        request.get('model'),
+        system_message,
+        user_messages,
+        request.get('temperature'),
+        request.get('max_tokens')
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    """Content-addressed SQLite store of completion texts with LRU/age eviction."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, max_age_seconds=CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY,"
+            " content TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+        self.evict()
+
+    def get(self, key):
+        """Return the cached completion for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, content):
+        """Store a completion under `key`."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, content, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, content, len(content.encode('utf-8')), now, now)
+            )
+            self.stores += 1
+            should_evict = self.stores % EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+
+    def forget(self, key):
+        """Remove one entry, e.g. a completion that turned out to be unusable."""
+        with self._lock:
+            self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under the size limit."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM completions WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            )
+            evicted = cursor.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                doomed = []
+                for key, size in self._conn.execute("SELECT key, size FROM completions ORDER BY accessed_at"):
+                    if excess <= 0:
+                        break
+                    doomed.append((key,))
+                    excess -= size
+                self._conn.executemany("DELETE FROM completions WHERE key = ?", doomed)
+                evicted += len(doomed)
+            self.evictions += evicted
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide completion cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompletionCache()
+        return _cache
+
+
+def forget_request(request):
+    """Drop the cached completion for a request so the next run asks again."""
+    if not CACHE_BYPASS:
+        get_cache().forget(make_cache_key(request))
+
+
+def print_cache_stats():
+    if CACHE_BYPASS:
+        print("🗄️  LLM cache bypassed (LLM_CACHE_BYPASS is set)")
+        return
+    stats = get_cache().stats()
+    print(f"🗄️  LLM cache: {stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['entries']} entries ({stats['bytes'] / (1024 * 1024):.1f} MB)")
@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+from collections import namedtuple
+from openai import AsyncAzureOpenAI
+from dotenv import load_dotenv
+from llm_cache import get_cache, make_cache_key, CACHE_BYPASS
+from rate_governor import (get_governor, estimate_request_tokens, is_throttled, retry_after_seconds,
+                           backoff_delay, START_CONCURRENCY, MAX_CONCURRENCY)
+import telemetry
+
+# Load environment variables
+load_dotenv()
+
+# Chat completions in flight at start-up; the rate governor adapts it up to LLM_MAX_CONCURRENCY
+DEFAULT_CONCURRENCY = START_CONCURRENCY
+
+# 429s a single request may wait out before it fails
+MAX_THROTTLED_RETRIES = int(os.getenv("LLM_MAX_THROTTLED_RETRIES", "8"))
+
+DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "Notes_Test_1")
+
+# One entry per submitted request, in the same order the requests were given.
+# Exactly one of `content` / `error` is set.
+LLMResult = namedtuple('LLMResult', ['index', 'content', 'error'])
+
+
+def create_async_client():
+    """Create an Azure OpenAI client bound to the running event loop."""
+    return AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2024-02-15-preview",
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        max_retries=0  # Retries go through the rate governor, which has to see every 429
+    )
+
+
+def build_request(system_message, user_message, model=None, max_tokens=2048, temperature=0.0, top_p=1.0):
+    """Build a chat completion request understood by LLMExecutor."""
+    return {
+        'model': model or DEPLOYMENT_NAME,
+        'messages': [system_message, user_message],
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'top_p': top_p
+    }
+
+
+class LLMExecutor:
+    """Runs chat completion requests concurrently under the process-wide rate governor.
+
+    `concurrency` caps this executor's requests in flight; within it, the
+    governor decides how many are actually sent from the deployment's
+    RPM/TPM budget and the 429s it has seen.
+    """
+
+    def __init__(self, concurrency=None, max_retries=3, retry_delay=1, client=None, use_cache=None, governor=None):
+        self.concurrency = concurrency or MAX_CONCURRENCY
+        self.use_cache = (not CACHE_BYPASS) if use_cache is None else use_cache
+        self.cache = get_cache() if self.use_cache else None
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._client = client
+        self._owns_client = client is None
+        self.governor = governor or get_governor()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = create_async_client()
+        return self._client
+
+    async def complete(self, request):
+        """Run a single request under the concurrency limit and return the completion text.
+
+        Cached completions are returned without taking a concurrency slot.
+        Every attempt's latency, token usage and finish reason is recorded in
+        telemetry under the current stage.
+        """
+        key = None
+        if self.cache is not None:
+            key = make_cache_key(request)
+            cached = self.cache.get(key)
+            if cached is not None:
+                telemetry.record_llm_call(0, cached=True)
+                return cached
+
+        cost = estimate_request_tokens(request)
+        async with self._semaphore:
+            failures = throttles = 0
+            while True:
+                await self.governor.acquire(cost)
+                started = time.perf_counter()
+                try:
+                    response = await self.client.chat.completions.create(**request)
+                except asyncio.CancelledError:
+                    self.governor.release()
+                    raise
+                except Exception as e:
+                    telemetry.record_llm_call(time.perf_counter() - started, error=e)
+                    if is_throttled(e):
+                        retry_after = retry_after_seconds(e)
+                        self.governor.release(throttled=True, retry_after=retry_after)
+                        throttles += 1
+                        if throttles > MAX_THROTTLED_RETRIES:
+                            raise
+                        telemetry.record_throttle()
+                        delay = backoff_delay(throttles - 1, retry_after)
+                        print(f"  ⏳ Throttled (429); retrying in {delay:.1f}s "
+                              f"(concurrency now {self.governor.concurrency})...")
+                    else:
+                        self.governor.release()
+                        failures += 1
+                        if failures >= self.max_retries:
+                            raise
+                        telemetry.record_retry()
+                        delay = backoff_delay(failures - 1, base=self.retry_delay)
+                        print(f"  ⚠️ Attempt {failures} failed: {str(e)}. Retrying in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+                    continue
+
+                self.governor.release(ok=True)
+                telemetry.record_llm_call(time.perf_counter() - started, response)
+                content = response.choices[0].message.content
+                if key is not None and content:
+                    self.cache.put(key, content)
+                return content
+
+    async def complete_all(self, requests, on_result=None):
+        """Run all requests concurrently and return LLMResults in input order.
+
+        A failing request does not cancel the others; its error is reported on
+        its own result. `on_result` is called with each result as soon as it
+        completes, in completion order.
+        """
+        async def run_one(index, request):
+            try:
+                result = LLMResult(index, await self.complete(request), None)
+            except Exception as e:
+                result = LLMResult(index, None, e)
+            if on_result:
+                on_result(result)
+            return result
+
+        return await asyncio.gather(*(run_one(i, r) for i, r in enumerate(requests)))
+
+    async def aclose(self):
+        if self._owns_client and self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+def run_prompts(requests, concurrency=None, on_result=None, **executor_kwargs):
+    """Synchronously run a list of requests through a fresh LLMExecutor."""
+    async def _run():
+        executor = LLMExecutor(concurrency=concurrency, **executor_kwargs)
+        try:
+            return await executor.complete_all(requests, on_result=on_result)
+        finally:
+            await executor.aclose()
+
+    return asyncio.run(_run())
+
+
+def report_failures(results, label="request"):
+    """Print one line per failed result and return the number of failures."""
+    failures = [r for r in results if r.error is not None]
+    for result in failures:
+        print(f"❌ {label} {result.index + 1} failed: {str(result.error)}")
+    return len(failures)
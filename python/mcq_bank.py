@@ -0,0 +1,427 @@
+import os
+import re
+import sys
+import json
+import struct
+import codecs
+import hashlib
+import argparse
+from mcq_sync import mcq_id, IDENTITY_FIELDS
+
+# Sidecar index record: 12-byte MCQ id key (see id_key) followed by the line's byte offset in the bank
+ID_BYTES = 12
+INDEX_RECORD = struct.Struct(f'<{ID_BYTES}sQ')
+INDEX_SUFFIX = '.idx'
+
+# Sources whose bank_id in the frontend (Home.jsx, index.html) isn't just their lowercased name
+FRONTEND_BANK_IDS = {
+    'biochemistry': 'mehlman-biochemistry',
+    'microbiology': 'mehlman-microbiology',
+    'pharmacology': 'mehlman-pharmacology',
+    'psychology': 'mehlman-psychology',
+    'hy obgyn:repro': 'obgyn',
+}
+
+
+def derive_bank_id(source_name):
+    """Map a source name (bare, X_factoids.json or the transcript's X.txt) to the bank_id the frontend uses."""
+    bank_id = source_name
+    for suffix in ('_factoids.json', '.txt'):
+        if bank_id.endswith(suffix):
+            bank_id = bank_id[:-len(suffix)]
+    bank_id = bank_id.lower()
+    if bank_id.startswith('mehlman '):
+        return 'mehlman-' + bank_id.replace('mehlman ', '')
+    return FRONTEND_BANK_IDS.get(bank_id, bank_id)
+
+
+def id_key(mcq_id):
+    """12-byte index key of an MCQ id.
+
+    Ids made by mcq_id() (and ObjectIds) are 24 hex digits and stored as is;
+    any other id, such as the UUIDs of older banks, is stored as a hash.
+    """
+    mcq_id = str(mcq_id)
+    if len(mcq_id) == 2 * ID_BYTES:
+        try:
+            return bytes.fromhex(mcq_id)
+        except ValueError:
+            pass
+    return hashlib.sha256(mcq_id.encode('utf-8')).digest()[:ID_BYTES]
+
+
+def index_path(bank_path):
+    return bank_path + INDEX_SUFFIX
+
+
+def is_jsonl(path):
+    return path.endswith('.jsonl')
+
+
+def _encode(mcq):
+    return (json.dumps(mcq, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _scan(bank_path):
+    """Yield (offset, end, mcq) for every complete line; stop at a torn last line."""
+    with open(bank_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            if line.strip():
+                yield offset, offset + len(line), json.loads(line)
+            offset += len(line)
+
+
+def _build_index(bank_path):
+    """(index bytes, end of the last complete line) of a bank, built in memory from its lines."""
+    records = bytearray()
+    end = 0
+    for offset, end, mcq in _scan(bank_path):
+        records += INDEX_RECORD.pack(id_key(mcq.get('id') or mcq_id(mcq)), offset)
+    return bytes(records), end
+
+
+def rebuild_index(bank_path):
+    """Rewrite the sidecar index from the bank, dropping a torn last line left by a crash.
+
+    Only the bank's writer (or the reindex command) may call this: it truncates the bank.
+    """
+    records, end = _build_index(bank_path)
+    with open(index_path(bank_path) + '.tmp', 'wb') as idx:
+        idx.write(records)
+    if os.path.getsize(bank_path) > end:
+        os.truncate(bank_path, end)
+    os.replace(index_path(bank_path) + '.tmp', index_path(bank_path))
+
+
+def _index_valid(bank_path):
+    """True if the index covers the bank exactly, i.e. its last entry ends at EOF."""
+    path = index_path(bank_path)
+    if not os.path.exists(path):
+        return False
+    size = os.path.getsize(path)
+    if size % INDEX_RECORD.size:
+        return False
+    bank_size = os.path.getsize(bank_path)
+    if size == 0:
+        return bank_size == 0
+    with open(path, 'rb') as idx:
+        idx.seek(size - INDEX_RECORD.size)
+        _, offset = INDEX_RECORD.unpack(idx.read(INDEX_RECORD.size))
+    with open(bank_path, 'rb') as f:
+        f.seek(offset)
+        line = f.readline()
+        return line.endswith(b'\n') and f.tell() == bank_size
+
+
+def tag_mcq(mcq, source_name, bank_id):
+    """MCQ as stored in a bank: tagged with its source, bank and id.
+
+    An MCQ keeps the id it already has (the frontend logs answers and
+    progress by it); only MCQs without one get the stable mcq_id().
+    """
+    record = dict(mcq, source_file=source_name, bank_id=bank_id)
+    record['id'] = mcq.get('id') or mcq_id(record)
+    return record
+
+
+class BankWriter:
+    """Appends MCQs to a JSONL bank and its offset index as they are produced.
+
+    Every line is flushed as soon as it is written, so a crash loses at most
+    the MCQ being written. MCQs whose id is already in the bank are skipped.
+    """
+
+    def __init__(self, bank_path, source_name, bank_id):
+        self.bank_path = bank_path
+        self.source_name = source_name
+        self.bank_id = bank_id
+        if os.path.exists(bank_path) and not _index_valid(bank_path):
+            rebuild_index(bank_path)
+        self.keys = {key for key, _ in BankReader(bank_path).entries()} if os.path.exists(bank_path) else set()
+        self._bank = open(bank_path, 'ab')
+        self._index = open(index_path(bank_path), 'ab')
+
+    def append(self, mcq):
+        """Tag and append one MCQ; return False if it was already in the bank."""
+        record = tag_mcq(mcq, self.source_name, self.bank_id)
+        key = id_key(record['id'])
+        if key in self.keys:
+            return False
+        offset = self._bank.tell()
+        self._bank.write(_encode(record))
+        self._bank.flush()
+        self._index.write(INDEX_RECORD.pack(key, offset))
+        self._index.flush()
+        self.keys.add(key)
+        return True
+
+    def close(self):
+        self._bank.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BankReader:
+    """Random access into a bank through its sidecar index.
+
+    Readers never change the bank: when the index is missing or stale (a
+    writer is appending, or crashed mid-line) it is rebuilt in memory from
+    the complete lines. Legacy JSON banks are scanned once for the byte
+    offset of each MCQ object, so only the index stays in memory for them
+    too; their MCQs are tagged as json_to_jsonl would store them.
+    """
+
+    def __init__(self, bank_path):
+        self.bank_path = bank_path
+        self._legacy = None
+        if not is_jsonl(bank_path):
+            source_name, bank_id, self._index = _scan_legacy(bank_path)
+            self._legacy = (source_name, bank_id)
+        elif _index_valid(bank_path):
+            with open(index_path(bank_path), 'rb') as idx:
+                self._index = idx.read()
+        else:
+            self._index, _ = _build_index(bank_path)
+        self._positions = None
+
+    def __len__(self):
+        return len(self._index) // INDEX_RECORD.size
+
+    def _entry(self, position):
+        return INDEX_RECORD.unpack_from(self._index, position * INDEX_RECORD.size)
+
+    def entries(self):
+        """(12-byte id key, byte offset) for every MCQ, in bank order."""
+        return INDEX_RECORD.iter_unpack(self._index)
+
+    def read_at(self, offset):
+        """MCQ whose line starts at a byte offset taken from entries()."""
+        if self._legacy is not None:
+            return tag_mcq(_read_legacy_at(self.bank_path, offset), *self._legacy)
+        with open(self.bank_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def get(self, position):
+        """MCQ at a position, or IndexError."""
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self.read_at(self._entry(position)[1])
+
+    def position_of(self, mcq_id):
+        """Position of an MCQ id, or None."""
+        if self._positions is None:
+            self._positions = {self._entry(i)[0]: i for i in range(len(self))}
+        return self._positions.get(id_key(mcq_id))
+
+    def by_id(self, mcq_id):
+        """MCQ with the given id, or None."""
+        position = self.position_of(mcq_id)
+        return None if position is None else self.get(position)
+
+    def __iter__(self):
+        if self._legacy is not None:
+            return (self.read_at(offset) for _, offset in self.entries())
+        return (mcq for _, _, mcq in _scan(self.bank_path))
+
+
+def iter_bank(path):
+    """Stream the MCQs of a bank in either format.
+
+    JSONL banks are read line by line; legacy JSON banks have to be parsed whole.
+    """
+    if is_jsonl(path):
+        yield from (mcq for _, _, mcq in _scan(path))
+        return
+    with open(path, 'r') as f:
+        yield from json.load(f).get('mcqs', [])
+
+
+def bank_source_name(path):
+    """Source name a bank file was generated from."""
+    if not is_jsonl(path):
+        with open(path, 'r') as f:
+            return json.load(f).get('source_file')
+    first = next(iter_bank(path), None)
+    if first and first.get('source_file'):
+        return first['source_file']
+    return os.path.basename(path).replace('_mcqs.jsonl', '')
+
+
+def write_bank(bank_path, source_name, bank_id, mcqs):
+    """Atomically (re)write a whole JSONL bank and its index."""
+    tmp_path = bank_path + '.tmp'
+    for path in (tmp_path, index_path(tmp_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    with BankWriter(tmp_path, source_name, bank_id) as writer:
+        for mcq in mcqs:
+            writer.append(mcq)
+    os.replace(index_path(tmp_path), index_path(bank_path))
+    os.replace(tmp_path, bank_path)
+
+
+def sync_bank(bank_path, source_name, bank_id, mcqs):
+    """Make a JSONL bank hold exactly `mcqs`, rewriting it only if its contents differ.
+
+    A bank appended to while MCQs were generated is left as is when it
+    already holds the same MCQs, whatever their order.
+    """
+    wanted = {}
+    for mcq in mcqs:
+        record = tag_mcq(mcq, source_name, bank_id)
+        wanted.setdefault(record['id'], record)
+    if os.path.exists(bank_path) and _index_valid(bank_path):
+        existing = {mcq['id']: mcq for mcq in iter_bank(bank_path)}
+        if existing == wanted:
+            return False
+    write_bank(bank_path, source_name, bank_id, mcqs)
+    return True
+
+
+def _legacy_bank(json_path):
+    """(source name, bank id, MCQs) of a legacy {source_file, mcqs} bank."""
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    source_name = data.get('source_file') or os.path.basename(json_path).replace('_mcqs.json', '')
+    mcqs = data.get('mcqs', [])
+    bank_id = mcqs[0].get('bank_id') if mcqs and mcqs[0].get('bank_id') else derive_bank_id(source_name)
+    return source_name, bank_id, mcqs
+
+
+def _scan_legacy(json_path):
+    """(source name, bank id, index bytes) of a legacy bank, with the byte offset of each MCQ object.
+
+    The document is walked one value at a time and only each MCQ's identity
+    is kept until the ids are computed; repeated MCQs keep their first
+    occurrence, as in json_to_jsonl.
+    """
+    with open(json_path, 'rb') as f:
+        data = f.read()
+    text = data.decode('utf-8')
+    ascii_only = len(text) == len(data)
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'\s*')
+    skip = lambda i: whitespace.match(text, i).end()
+
+    source_name = os.path.basename(json_path).replace('_mcqs.json', '')
+    bank_id = None
+    identities = []  # (byte offset, existing id, MCQ fields mcq_id() needs)
+    i = skip(text.index('{') + 1)
+    while text[i] != '}':
+        key, i = decoder.raw_decode(text, i)
+        i = skip(skip(i) + 1)  # Past the ':'
+        if key != 'mcqs':
+            value, i = decoder.raw_decode(text, i)
+            if key == 'source_file' and value:
+                source_name = value
+        else:
+            i = skip(i + 1)  # Past the '['
+            byte_offset = char_offset = 0
+            while text[i] != ']':
+                byte_offset += i - char_offset if ascii_only else len(text[char_offset:i].encode('utf-8'))
+                char_offset = i
+                mcq, i = decoder.raw_decode(text, i)
+                if bank_id is None:
+                    bank_id = mcq.get('bank_id') or ''
+                identities.append((byte_offset, mcq.get('id'), {field: mcq.get(field) for field in IDENTITY_FIELDS}))
+                i = skip(i)
+                if text[i] == ',':
+                    i = skip(i + 1)
+            i += 1
+        i = skip(i)
+        if text[i] == ',':
+            i = skip(i + 1)
+
+    bank_id = bank_id or derive_bank_id(source_name)
+    records = {}
+    for offset, existing_id, fields in identities:
+        key = id_key(existing_id or mcq_id(dict(fields, bank_id=bank_id)))
+        records.setdefault(key, offset)
+    return source_name, bank_id, b''.join(INDEX_RECORD.pack(key, offset) for key, offset in records.items())
+
+
+def _read_legacy_at(json_path, offset):
+    """The MCQ object starting at a byte offset of a legacy bank, read a block at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    text = ''
+    with open(json_path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            block = f.read(8192)
+            text += decoder.decode(block, final=not block)
+            try:
+                return json.JSONDecoder().raw_decode(text)[0]
+            except ValueError:
+                if not block:
+                    raise
+
+
+def json_to_jsonl(json_path, jsonl_path=None):
+    """Convert a legacy {source_file, mcqs} bank to JSONL; return the new path."""
+    jsonl_path = jsonl_path or os.path.splitext(json_path)[0] + '.jsonl'
+    write_bank(jsonl_path, *_legacy_bank(json_path))
+    return jsonl_path
+
+
+def jsonl_to_json(jsonl_path, json_path=None):
+    """Convert a JSONL bank back to the {source_file, mcqs} format; return the new path."""
+    json_path = json_path or os.path.splitext(jsonl_path)[0] + '.json'
+    mcqs = list(iter_bank(jsonl_path))
+    with open(json_path, 'w') as f:
+        json.dump({'source_file': bank_source_name(jsonl_path), 'mcqs': mcqs}, f, indent=2)
+    return json_path
+
+
+def current_bank(bank_dir, source_name):
+    """Path of a source's bank in bank_dir, or None.
+
+    The JSONL bank is preferred unless a legacy JSON bank beside it is newer;
+    nothing is converted here (use `mcq_bank.py to-jsonl` for that).
+    """
+    jsonl_path = os.path.join(bank_dir, f"{source_name}_mcqs.jsonl")
+    json_path = os.path.join(bank_dir, f"{source_name}_mcqs.json")
+    if os.path.exists(json_path) and (not os.path.exists(jsonl_path)
+                                      or os.path.getmtime(json_path) > os.path.getmtime(jsonl_path)):
+        return json_path
+    return jsonl_path if os.path.exists(jsonl_path) else None
+
+
+def list_banks(bank_dirs):
+    """Paths of every bank in bank_dirs, one per source (see current_bank)."""
+    paths = []
+    for bank_dir in bank_dirs:
+        if not os.path.isdir(bank_dir):
+            continue
+        sources = sorted({name[:-len('_mcqs.json')] if name.endswith('_mcqs.json') else name[:-len('_mcqs.jsonl')]
+                          for name in os.listdir(bank_dir) if name.endswith(('_mcqs.json', '_mcqs.jsonl'))})
+        paths.extend(current_bank(bank_dir, source) for source in sources)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert MCQ banks between JSON and JSONL')
+    parser.add_argument('command', choices=['to-jsonl', 'to-json', 'reindex'])
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        if args.command == 'to-jsonl':
+            print(f"✅ {path} → {json_to_jsonl(path)}")
+        elif args.command == 'to-json':
+            print(f"✅ {path} → {jsonl_to_json(path)}")
+        else:
+            rebuild_index(path)
+            print(f"✅ Reindexed {path} ({len(BankReader(path))} MCQs)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import hashlib
+from datetime import datetime
+
+# One append-only journal per source file lives here
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'journals')
+
+
+def factoid_hash(factoid):
+    """Stable identifier for a factoid's text."""
+    return hashlib.sha256(factoid.strip().encode('utf-8')).hexdigest()[:24]
+
+
+def source_name(source_file):
+    """Canonical journal key of a source: its bare name, whether given as X, X.txt, X.pdf or X_factoids.json."""
+    name = os.path.basename(source_file)
+    for suffix in ('_factoids.json', '.txt', '.pdf'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def journal_path(source_file, journal_dir=JOURNAL_DIR):
+    """Journal file for a source; the name hash keeps distinct sources apart after sanitizing."""
+    safe_name = re.sub(r'[^\w.-]+', '_', os.path.basename(source_file)).strip('_') or 'source'
+    name_hash = hashlib.sha256(source_file.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(journal_dir, f"{safe_name}.{name_hash}.jsonl")
+
+
+class MCQJournal:
+    """Append-only record of MCQs generated for one source file, keyed by factoid hash.
+
+    Each line is a JSON event:
+      {"event": "mcq", "factoid_hash": ..., "mcq": {...}, "completed_at": ...}
+      {"event": "saved", "factoid_hashes": [...], "completed_at": ...}
+    A line is written (and fsynced) as soon as its MCQ exists, so a crash loses
+    at most the requests that were in flight. A torn final line is ignored.
+
+    Every pipeline opens the journal of a source under its source_name(),
+    so switching between them resumes rather than regenerates.
+    """
+
+    def __init__(self, source_file, journal_dir=JOURNAL_DIR):
+        self.source_file = source_name(source_file)
+        self.path = journal_path(self.source_file, journal_dir)
+        self.completed = {}
+        self.saved = set()
+        self._torn_tail = False
+        os.makedirs(journal_dir, exist_ok=True)
+        # Journal an older run kept under the transcript's file name
+        legacy_path = journal_path(f"{self.source_file}.txt", journal_dir)
+        if os.path.exists(legacy_path) and not os.path.exists(self.path):
+            os.replace(legacy_path, self.path)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        line = ''
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partially written line from a crash
+                if entry.get('event') == 'mcq':
+                    self.completed[entry['factoid_hash']] = entry['mcq']
+                elif entry.get('event') == 'saved':
+                    self.saved.update(entry['factoid_hashes'])
+            self._torn_tail = bool(line) and not line.endswith('\n')
+
+    def _append(self, entry):
+        # A single O_APPEND write per line keeps concurrent writers from interleaving
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        if self._torn_tail:
+            # Terminate the torn line so this entry starts on a fresh one
+            line = '\n' + line
+            self._torn_tail = False
+        line = line.encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def is_done(self, factoid):
+        return factoid_hash(factoid) in self.completed
+
+    def pending(self, factoids):
+        """Factoids that still need an MCQ, in their original order."""
+        return [f for f in factoids if not self.is_done(f)]
+
+    def unsaved(self, factoids):
+        """Factoids whose MCQ was generated but never confirmed as saved to the database."""
+        return [
+            f for f in factoids
+            if factoid_hash(f) in self.completed and factoid_hash(f) not in self.saved
+        ]
+
+    def mcqs_for(self, factoids):
+        """Completed MCQs for `factoids`, in factoid order."""
+        return [self.completed[h] for h in map(factoid_hash, factoids) if h in self.completed]
+
+    def record(self, factoid, mcq):
+        key = factoid_hash(factoid)
+        self._append({
+            'event': 'mcq',
+            'factoid_hash': key,
+            'mcq': mcq,
+            'completed_at': datetime.now().isoformat()
+        })
+        self.completed[key] = mcq
+
+    def mark_saved(self, factoids):
+        """Record that the MCQs for these factoids are in the database."""
+        keys = [factoid_hash(f) for f in factoids]
+        self._append({
+            'event': 'saved',
+            'factoid_hashes': keys,
+            'completed_at': datetime.now().isoformat()
+        })
+        self.saved.update(keys)
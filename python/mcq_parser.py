@@ -0,0 +1,232 @@
+import os
+import re
+import json
+from enum import Enum
+from collections import Counter, namedtuple
+
+# Choices every MCQ must have: one correct answer and four distractors
+CHOICE_COUNT = int(os.getenv("MCQ_CHOICE_COUNT", "5"))
+
+REQUIRED_FIELDS = ['question', 'answerChoices', 'explanation', 'factoid']
+
+CODE_FENCE = re.compile(r'```(?:json|JSON)?\s*\n?(.*?)(?:```|$)', re.DOTALL)
+
+
+class FailureReason(str, Enum):
+    NO_JSON = 'no_json'
+    INVALID_JSON = 'invalid_json'
+    TRUNCATED = 'truncated'
+    NOT_AN_OBJECT = 'not_an_object'
+    MISSING_FIELDS = 'missing_fields'
+    EMPTY_FIELD = 'empty_field'
+    BAD_CHOICES = 'bad_choices'
+    WRONG_CHOICE_COUNT = 'wrong_choice_count'
+    NO_CORRECT_ANSWER = 'no_correct_answer'
+    MULTIPLE_CORRECT_ANSWERS = 'multiple_correct_answers'
+    MISSING_ITEM = 'missing_item'
+
+
+# mcq is the validated dict, or None with reason/detail explaining why
+ParseResult = namedtuple('ParseResult', ['mcq', 'reason', 'detail'])
+
+# Outcome counts for the whole process: 'ok', 'repaired', or a FailureReason value
+outcomes = Counter()
+
+
+class MCQParseError(ValueError):
+    def __init__(self, reason, detail=''):
+        super().__init__(f"{reason.value}: {detail}" if detail else reason.value)
+        self.reason = reason
+        self.detail = detail
+
+
+def strip_code_fences(text):
+    match = CODE_FENCE.search(text)
+    return match.group(1) if match else text
+
+
+def extract_json_text(text):
+    """Return the first balanced JSON object or array in text, closing it if truncated.
+
+    Returns (json_text, closed). A truncated array is cut back to its last
+    complete element; otherwise the open strings and brackets are closed and
+    `closed` is True, meaning the last value in json_text is cut off.
+    """
+    start = next((i for i, ch in enumerate(text) if ch in '{['), None)
+    if start is None:
+        raise MCQParseError(FailureReason.NO_JSON, "no '{' or '[' in completion")
+
+    stack = []
+    in_string = escaped = False
+    last_element_end = None  # End of the last complete element of a top-level array
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            if not stack or stack[-1] != ch:
+                raise MCQParseError(FailureReason.INVALID_JSON, f"unbalanced '{ch}' at offset {i}")
+            stack.pop()
+            if not stack:
+                return text[start:i + 1], False
+            if len(stack) == 1 and stack[0] == ']':
+                last_element_end = i + 1
+
+    # Ran out of text: the completion was truncated
+    if stack[0] == ']' and last_element_end is not None:
+        return text[start:last_element_end] + ']', False
+    closing = ('"' if in_string else '') + ''.join(reversed(stack))
+    return text[start:].rstrip().rstrip(',') + closing, True
+
+
+def remove_trailing_commas(json_text):
+    """Drop commas directly before a closing bracket, ignoring string contents."""
+    out = []
+    in_string = escaped = False
+    for ch in json_text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '}]':
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+        out.append(ch)
+    return ''.join(out)
+
+
+def load_json(text):
+    """Parse the first JSON value in a completion, repairing common defects.
+
+    Returns (value, repaired, closed); `closed` means the completion was cut
+    off inside the value's last object, which parsed only after its strings
+    and brackets were closed.
+    """
+    try:
+        return json.loads(text), False, False
+    except json.JSONDecodeError:
+        pass
+    json_text, closed = extract_json_text(strip_code_fences(text))
+    try:
+        return json.loads(json_text), True, closed
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(remove_trailing_commas(json_text)), True, closed
+    except json.JSONDecodeError as e:
+        reason = FailureReason.TRUNCATED if closed else FailureReason.INVALID_JSON
+        raise MCQParseError(reason, str(e))
+
+
+def _coerce_bool(value):
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    return value
+
+
+def validate_mcq(mcq, choice_count=CHOICE_COUNT):
+    """Check an MCQ against the full schema, raising MCQParseError on the first problem."""
+    if not isinstance(mcq, dict):
+        raise MCQParseError(FailureReason.NOT_AN_OBJECT, type(mcq).__name__)
+    missing = [field for field in REQUIRED_FIELDS if field not in mcq]
+    if missing:
+        raise MCQParseError(FailureReason.MISSING_FIELDS, ', '.join(missing))
+    for field in ('question', 'explanation', 'factoid'):
+        if not isinstance(mcq[field], str) or not mcq[field].strip():
+            raise MCQParseError(FailureReason.EMPTY_FIELD, field)
+
+    choices = mcq['answerChoices']
+    if not isinstance(choices, list) or not all(
+            isinstance(c, dict) and isinstance(c.get('value'), str) and c['value'].strip() for c in choices):
+        raise MCQParseError(FailureReason.BAD_CHOICES, "answerChoices must be a list of {value, correct}")
+    for choice in choices:
+        choice['correct'] = _coerce_bool(choice.get('correct'))
+        if not isinstance(choice['correct'], bool):
+            raise MCQParseError(FailureReason.BAD_CHOICES, f"non-boolean 'correct' on {choice['value']!r}")
+    if len(choices) != choice_count:
+        raise MCQParseError(FailureReason.WRONG_CHOICE_COUNT, f"{len(choices)} choices, expected {choice_count}")
+
+    correct = sum(1 for c in choices if c['correct'])
+    if correct == 0:
+        raise MCQParseError(FailureReason.NO_CORRECT_ANSWER)
+    if correct > 1:
+        raise MCQParseError(FailureReason.MULTIPLE_CORRECT_ANSWERS, f"{correct} choices marked correct")
+    return mcq
+
+
+def _record(result, repaired=False):
+    outcomes[result.reason.value if result.reason else ('repaired' if repaired else 'ok')] += 1
+    return result
+
+
+def parse_mcq(completion, choice_count=CHOICE_COUNT):
+    """Parse one MCQ completion into a ParseResult.
+
+    A completion cut off mid-object fails as TRUNCATED even if closing it
+    would give a valid MCQ, since its last field is incomplete.
+    """
+    try:
+        value, repaired, closed = load_json(completion or '')
+        if closed:
+            raise MCQParseError(FailureReason.TRUNCATED, "completion ends inside the MCQ object")
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        return _record(ParseResult(validate_mcq(value, choice_count), None, ''), repaired)
+    except MCQParseError as e:
+        return _record(ParseResult(None, e.reason, e.detail))
+
+
+def parse_mcq_array(completion, count, choice_count=CHOICE_COUNT):
+    """Parse a completion holding an array of `count` MCQs into `count` ParseResults.
+
+    Each element is validated on its own; an element the completion was cut
+    off inside fails with TRUNCATED, and elements missing from a short or
+    truncated array fail with MISSING_ITEM.
+    """
+    try:
+        items, repaired, closed = load_json(completion or '')
+    except MCQParseError as e:
+        return [_record(ParseResult(None, e.reason, e.detail)) for _ in range(count)]
+    if not isinstance(items, list):
+        items = [items]
+
+    results = []
+    for i, item in enumerate(items[:count]):
+        if closed and i == len(items) - 1:
+            results.append(_record(ParseResult(None, FailureReason.TRUNCATED, "completion ends inside this item")))
+            continue
+        try:
+            results.append(_record(ParseResult(validate_mcq(item, choice_count), None, ''), repaired))
+        except MCQParseError as e:
+            results.append(_record(ParseResult(None, e.reason, e.detail)))
+    while len(results) < count:
+        results.append(_record(ParseResult(None, FailureReason.MISSING_ITEM, f"array had {len(items)} items")))
+    return results
+
+
+def print_parse_stats():
+    if not outcomes:
+        return
+    total = sum(outcomes.values())
+    usable = outcomes['ok'] + outcomes['repaired']
+    print(f"🧾 MCQ parsing: {usable}/{total} usable ({outcomes['repaired']} repaired)")
+    for reason, count in outcomes.most_common():
+        if reason not in ('ok', 'repaired'):
+            print(f"   - {reason}: {count}")
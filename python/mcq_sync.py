@@ -0,0 +1,102 @@
+import json
+import hashlib
+from datetime import datetime
+from collections import namedtuple
+from pymongo import InsertOne, UpdateOne, DeleteMany
+from pymongo.errors import BulkWriteError
+import telemetry
+
+# Fields that make up a question's identity; editing any other field updates it in place
+IDENTITY_FIELDS = ['bank_id', 'factoid', 'question']
+
+# Fields stored for every MCQ and compared to detect updates
+CONTENT_FIELDS = ['question', 'answerChoices', 'explanation', 'factoid', 'source_file', 'bank_id']
+
+SyncResult = namedtuple('SyncResult', ['inserted', 'updated', 'deleted', 'unchanged', 'duplicates'])
+
+
+def _digest(values):
+    return hashlib.sha256(json.dumps(values, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def mcq_id(mcq):
+    """Stable id for an MCQ: the same bank, factoid and question always get the same id."""
+    return _digest([(mcq.get(field) or '').strip() for field in IDENTITY_FIELDS])[:24]
+
+
+def content_hash(mcq):
+    """Hash of every stored field, used to skip writes for unchanged MCQs."""
+    return _digest([mcq.get(field) for field in CONTENT_FIELDS])
+
+
+def build_documents(mcqs, source_file, bank_id):
+    """Turn MCQs into documents keyed by their stable id.
+
+    Returns (documents_by_id, duplicate_count); repeated MCQs keep their first occurrence.
+    """
+    documents = {}
+    duplicates = 0
+    for mcq in mcqs:
+        doc = {field: mcq.get(field) for field in CONTENT_FIELDS}
+        doc['source_file'] = source_file
+        doc['bank_id'] = bank_id
+        doc_id = mcq_id(doc)
+        if doc_id in documents:
+            duplicates += 1
+            continue
+        doc['_id'] = doc_id
+        doc['content_hash'] = content_hash(doc)
+        documents[doc_id] = doc
+    return documents, duplicates
+
+
+def sync_mcqs(collection, mcqs, source_file, bank_id, delete_missing=True):
+    """Make the stored MCQs of one bank match `mcqs` with as few writes as possible.
+
+    Existing documents for the source file or bank are compared by id and
+    content hash; only inserts, updates and (with delete_missing) deletes of
+    stale documents are sent, as one unordered bulk write.
+    """
+    documents, duplicates = build_documents(mcqs, source_file, bank_id)
+    if delete_missing:
+        query = {'$or': [{'source_file': source_file}, {'bank_id': bank_id}]}
+    else:
+        query = {'_id': {'$in': list(documents)}}
+    existing = {doc['_id']: doc.get('content_hash') for doc in collection.find(query, {'_id': 1, 'content_hash': 1})}
+
+    now = datetime.utcnow()
+    operations = []
+    inserted = updated = unchanged = 0
+    for doc_id, doc in documents.items():
+        if doc_id not in existing:
+            operations.append(InsertOne(dict(doc, created_at=now)))
+            inserted += 1
+        elif existing[doc_id] != doc['content_hash']:
+            fields = {key: value for key, value in doc.items() if key != '_id'}
+            operations.append(UpdateOne({'_id': doc_id}, {'$set': dict(fields, updated_at=now)}))
+            updated += 1
+        else:
+            unchanged += 1
+
+    stale = [doc_id for doc_id in existing if doc_id not in documents] if delete_missing else []
+    if stale:
+        operations.append(DeleteMany({'_id': {'$in': stale}}))
+
+    if operations:
+        try:
+            with telemetry.timed('db_write_seconds', collection=collection.name):
+                collection.bulk_write(operations, ordered=False)
+            telemetry.increment('db_documents_written_total', len(operations), collection=collection.name)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            print(f"⚠️  {len(errors)} of {len(operations)} writes failed for {source_file}: "
+                  f"{errors[0].get('errmsg') if errors else e}")
+            raise
+    return SyncResult(inserted, updated, len(stale), unchanged, duplicates)
+
+
+def print_sync_result(result, label):
+    print(f"✅ {label}: {result.inserted} inserted, {result.updated} updated, "
+          f"{result.deleted} deleted, {result.unchanged} unchanged")
+    if result.duplicates:
+        print(f"   ({result.duplicates} duplicate MCQs in the input were skipped)")
@@ -0,0 +1,141 @@
+import os
+import re
+from collections import Counter, deque
+from text_chunker import estimate_tokens
+
+# Removed wherever they appear on a page (case-insensitive): watermarks
+DEFAULT_STRIP_PATTERNS = [
+    r'mehlmanmedical\.com',
+]
+
+# Page-number lines, removed only from a page's edge lines so number-only body lines (lab values) stay
+PAGE_NUMBER = re.compile(r'^[ \t]*(?:page[ \t]*)?\d{1,4}(?:[ \t]*(?:of|/)[ \t]*\d{1,4})?[ \t]*$', re.IGNORECASE)
+
+# Extra patterns, separated by "||", e.g. TRANSCRIBE_STRIP_PATTERNS='©\s*\d{4} Acme||Confidential'
+EXTRA_STRIP_PATTERNS = [p for p in os.getenv("TRANSCRIBE_STRIP_PATTERNS", "").split('||') if p.strip()]
+
+# A line within EDGE_LINES of the top or bottom of a page is a running header/footer when it
+# appears on at least REPEAT_MIN_PAGES pages and REPEAT_FRACTION of the pages in the sliding
+# window of REPEAT_WINDOW_PAGES around it, so a chapter's running header counts within its chapter
+EDGE_LINES = int(os.getenv("TRANSCRIBE_EDGE_LINES", "3"))
+REPEAT_MIN_PAGES = int(os.getenv("TRANSCRIBE_REPEAT_MIN_PAGES", "3"))
+REPEAT_FRACTION = float(os.getenv("TRANSCRIBE_REPEAT_FRACTION", "0.5"))
+REPEAT_WINDOW_PAGES = int(os.getenv("TRANSCRIBE_REPEAT_WINDOW_PAGES", "16"))
+
+# Pages held back so each page is also judged against the pages after it; part of the window
+WARMUP_PAGES = int(os.getenv("TRANSCRIBE_WARMUP_PAGES", "8"))
+
+# Lines longer than this are body text, never headers
+MAX_HEADER_CHARS = 120
+
+STRIP = re.compile('|'.join(f'(?:{p})' for p in DEFAULT_STRIP_PATTERNS + EXTRA_STRIP_PATTERNS),
+                   re.IGNORECASE | re.MULTILINE)
+BLANK_RUNS = re.compile(r'\n[ \t]*(?:\n[ \t]*){2,}')
+DIGITS = re.compile(r'\d+')
+
+
+def _edge_indices(lines):
+    """Indices of the first and last EDGE_LINES non-blank lines of a page."""
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    return set(content[:EDGE_LINES] + content[-EDGE_LINES:])
+
+
+def strip_patterns(text):
+    """Remove watermarks anywhere and page-number lines at the page edges (safe to run in worker processes)."""
+    lines = STRIP.sub('', text).split('\n')
+    for i in _edge_indices(lines):
+        lines[i] = PAGE_NUMBER.sub('', lines[i])
+    return '\n'.join(lines)
+
+
+def line_key(line):
+    """Comparison key for a header line: case, spacing and page numbers don't matter."""
+    return DIGITS.sub('#', ' '.join(line.lower().split()))
+
+
+def _edge_keys(lines):
+    """Keys of the candidate header/footer lines of a page, each counted once."""
+    edges = (lines[i] for i in _edge_indices(lines))
+    return {line_key(line) for line in edges if len(line) <= MAX_HEADER_CHARS}
+
+
+class PageNormalizer:
+    """Strips running headers, footers and watermarks from a document's pages as they stream in.
+
+    Each page's edge lines are counted in a frequency table over a sliding
+    window of pages; a page is emitted once the `warmup` pages after it
+    have been seen, with the edge lines that repeat within the window
+    removed and blank runs collapsed. Characters and estimated tokens
+    before and after are tallied per document.
+    """
+
+    def __init__(self, warmup=WARMUP_PAGES, window=REPEAT_WINDOW_PAGES):
+        self.warmup = warmup
+        self.window = max(window, warmup + 1)
+        self.counts = Counter()
+        self._window_keys = deque()  # edge keys of each page in the window, oldest first
+        self.pages_seen = 0
+        self.chars_in = self.chars_out = 0
+        self.tokens_in = self.tokens_out = 0
+        self.lines_dropped = 0
+        self._pending = deque()
+
+    def add(self, page_num, text, raw_chars=None, raw_tokens=None):
+        """Take a pattern-stripped page; return the (page_num, text) pages now ready, in order."""
+        self.chars_in += len(text) if raw_chars is None else raw_chars
+        self.tokens_in += estimate_tokens(text) if raw_tokens is None else raw_tokens
+        lines = text.split('\n')
+        keys = _edge_keys(lines)
+        self.counts.update(keys)
+        self._window_keys.append(keys)
+        self.pages_seen += 1
+        self._pending.append((page_num, lines))
+        ready = []
+        while len(self._pending) > self.warmup:
+            ready.append(self._emit(*self._pending.popleft()))
+        return ready
+
+    def finish(self):
+        """The pages still held back."""
+        ready = [self._emit(*page) for page in self._pending]
+        self._pending.clear()
+        return ready
+
+    def _is_repeated(self, key):
+        return self.counts[key] >= max(REPEAT_MIN_PAGES, REPEAT_FRACTION * len(self._window_keys))
+
+    def _slide(self):
+        # Drop the oldest page once the window is full; called after a page is emitted
+        while len(self._window_keys) >= self.window:
+            for key in self._window_keys.popleft():
+                self.counts[key] -= 1
+                if not self.counts[key]:
+                    del self.counts[key]
+
+    def _emit(self, page_num, lines):
+        edges = _edge_indices(lines)
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edges and len(line) <= MAX_HEADER_CHARS and self._is_repeated(line_key(line)):
+                self.lines_dropped += 1
+                continue
+            kept.append(line.rstrip())
+        text = BLANK_RUNS.sub('\n\n', '\n'.join(kept)).strip()
+        self.chars_out += len(text)
+        self.tokens_out += estimate_tokens(text) if text else 0
+        self._slide()
+        return page_num, text
+
+    def stats(self):
+        return {
+            'pages': self.pages_seen,
+            'chars_saved': self.chars_in - self.chars_out,
+            'tokens_saved': self.tokens_in - self.tokens_out,
+            'lines_dropped': self.lines_dropped,
+        }
+
+    def print_report(self, name):
+        stats = self.stats()
+        share = stats['tokens_saved'] / self.tokens_in * 100 if self.tokens_in else 0
+        print(f"🧹 {name}: stripped {stats['chars_saved']} characters (~{stats['tokens_saved']} tokens, "
+              f"{share:.1f}%) of boilerplate, {stats['lines_dropped']} repeated header/footer lines")
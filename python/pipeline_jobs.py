@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from transcribe_pdf import transcribe_pdf_file
+from generate_factoids import chunk_transcript, generate_factoids_for_chunks, write_factoids_file, MAX_FACTOIDS
+from factoid_dedup import dedupe_factoids
+from pipeline_manifest import hash_file
+from job_queue import JobQueue, JobSpec, Heartbeat, worker_name, print_status, QUEUE_PATH
+
+# Stages in pipeline order; later stages are leased first so started books finish before new ones begin
+STAGES = ('transcribe', 'factoids', 'collect_factoids', 'mcqs', 'finalize')
+PRIORITIES = {stage: rank for rank, stage in enumerate(STAGES)}
+
+# Transcript chunks per factoid job and factoids per MCQ job
+CHUNKS_PER_JOB = int(os.getenv("JOB_CHUNKS_PER_JOB", "4"))
+FACTOIDS_PER_JOB = int(os.getenv("JOB_FACTOIDS_PER_JOB", "25"))
+
+# How long an idle worker waits before asking for a job again
+POLL_SECONDS = 2.0
+
+# Crashed workers replaced per worker slot before run_workers stops replacing them
+MAX_RESPAWNS_PER_WORKER = 3
+
+# PDF extraction processes per worker, set by work(); the cores are split between the workers
+_transcribe_pool = None
+
+
+def _paths(job):
+    payload = job.payload
+    return (os.path.join(payload['transcribed_dir'], f"{job.source}.txt"),
+            os.path.join(payload['factoids_dir'], f"{job.source}_factoids.json"),
+            os.path.join(payload['mcqs_dir'], f"{job.source}_mcqs.jsonl"))
+
+
+def _report_failed(job, stage, unit):
+    failed = job.payload.get('failed', {}).get(stage)
+    if failed:
+        ranges = ', '.join(f"{start}–{end}" for start, end in failed)
+        print(f"⚠️  {job.source}: skipping {unit} {ranges}; their {stage} jobs failed for good")
+    return failed or []
+
+
+def run_transcribe(queue, job):
+    """PDF → transcript, then one factoid job per CHUNKS_PER_JOB chunks."""
+    transcript_path, page_count, seconds = transcribe_pdf_file(
+        job.payload['pdf_path'], job.payload['transcribed_dir'], pool=_transcribe_pool)
+    chunk_count = len(chunk_transcript(transcript_path))
+    follow_ups = [JobSpec(job.source, 'factoids', start, min(start + CHUNKS_PER_JOB, chunk_count), job.payload,
+                          then_stage='collect_factoids')
+                  for start in range(0, chunk_count, CHUNKS_PER_JOB)]
+    if not follow_ups:
+        follow_ups = [JobSpec(job.source, 'collect_factoids', payload=job.payload)]
+    return {'pages': page_count, 'chunks': chunk_count}, follow_ups
+
+
+def run_factoids(queue, job):
+    """Factoids for chunks [start, end) of the transcript; any failed chunk fails the job so it is retried."""
+    transcript_path, _, _ = _paths(job)
+    chunks = chunk_transcript(transcript_path)[job.start:job.end]
+    results = generate_factoids_for_chunks(chunks)
+    failed = sum(1 for r in results if r is None)
+    if failed:
+        raise RuntimeError(f"{failed}/{len(chunks)} chunks failed")
+    return results, []
+
+
+def run_collect_factoids(queue, job):
+    """Merge every factoid job's output into the factoids file, then one MCQ job per FACTOIDS_PER_JOB factoids."""
+    transcript_path, _, _ = _paths(job)
+    failed = _report_failed(job, 'factoids', 'chunks')
+    factoids = [f for chunk_results in queue.results(job.source, 'factoids')
+                for chunk_factoids in chunk_results for f in chunk_factoids]
+    factoids, _ = dedupe_factoids(factoids)
+    factoids = factoids[:MAX_FACTOIDS]
+    write_factoids_file(transcript_path, job.payload['factoids_dir'], factoids)
+    follow_ups = [JobSpec(job.source, 'mcqs', start, min(start + FACTOIDS_PER_JOB, len(factoids)), job.payload,
+                          then_stage='finalize')
+                  for start in range(0, len(factoids), FACTOIDS_PER_JOB)]
+    if not follow_ups:
+        follow_ups = [JobSpec(job.source, 'finalize', payload=job.payload)]
+    return {'factoids': len(factoids), 'failed_chunk_ranges': failed}, follow_ups
+
+
+def run_mcqs(queue, job):
+    """MCQs for factoids [start, end); individual failures are dropped as in the other pipelines."""
+    from generate_mcqs import generate_mcqs_for_factoids  # Connects to MongoDB on import
+    _, factoids_path, _ = _paths(job)
+    with open(factoids_path, 'r', encoding='utf-8') as f:
+        factoids = json.load(f)['factoids'][job.start:job.end]
+    mcqs = generate_mcqs_for_factoids(factoids)
+    if factoids and not any(mcqs):
+        raise RuntimeError(f"all {len(factoids)} MCQs failed")
+    return mcqs, []
+
+
+def run_finalize(queue, job):
+    """Write the source's MCQ bank from every MCQ job's output and import it into MongoDB."""
+    from generate_mcqs import write_mcqs_file
+    from test_pipeline import import_to_mongodb
+    _, _, mcqs_path = _paths(job)
+    failed = _report_failed(job, 'mcqs', 'factoids')
+    mcqs = [mcq for batch in queue.results(job.source, 'mcqs') for mcq in batch if mcq]
+    write_mcqs_file(mcqs_path, job.source, mcqs)
+    if not import_to_mongodb(mcqs_path, job.source):
+        raise RuntimeError("MongoDB import failed")
+    return {'mcqs': len(mcqs), 'failed_factoid_ranges': failed}, []
+
+
+HANDLERS = {
+    'transcribe': run_transcribe,
+    'factoids': run_factoids,
+    'collect_factoids': run_collect_factoids,
+    'mcqs': run_mcqs,
+    'finalize': run_finalize,
+}
+
+
+def open_queue(path=QUEUE_PATH):
+    return JobQueue(path, priorities=PRIORITIES)
+
+
+def describe(job):
+    return f"{job.source} {job.stage}" + (f" [{job.start}:{job.end}]" if job.end else '')
+
+
+def enqueue_pdfs(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, force=False, queue_path=QUEUE_PATH):
+    """Queue a transcribe job for every PDF that is new or changed since it was last queued."""
+    queue = open_queue(queue_path)
+    added = 0
+    try:
+        for pdf in sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')):
+            source = os.path.splitext(pdf)[0]
+            pdf_path = os.path.abspath(os.path.join(pdf_dir, pdf))
+            pdf_hash = hash_file(pdf_path)
+            jobs = queue.source_jobs(source)
+            if jobs:
+                if any(status == 'leased' for _, status, _ in jobs):
+                    print(f"⏭️  {pdf}: jobs are running, leaving it alone")
+                    continue
+                if not force and json.loads(jobs[0][2]).get('pdf_hash') == pdf_hash:
+                    print(f"⏭️  {pdf}: already queued")
+                    continue
+                queue.reset_source(source)
+            payload = {
+                'pdf_path': pdf_path,
+                'pdf_hash': pdf_hash,
+                'transcribed_dir': os.path.abspath(transcribed_dir),
+                'factoids_dir': os.path.abspath(factoids_dir),
+                'mcqs_dir': os.path.abspath(mcqs_dir),
+            }
+            added += queue.enqueue([JobSpec(source, 'transcribe', payload=payload)])
+            print(f"📥 Queued {pdf}")
+    finally:
+        queue.close()
+    return added
+
+
+def work(queue_path=QUEUE_PATH, transcribe_processes=1):
+    """Worker process body: lease and run jobs until the queue has no pending or running jobs left."""
+    global _transcribe_pool
+    _transcribe_pool = ProcessPoolExecutor(max_workers=transcribe_processes)
+    queue = open_queue(queue_path)
+    worker = worker_name()
+    finished = 0
+    try:
+        while True:
+            job = queue.lease(worker)
+            if job is None:
+                if not queue.has_work():
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+
+            print(f"🔧 [{worker}] {describe(job)} (attempt {job.attempts})")
+            started = time.time()
+            try:
+                with Heartbeat(queue, job, worker) as heartbeat:
+                    result, follow_ups = HANDLERS[job.stage](queue, job)
+            except Exception as e:
+                print(f"❌ [{worker}] {describe(job)} failed: {str(e)}")
+                traceback.print_exc()
+                queue.fail(job, e, worker)
+                continue
+            if heartbeat.lost or not queue.complete(job, result, follow_ups, worker):
+                print(f"⚠️  [{worker}] Lost the lease on {describe(job)}; another worker is redoing it")
+                continue
+            finished += 1
+            print(f"✅ [{worker}] {describe(job)} done in {time.time() - started:.1f}s")
+    finally:
+        queue.close()
+        _transcribe_pool.shutdown()
+    print(f"👋 [{worker}] Queue drained after {finished} jobs")
+
+
+def run_workers(workers, queue_path=QUEUE_PATH):
+    """Drain the queue with `workers` processes, replacing any that crash while work remains."""
+    context = multiprocessing.get_context('spawn')
+    queue = open_queue(queue_path)
+    # Split the cores between the workers rather than giving each a full-size extraction pool
+    transcribe_processes = max(1, (os.cpu_count() or 1) // workers)
+
+    def spawn():
+        process = context.Process(target=work, args=(queue_path, transcribe_processes))
+        process.start()
+        return process
+
+    processes = [spawn() for _ in range(workers)]
+    respawns = workers * MAX_RESPAWNS_PER_WORKER
+    print(f"🚀 Started {workers} workers on {queue_path}")
+    try:
+        while processes:
+            time.sleep(1)
+            for i, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                processes[i] = None
+                if process.exitcode == 0 or not queue.has_work():
+                    continue
+                # Its job's lease expires and is picked up again; keep the worker count up
+                print(f"💥 Worker {process.pid} died (exit code {process.exitcode})")
+                if respawns:
+                    respawns -= 1
+                    processes[i] = spawn()
+                elif not any(processes):
+                    print("❌ Workers keep dying; giving up (the queue keeps its jobs for the next run)")
+            processes = [p for p in processes if p is not None]
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping workers; their jobs are leased again once the leases expire")
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        status = queue.status()
+        queue.close()
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the PDF pipeline as leased jobs in a local SQLite queue')
+    parser.add_argument('--queue', default=QUEUE_PATH, help='queue database path')
+    commands = parser.add_subparsers(dest='command', required=True)
+    enqueue = commands.add_parser('enqueue', help='queue every new or changed PDF in python/pdfs')
+    enqueue.add_argument('--force', action='store_true', help='requeue PDFs even if unchanged')
+    run = commands.add_parser('work', help='drain the queue with worker processes')
+    run.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    commands.add_parser('status', help='show queue depth and throughput')
+    commands.add_parser('retry-failed', help='put failed jobs back in the queue')
+    args = parser.parse_args(argv)
+
+    if args.command == 'enqueue':
+        from test_pipeline import ensure_directories
+        print(f"\n📥 {enqueue_pdfs(*ensure_directories(), force=args.force, queue_path=args.queue)} PDFs queued")
+    elif args.command == 'work':
+        print_status(run_workers(args.workers, args.queue))
+    elif args.command == 'retry-failed':
+        queue = open_queue(args.queue)
+        print(f"🔁 {queue.retry_failed()} failed jobs queued again")
+        queue.close()
+    else:
+        queue = open_queue(args.queue)
+        print_status(queue.status())
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+
+# Build state for the PDF → transcript → factoids → MCQs pipeline
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline_manifest.json')
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text):
+    return hash_bytes(text.encode('utf-8'))
+
+
+def hash_file(path, block_size=1 << 20):
+    """Hash a file's contents without reading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PipelineManifest:
+    """Content hashes for every source and the artifacts derived from them.
+
+    Layout, per source PDF name:
+      pdf_hash          hash of the PDF bytes the transcript was built from
+      transcript        {path, hash}
+      chunks            chunk text hash → factoids generated from that chunk
+      factoids_file     {path, hash}
+      factoids          factoid hashes in the factoids file
+      mcqs_file         {path, hash, factoids_hash}
+      imported_hash     hash of the MCQ file last imported into MongoDB
+    A stage reruns only when the hash of its input differs from the one
+    recorded for its output.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.data = {'version': 1, 'sources': {}}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def source(self, name):
+        return self.data['sources'].setdefault(name, {})
+
+    def artifact_current(self, entry, key, path):
+        """True if `path` exists and still has the hash recorded under entry[key]."""
+        recorded = entry.get(key)
+        return bool(recorded) and recorded.get('path') == path and os.path.exists(path) \
+            and hash_file(path) == recorded.get('hash')
+
+    def record_artifact(self, entry, key, path, **extra):
+        entry[key] = dict({'path': path, 'hash': hash_file(path)}, **extra)
+
+    def save(self):
+        """Atomically write the manifest so a crash never leaves it half-written."""
+        self.data['updated_at'] = datetime.now().isoformat()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
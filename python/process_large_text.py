@@ -1,97 +1,59 @@
 import os
 import json
-import time
-from openai import AzureOpenAI
 from dotenv import load_dotenv
+from llm_executor import build_request, run_prompts, report_failures
+from llm_cache import print_cache_stats
+from text_chunker import iter_chunks
+import telemetry
 
 # Load environment variables
 load_dotenv()
 
-# Azure OpenAI Configuration
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-15-preview",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
-
+# Azure OpenAI Configuration (requests are sent through llm_executor)
 DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 
-def chunk_text(text, chunk_size=4000):
-    """Split text into chunks of roughly equal size."""
-    # Split by paragraphs first
-    paragraphs = text.split('\n\n')
-    chunks = []
-    current_chunk = []
-    current_size = 0
-    
-    for para in paragraphs:
-        para_size = len(para)
-        if current_size + para_size > chunk_size and current_chunk:
-            # Join the current chunk and add to chunks
-            chunks.append('\n\n'.join(current_chunk))
-            current_chunk = [para]
-            current_size = para_size
-        else:
-            current_chunk.append(para)
-            current_size += para_size
-    
-    # Add the last chunk if it exists
-    if current_chunk:
-        chunks.append('\n\n'.join(current_chunk))
-    
-    return chunks
+# Token budget per chunk, and how much of each chunk is repeated in the next
+CHUNK_TOKENS = int(os.getenv("LARGE_TEXT_CHUNK_TOKENS", "3000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("LARGE_TEXT_CHUNK_OVERLAP_TOKENS", "100"))
+
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "Extract testable medical factoids from the text. Each factoid should be a single, clear statement."
+}
+
+def build_chunk_request(chunk):
+    """Build the chat completion request for a single chunk."""
+    user_message = {
+        "role": "user",
+        "content": f"Extract factoids from this text:\n\n{chunk}"
+    }
+    return build_request(SYSTEM_MESSAGE, user_message, model=DEPLOYMENT_NAME, temperature=0.0)
 
 def process_chunk_with_retry(chunk, max_retries=3, delay=1):
-    """Process a single chunk with retry logic."""
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(
-                model=DEPLOYMENT_NAME,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Extract testable medical factoids from the text. Each factoid should be a single, clear statement."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Extract factoids from this text:\n\n{chunk}"
-                    }
-                ],
-                max_tokens=2048,
-                temperature=0.0
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            if attempt == max_retries - 1:
-                print(f"Failed after {max_retries} attempts: {str(e)}")
-                return None
-            print(f"Attempt {attempt + 1} failed: {str(e)}. Retrying...")
-            time.sleep(delay * (attempt + 1))  # Exponential backoff
+    """Process a single chunk, retrying failures with jittered exponential backoff from `delay` seconds."""
+    with telemetry.stage('large_text'):
+        result = run_prompts([build_chunk_request(chunk)], max_retries=max_retries, retry_delay=delay)[0]
+    if result.error is not None:
+        print(f"Failed after {max_retries} attempts: {str(result.error)}")
+        return None
+    return result.content.strip()
 
 def process_large_file(input_file, output_dir):
     """Process a large text file and generate factoids."""
-    # Read the input file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        text = f.read()
-    
-    # Split into chunks
-    chunks = chunk_text(text)
+    # Split into token-packed chunks straight from the memory-mapped file
+    chunks = list(iter_chunks(input_file, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS))
     print(f"Split text into {len(chunks)} chunks")
     
-    # Process each chunk with rate limiting
+    # Process all chunks concurrently; results come back in chunk order
+    with telemetry.stage('large_text'):
+        results = run_prompts([build_chunk_request(chunk.text) for chunk in chunks])
+    report_failures(results, label="Chunk")
+
     all_factoids = []
-    for i, chunk in enumerate(chunks, 1):
-        print(f"Processing chunk {i}/{len(chunks)}")
-        
-        # Add rate limiting delay
-        if i > 1:
-            time.sleep(2)  # Basic rate limiting
-        
-        # Process chunk
-        result = process_chunk_with_retry(chunk)
-        if result:
+    for i, result in enumerate(results, 1):
+        if result.content:
             # Split result into individual factoids and clean them
-            chunk_factoids = [f.strip() for f in result.split('\n') if f.strip()]
+            chunk_factoids = [f.strip() for f in result.content.strip().split('\n') if f.strip()]
             all_factoids.extend(chunk_factoids)
             print(f"Extracted {len(chunk_factoids)} factoids from chunk {i}")
     
@@ -118,5 +80,8 @@ if __name__ == "__main__":
         if filename.endswith('.txt'):
             input_file = os.path.join(input_dir, filename)
             print(f"\nProcessing {filename}...")
-            output_file = process_large_file(input_file, output_dir)
-            print(f"Saved factoids to {output_file}") 
\ No newline at end of file
+            with telemetry.run(os.path.splitext(filename)[0]):
+                output_file = process_large_file(input_file, output_dir)
+            print(f"Saved factoids to {output_file}")
+
+    print_cache_stats() 
\ No newline at end of file
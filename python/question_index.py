@@ -0,0 +1,244 @@
+import os
+import sys
+import time
+import random
+import threading
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from mcq_bank import BankReader, list_banks, id_key
+
+# Directories loaded by default, newest generated banks first
+DEFAULT_BANK_DIRS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcqs'),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'COMPLETED_MCQS'),
+]
+
+ID_BYTES = 12
+
+# Seconds between checks of the bank files for changes; requests in between reuse the index
+CHECK_SECONDS = float(os.getenv("QUESTION_INDEX_CHECK_SECONDS", "5"))
+
+# One contiguous run of rows from the same bank file (or the same bank in MongoDB)
+Segment = namedtuple('Segment', ['bank_id', 'source_file', 'path', 'start', 'end'])
+
+
+class QuestionIndex:
+    """Compact, read-only index of every question in a set of banks.
+
+    Each question costs a fixed 12-byte id, an 8-byte offset and a 4-byte
+    id-order slot, held in flat arrays; questions themselves are read from
+    their bank file (or MongoDB) only when a sample is returned. Rows of one
+    bank are contiguous, so bank lookups are ranges and sampling is a few
+    random draws plus a bisect.
+    """
+
+    def __init__(self):
+        self.segments = []
+        self._ids = bytearray()
+        self._offsets = array('Q')
+        self._id_order = None
+        self._collection = None
+        self._readers = {}
+        self._hashed_ids = {}  # id key -> MongoDB _id, for the _ids id_key() had to hash
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @classmethod
+    def from_files(cls, bank_dirs=None):
+        """Index every JSONL (or legacy JSON) bank under bank_dirs."""
+        index = cls()
+        for path in list_banks(bank_dirs or DEFAULT_BANK_DIRS):
+            index._add_bank_file(path)
+        index._finish()
+        return index
+
+    @classmethod
+    def from_collection(cls, collection):
+        """Index the mcqs collection; questions are fetched by id when sampled."""
+        index = cls()
+        index._collection = collection
+        cursor = collection.find({}, {'_id': 1, 'bank_id': 1, 'source_file': 1}) \
+            .sort([('bank_id', 1), ('source_file', 1)])
+        current = None
+        start = 0
+        for doc in cursor:
+            key = (doc.get('bank_id'), doc.get('source_file'))
+            if key != current:
+                if current is not None:
+                    index._add_segment(current[0], current[1], None, start)
+                current, start = key, len(index)
+            key = id_key(doc['_id'])
+            if key.hex() != str(doc['_id']):
+                index._hashed_ids[key] = str(doc['_id'])
+            index._ids += key
+            index._offsets.append(0)
+        if current is not None:
+            index._add_segment(current[0], current[1], None, start)
+        index._finish()
+        return index
+
+    def _add_bank_file(self, path):
+        reader = BankReader(path)
+        if not len(reader):
+            return
+        first = reader.get(0)
+        start = len(self)
+        for mcq_id, offset in reader.entries():
+            self._ids += mcq_id
+            self._offsets.append(offset)
+        self._readers[path] = reader
+        self._add_segment(first.get('bank_id'), first.get('source_file'), path, start)
+
+    def _add_segment(self, bank_id, source_file, path, start):
+        intern = lambda value: sys.intern(value) if isinstance(value, str) else value
+        self.segments.append(Segment(intern(bank_id), intern(source_file), path, start, len(self)))
+
+    def _finish(self):
+        # Rows sorted by id, for binary-search lookups without a per-question dict
+        order = sorted(range(len(self)), key=self._id_at)
+        self._id_order = array('I', order)
+        self._segment_starts = [segment.start for segment in self.segments]
+
+    def _id_at(self, row):
+        return bytes(self._ids[row * ID_BYTES:(row + 1) * ID_BYTES])
+
+    def row_of(self, mcq_id):
+        """Row of an MCQ id, or None."""
+        key = id_key(mcq_id)
+        lo, hi = 0, len(self._id_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id_at(self._id_order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._id_order) and self._id_at(self._id_order[lo]) == key:
+            return self._id_order[lo]
+        return None
+
+    def segment_of(self, row):
+        return self.segments[bisect_right(self._segment_starts, row) - 1]
+
+    def select(self, banks=None):
+        """Segments whose bank_id or source_file is in `banks` (all segments when empty)."""
+        if not banks:
+            return list(self.segments)
+        wanted = set(banks)
+        return [s for s in self.segments if s.bank_id in wanted or s.source_file in wanted]
+
+    def bank_sizes(self):
+        sizes = {}
+        for segment in self.segments:
+            sizes[segment.bank_id] = sizes.get(segment.bank_id, 0) + segment.end - segment.start
+        return sizes
+
+    def sample(self, n, banks=None, stratified=False, rng=random):
+        """Rows of up to n distinct questions drawn from the selected banks.
+
+        Random mode draws uniformly over every selected question. Stratified
+        mode splits n as evenly as possible across the selected banks, giving
+        a small bank's unused share to the others.
+        """
+        segments = self.select(banks)
+        if not stratified:
+            return _sample_segments(segments, n, rng)
+
+        by_bank = {}
+        for segment in segments:
+            by_bank.setdefault(segment.bank_id, []).append(segment)
+        sizes = {bank: sum(s.end - s.start for s in bank_segments) for bank, bank_segments in by_bank.items()}
+        rows = []
+        for bank, quota in _split_evenly(n, sizes).items():
+            rows.extend(_sample_segments(by_bank[bank], quota, rng))
+        rng.shuffle(rows)
+        return rows
+
+    def load(self, rows):
+        """Full MCQs for rows, in the same order, each tagged with its id."""
+        if self._collection is not None:
+            ids = [self._hashed_ids.get(key) or key.hex() for key in map(self._id_at, rows)]
+            docs = {str(doc['_id']): doc for doc in self._collection.find({'_id': {'$in': ids + _object_ids(ids)}})}
+            mcqs = []
+            for mcq_id in ids:
+                doc = docs.get(mcq_id)
+                if doc is not None:
+                    mcqs.append(dict(doc, _id=str(doc['_id']), id=mcq_id))
+            return mcqs
+
+        mcqs = []
+        for row in rows:
+            reader = self._readers[self.segment_of(row).path]
+            mcq = reader.read_at(self._offsets[row])
+            mcq.setdefault('id', self._id_at(row).hex())
+            mcqs.append(mcq)
+        return mcqs
+
+    def get(self, mcq_id):
+        row = self.row_of(mcq_id)
+        return None if row is None else self.load([row])[0]
+
+
+def _sample_segments(segments, k, rng):
+    """k distinct rows drawn uniformly from the union of segments."""
+    starts = []
+    total = 0
+    for segment in segments:
+        starts.append(total)
+        total += segment.end - segment.start
+    rows = []
+    for pick in rng.sample(range(total), min(k, total)):
+        i = bisect_right(starts, pick) - 1
+        rows.append(segments[i].start + pick - starts[i])
+    return rows
+
+
+def _split_evenly(n, sizes):
+    """Share n between keys as evenly as their sizes allow."""
+    quotas = {key: 0 for key in sizes}
+    remaining = min(n, sum(sizes.values()))
+    open_keys = [key for key in sizes if sizes[key] > 0]
+    while remaining and open_keys:
+        share, extra = divmod(remaining, len(open_keys))
+        for i, key in enumerate(open_keys):
+            take = min(share + (1 if i < extra else 0), sizes[key] - quotas[key])
+            quotas[key] += take
+            remaining -= take
+        open_keys = [key for key in open_keys if quotas[key] < sizes[key]]
+    return quotas
+
+
+def _object_ids(ids):
+    """Legacy documents have ObjectId _ids rather than content-hash strings."""
+    from bson import ObjectId
+    return [ObjectId(mcq_id) for mcq_id in ids if ObjectId.is_valid(mcq_id)]
+
+
+_index = None
+_index_key = None
+_index_checked = 0.0
+_index_lock = threading.Lock()
+
+
+def get_question_index(bank_dirs=None, collection=None):
+    """Shared index, rebuilt when a bank file is added, removed or rewritten.
+
+    The bank files are looked at most every CHECK_SECONDS, by size and
+    mtime. With a collection, the index is built from MongoDB once per process.
+    """
+    global _index, _index_key, _index_checked
+    if _index is not None and time.monotonic() - _index_checked < CHECK_SECONDS:
+        return _index
+    if collection is not None:
+        key = 'mongo'
+    else:
+        key = tuple((path, stat.st_size, stat.st_mtime_ns)
+                    for path, stat in ((path, os.stat(path)) for path in list_banks(bank_dirs or DEFAULT_BANK_DIRS)))
+    with _index_lock:
+        _index_checked = time.monotonic()
+        if _index is None or _index_key != key:
+            _index = QuestionIndex.from_collection(collection) if collection is not None \
+                else QuestionIndex.from_files(bank_dirs)
+            _index_key = key
+        return _index
@@ -0,0 +1,170 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from text_chunker import estimate_tokens
+import telemetry
+
+# Deployment quota; 0 leaves that budget unenforced (429s are still honored)
+RPM_LIMIT = float(os.getenv("LLM_RPM_LIMIT", "0"))
+TPM_LIMIT = float(os.getenv("LLM_TPM_LIMIT", "0"))
+
+# Requests in flight at start-up, and the range AIMD may move it within
+START_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", str(START_CONCURRENCY * 4)))
+MIN_CONCURRENCY = 1
+
+# Concurrency is multiplied by this on a 429, at most once per throttling episode
+DECREASE_FACTOR = 0.5
+
+# Jittered exponential backoff: up to BACKOFF_BASE * 2**attempt seconds, capped
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "60"))
+
+# Longest a waiting request sleeps before checking again (in-flight requests may finish sooner)
+POLL_SECONDS = 0.05
+
+
+def estimate_request_tokens(request):
+    """Tokens a request counts against the TPM quota: its prompt plus max_tokens, as Azure reserves them."""
+    prompt = sum(estimate_tokens(message.get('content') or '') for message in request.get('messages', []))
+    return prompt + (request.get('max_tokens') or 0)
+
+
+def is_throttled(error):
+    return getattr(error, 'status_code', None) == 429
+
+
+def retry_after_seconds(error):
+    """Seconds the server asked us to wait (retry-after-ms or Retry-After), or None."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_delay(attempt, retry_after=None, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=random):
+    """Full-jitter exponential delay for a retry, never shorter than the server's Retry-After."""
+    return max(rng.uniform(0, min(cap, base * 2 ** attempt)), retry_after or 0)
+
+
+class RateGovernor:
+    """Process-wide admission control for LLM requests.
+
+    A request is admitted once a concurrency slot is free and the
+    requests-per-minute and tokens-per-minute buckets hold enough budget for
+    it. The concurrency limit grows by one per window of successful requests
+    while it is the bottleneck, and halves on a 429, which also pauses every
+    caller until the server's Retry-After has passed. Shared by all event
+    loops and threads in the process.
+    """
+
+    def __init__(self, rpm=None, tpm=None, concurrency=None, max_concurrency=None, clock=time.monotonic):
+        self.rpm = RPM_LIMIT if rpm is None else rpm
+        self.tpm = TPM_LIMIT if tpm is None else tpm
+        self.max_concurrency = max_concurrency or MAX_CONCURRENCY
+        self.limit = float(min(concurrency or START_CONCURRENCY, self.max_concurrency))
+        self.in_flight = 0
+        self.throttled = 0
+        self.blocked_until = 0.0
+        self._clock = clock
+        self._request_budget = self.rpm
+        self._token_budget = self.tpm
+        self._refilled = clock()
+        self._last_decrease = float('-inf')
+        self._lock = threading.Lock()
+        telemetry.metrics.set('llm_concurrency_limit', self.limit)
+
+    @property
+    def concurrency(self):
+        return int(self.limit)
+
+    def _refill(self, now):
+        elapsed = now - self._refilled
+        self._refilled = now
+        if self.rpm:
+            self._request_budget = min(self.rpm, self._request_budget + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._token_budget = min(self.tpm, self._token_budget + elapsed * self.tpm / 60)
+
+    def try_acquire(self, cost):
+        """Admit a request costing `cost` tokens and return 0, or return the seconds to wait first."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.limit):
+                return POLL_SECONDS
+            # A request larger than the whole TPM budget waits for a full bucket rather than forever
+            cost = min(cost, self.tpm) if self.tpm else cost
+            wait = 0.0
+            if self.rpm and self._request_budget < 1:
+                wait = (1 - self._request_budget) * 60 / self.rpm
+            if self.tpm and self._token_budget < cost:
+                wait = max(wait, (cost - self._token_budget) * 60 / self.tpm)
+            if wait:
+                return wait
+            if self.rpm:
+                self._request_budget -= 1
+            if self.tpm:
+                self._token_budget -= cost
+            self.in_flight += 1
+            return 0
+
+    async def acquire(self, cost):
+        while True:
+            wait = self.try_acquire(cost)
+            if not wait:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, ok=False, throttled=False, retry_after=None):
+        """Return a slot: success grows the limit (additively), a 429 shrinks it (multiplicatively)."""
+        with self._lock:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = self._clock()
+            if throttled:
+                self.throttled += 1
+                pause = retry_after if retry_after is not None else BACKOFF_BASE
+                self.blocked_until = max(self.blocked_until, now + pause)
+                # Everything in flight when the quota ran out will 429 too; count that as one signal
+                if now - self._last_decrease >= max(pause, 1.0):
+                    self.limit = max(MIN_CONCURRENCY, self.limit * DECREASE_FACTOR)
+                    self._last_decrease = now
+                # The server's view of the quota is what counts; start refilling from empty
+                self._request_budget = min(self._request_budget, 0)
+                self._token_budget = min(self._token_budget, 0)
+            elif ok and saturated:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            limit = self.limit
+        telemetry.metrics.set('llm_concurrency_limit', limit)
+
+    def stats(self):
+        return {'concurrency': self.concurrency, 'in_flight': self.in_flight, 'throttled': self.throttled}
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = RateGovernor()
+    return _governor
@@ -0,0 +1,253 @@
+import os
+import heapq
+import itertools
+import threading
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne
+from db_utils import get_db, WriteBehindBuffer, REVIEW_COLLECTION
+import telemetry
+
+# Users whose schedules are kept in memory; the least recently used are dropped first
+REVIEW_CACHE_USERS = int(os.getenv("REVIEW_CACHE_USERS", "1000"))
+
+# SM-2 grades run 0-5; below 3 the card starts over. A logged incorrect answer counts as 1.
+PASSING_QUALITY = 3
+INCORRECT_QUALITY = 1
+MIN_EASINESS = 1.3
+START_EASINESS = 2.5
+
+# One card per (user, MCQ); interval is in days
+ReviewState = namedtuple('ReviewState', [
+    'user_id', 'mcq_id', 'factoid', 'easiness', 'interval', 'repetitions', 'due', 'reviewed_at'
+])
+
+
+def sm2(card, quality, now):
+    """Next state of a card after a review graded `quality` (0-5), per SuperMemo-2."""
+    if quality < PASSING_QUALITY:
+        repetitions, interval = 0, 1
+    else:
+        repetitions = card.repetitions + 1
+        if repetitions == 1:
+            interval = 1
+        elif repetitions == 2:
+            interval = 6
+        else:
+            interval = round(card.interval * card.easiness)
+    easiness = max(MIN_EASINESS, card.easiness + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return card._replace(easiness=easiness, interval=interval, repetitions=repetitions,
+                         due=now + timedelta(days=interval), reviewed_at=now)
+
+
+def new_card(user_id, mcq_id, factoid, now):
+    return ReviewState(user_id, mcq_id, factoid, START_EASINESS, 0, 0, now, None)
+
+
+def card_id(user_id, mcq_id):
+    return f"{user_id}:{mcq_id}"
+
+
+def _to_document(card):
+    return dict(card._asdict(), _id=card_id(card.user_id, card.mcq_id), userId=card.user_id)
+
+
+def _from_document(doc):
+    return ReviewState(*(doc.get(field) for field in ReviewState._fields))
+
+
+def card_to_json(card):
+    card = card._asdict()
+    for field in ('due', 'reviewed_at'):
+        if isinstance(card[field], datetime):
+            card[field] = card[field].isoformat() + 'Z'
+    card['user_id'] = str(card['user_id'])
+    return card
+
+
+def _load_cards(user_id):
+    """Stored cards for a user; a user with none is seeded once from their incorrect answers."""
+    cards = [_from_document(doc) for doc in get_db()[REVIEW_COLLECTION].find({'userId': user_id})]
+    if cards:
+        return cards
+    latest_misses = get_db()['incorrect_answers'].aggregate([
+        {'$match': {'userId': user_id}},
+        {'$sort': {'timestamp': 1}},  # So $last is the factoid of the latest miss
+        {'$group': {'_id': '$mcq_id', 'factoid': {'$last': '$factoid'}, 'timestamp': {'$max': '$timestamp'}}}
+    ])
+    cards = [sm2(new_card(user_id, miss['_id'], miss.get('factoid'), miss['timestamp']), INCORRECT_QUALITY, miss['timestamp'])
+             for miss in latest_misses if miss['_id'] is not None and miss.get('timestamp')]
+    if cards:
+        _write_cards(cards)
+    return cards
+
+
+def _write_cards(cards):
+    """Upsert cards; only the newest state of a card queued twice in one batch is kept."""
+    latest = {}
+    for card in cards:
+        latest[card_id(card.user_id, card.mcq_id)] = card
+    with telemetry.timed('db_write_seconds', collection=REVIEW_COLLECTION):
+        get_db()[REVIEW_COLLECTION].bulk_write(
+            [ReplaceOne({'_id': key}, _to_document(card), upsert=True) for key, card in latest.items()],
+            ordered=False
+        )
+    telemetry.increment('db_documents_written_total', len(latest), collection=REVIEW_COLLECTION)
+
+
+class _UserSchedule:
+    """A user's cards plus a min-heap of (due, version, mcq_id).
+
+    Every push gives the card a new version; heap entries whose version is
+    no longer the card's are superseded and skipped lazily, even when two
+    reviews left the card with the same due time.
+    """
+    __slots__ = ('cards', 'versions', 'heap', '_next_version')
+
+    def __init__(self, cards):
+        self._next_version = itertools.count()
+        self.cards = {card.mcq_id: card for card in cards}
+        self.versions = {mcq_id: next(self._next_version) for mcq_id in self.cards}
+        self.heap = self._entries()
+        heapq.heapify(self.heap)
+
+    def _entries(self):
+        return [(card.due, self.versions[mcq_id], mcq_id) for mcq_id, card in self.cards.items()]
+
+    def push(self, card):
+        self.cards[card.mcq_id] = card
+        version = self.versions[card.mcq_id] = next(self._next_version)
+        heapq.heappush(self.heap, (card.due, version, card.mcq_id))
+        if len(self.heap) > 2 * len(self.cards) + 16:
+            # Too many stale entries; rebuild from the live cards
+            self.heap = self._entries()
+            heapq.heapify(self.heap)
+
+    def pop_due(self, n, now):
+        """Up to n cards due by `now`, soonest first, in O(k log n) for k heap entries touched."""
+        due = []
+        while self.heap and len(due) < n and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if self.versions.get(entry[2]) == entry[1]:
+                due.append(entry)
+        for entry in due:
+            heapq.heappush(self.heap, entry)
+        return [self.cards[mcq_id] for _, _, mcq_id in due]
+
+
+class ReviewScheduler:
+    """SM-2 review schedule per (user, MCQ), kept in memory and written behind to MongoDB.
+
+    A user's cards are loaded with one indexed query on first use (and
+    seeded from their incorrect answers if they have none yet). Every
+    graded review, including each logged incorrect answer, updates the card
+    in place, so listing due reviews never scans the answer history.
+
+    Loading happens outside the scheduler lock, under a per-user lock, so
+    one user's first request never stalls everyone else's. A user with
+    reviews still waiting in the write-behind buffer is never evicted from
+    the cache, since reloading them from MongoDB would lose those reviews.
+    """
+
+    def __init__(self, load=None, write=None):
+        self._load = load or _load_cards
+        self._writer = WriteBehindBuffer(write or _write_cards, REVIEW_COLLECTION)
+        self._users = OrderedDict()
+        self._loading = {}  # user_id -> lock held while that user's cards are loaded
+        self._unwritten = {}  # user_id -> reviews queued for MongoDB but not yet written
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id):
+        # Caller holds self._lock
+        schedule = self._users.get(user_id)
+        if schedule is not None:
+            self._users.move_to_end(user_id)
+        return schedule
+
+    def _schedule(self, user_id):
+        """The user's schedule, loaded once by whichever request asks first."""
+        with self._lock:
+            schedule = self._cached(user_id)
+            if schedule is not None:
+                return schedule
+            loading = self._loading.setdefault(user_id, threading.Lock())
+        with loading:
+            with self._lock:
+                schedule = self._cached(user_id)
+            if schedule is not None:
+                return schedule
+            try:
+                schedule = _UserSchedule(list(self._load(user_id)))
+                with self._lock:
+                    self._users[user_id] = schedule
+                    self._evict()
+            finally:
+                with self._lock:
+                    self._loading.pop(user_id, None)
+        return schedule
+
+    def _evict(self):
+        # Caller holds self._lock; least recently used first, skipping users with unwritten reviews
+        while len(self._users) > REVIEW_CACHE_USERS:
+            victim = next((user_id for user_id in self._users if not self._unwritten.get(user_id)), None)
+            if victim is None:
+                return  # Every cached user has reviews in flight; evict once they are written
+            del self._users[victim]
+
+    def _written(self, cards):
+        # Called from the writer thread once cards are in MongoDB
+        with self._lock:
+            for card in cards:
+                left = self._unwritten.get(card.user_id, 0) - 1
+                if left > 0:
+                    self._unwritten[card.user_id] = left
+                else:
+                    self._unwritten.pop(card.user_id, None)
+
+    def record(self, user_id, mcq_id, quality, factoid=None, now=None):
+        """Grade a review (0-5) and return the card's new state."""
+        now = now or datetime.utcnow()
+        schedule = self._schedule(user_id)
+        with self._lock:
+            # Evicted since it was looked up: an unpinned schedule matches MongoDB, so it can go back
+            schedule = self._users.setdefault(user_id, schedule)
+            self._users.move_to_end(user_id)
+            card = schedule.cards.get(mcq_id) or new_card(user_id, mcq_id, factoid, now)
+            if factoid and not card.factoid:
+                card = card._replace(factoid=factoid)
+            card = sm2(card, quality, now)
+            schedule.push(card)
+            self._unwritten[user_id] = self._unwritten.get(user_id, 0) + 1
+        self._writer.add(card, on_written=self._written)
+        return card
+
+    def due(self, user_id, n=10, now=None):
+        """The user's next n cards that are due, soonest first."""
+        schedule = self._schedule(user_id)
+        with self._lock:
+            return schedule.pop_due(n, now or datetime.utcnow())
+
+    def upcoming(self, user_id, n=10):
+        """The user's next n cards whether or not they are due yet."""
+        schedule = self._schedule(user_id)
+        with self._lock:
+            return schedule.pop_due(n, datetime.max)
+
+    def stats(self):
+        return dict(self._writer.stats(), users=len(self._users))
+
+    def close(self):
+        self._writer.close()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ReviewScheduler()
+    return _scheduler
@@ -0,0 +1,426 @@
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import heapq
+import struct
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from mcq_bank import BankReader, list_banks
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, so run one index updater at a time
+    fcntl = None
+
+SEARCH_INDEX_DIR = os.getenv(
+    "SEARCH_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search_index')
+)
+DEFAULT_BANK_DIRS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcqs'),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'COMPLETED_MCQS'),
+]
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# A prefix expands to at most this many index terms
+MAX_PREFIX_TERMS = 64
+
+# Segments are merged into one once there are more than this many
+MAX_SEGMENTS = 8
+
+# Lock file in the index directory held by whichever process is updating the index
+LOCK_NAME = 'update.lock'
+
+TOKEN = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'the of and to in is a an for with by on at as be are was were or which that this from it its '
+    'following most likely patient what who how when into than then'.split()
+)
+
+# Segment file layout: header, doc table, term offsets, term text, postings offsets, postings
+MAGIC = b'MCQSRCH1'
+HEADER = struct.Struct('<8sIIQQQQQQ')  # magic, docs, terms, total tokens, then five section offsets
+DOC = struct.Struct('<12sHIQ')        # MCQ id, bank number, token count, byte offset in the bank
+POSTING = struct.Struct('<IH')        # doc number within the segment, term frequency
+U32 = struct.Struct('<I')
+U64 = struct.Struct('<Q')
+
+
+def tokenize(text):
+    return [t for t in TOKEN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def mcq_text(mcq):
+    """Everything searchable about an MCQ: question, choices, explanation and factoid."""
+    choices = ' '.join(c.get('value', '') for c in mcq.get('answerChoices') or [] if isinstance(c, dict))
+    return ' '.join(str(mcq.get(field) or '') for field in ('question', 'explanation', 'factoid')) + ' ' + choices
+
+
+def write_segment(path, docs):
+    """Write an immutable segment for docs: a list of (id_bytes, bank_number, offset, tokens)."""
+    postings = {}
+    doc_table = []
+    for number, (mcq_id, bank, offset, tokens) in enumerate(docs):
+        doc_table.append(DOC.pack(mcq_id, bank, len(tokens), offset))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            postings.setdefault(token, []).append((number, min(tf, 0xFFFF)))
+
+    terms = sorted(postings)
+    term_blob = bytearray()
+    term_offsets = bytearray()
+    posting_blob = bytearray()
+    posting_offsets = bytearray()
+    for term in terms:
+        term_offsets += U32.pack(len(term_blob))
+        term_blob += term.encode('utf-8')
+        posting_offsets += U64.pack(len(posting_blob))
+        for number, tf in postings[term]:
+            posting_blob += POSTING.pack(number, tf)
+    term_offsets += U32.pack(len(term_blob))
+    posting_offsets += U64.pack(len(posting_blob))
+
+    total_length = sum(len(tokens) for _, _, _, tokens in docs)
+    docs_at = HEADER.size
+    term_offsets_at = docs_at + len(doc_table) * DOC.size
+    terms_at = term_offsets_at + len(term_offsets)
+    posting_offsets_at = terms_at + len(term_blob)
+    postings_at = posting_offsets_at + len(posting_offsets)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(docs), len(terms), total_length, docs_at, term_offsets_at, terms_at,
+                            posting_offsets_at, postings_at))
+        f.writelines(doc_table)
+        f.write(term_offsets)
+        f.write(term_blob)
+        f.write(posting_offsets)
+        f.write(posting_blob)
+    os.replace(path + '.tmp', path)
+
+
+class Segment:
+    """Read-only view of a memory-mapped segment file.
+
+    `banks` is the manifest bank list its docs' bank numbers refer to.
+    """
+
+    def __init__(self, path, banks=()):
+        self.path = path
+        self.banks = banks
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.doc_count, self.term_count, self.total_length, self._docs_at, self._term_offsets_at,
+         self._terms_at, self._posting_offsets_at, self._postings_at) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a search index segment")
+
+    def doc(self, number):
+        """(id_bytes, bank_number, token_count, offset) of a doc in this segment."""
+        return DOC.unpack_from(self._map, self._docs_at + number * DOC.size)
+
+    def term(self, i):
+        start, end = struct.unpack_from('<II', self._map, self._term_offsets_at + i * U32.size)
+        return self._map[self._terms_at + start:self._terms_at + end].decode('utf-8')
+
+    def _lower_bound(self, term):
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, term):
+        """Term number of an exact term, or None."""
+        i = self._lower_bound(term)
+        return i if i < self.term_count and self.term(i) == term else None
+
+    def expand(self, prefix, limit=MAX_PREFIX_TERMS):
+        """Terms starting with prefix, in order."""
+        terms = []
+        i = self._lower_bound(prefix)
+        while i < self.term_count and len(terms) < limit:
+            term = self.term(i)
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+            i += 1
+        return terms
+
+    def postings(self, i):
+        """(doc number, tf) pairs for term number i."""
+        start, end = struct.unpack_from('<QQ', self._map, self._posting_offsets_at + i * U64.size)
+        return POSTING.iter_unpack(self._map[self._postings_at + start:self._postings_at + end])
+
+    def df(self, i):
+        start, end = struct.unpack_from('<QQ', self._map, self._posting_offsets_at + i * U64.size)
+        return (end - start) // POSTING.size
+
+
+class SearchIndex:
+    """BM25 search over every MCQ in the banks, kept as memory-mapped segments.
+
+    The manifest lists the segments and, per bank, how many of its MCQs are
+    indexed. JSONL banks only grow while MCQs are generated, so update()
+    indexes just the new tail of each bank into a new segment; a bank that
+    was rewritten or removed triggers a full rebuild.
+
+    Processes updating the same index take turns through a lock file, and
+    each starts from the manifest on disk, so none overwrites another's
+    segments. The new segments and bank numbering are swapped in together
+    under self._lock only once they are built, and search() takes one
+    snapshot of them, so a query never waits for an update nor mixes two
+    versions of the index.
+    """
+
+    def __init__(self, index_dir=SEARCH_INDEX_DIR, bank_dirs=None):
+        self.index_dir = index_dir
+        self.bank_dirs = bank_dirs or DEFAULT_BANK_DIRS
+        self.manifest_path = os.path.join(index_dir, 'manifest.json')
+        self.manifest = {'banks': [], 'segments': []}
+        self.segments = []
+        self._readers = {}
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self._read_manifest()
+        self._open_segments()
+
+    def _read_manifest(self):
+        if os.path.exists(self.manifest_path):
+            self._manifest_mtime = os.path.getmtime(self.manifest_path)
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+
+    def _open_segments(self):
+        # Replaced segments are unmapped when the last search using them drops them
+        banks = self.manifest['banks']
+        segments = [Segment(os.path.join(self.index_dir, name), banks) for name in self.manifest['segments']]
+        doc_count = sum(s.doc_count for s in segments)
+        bank_numbers = {}
+        for number, bank in enumerate(banks):
+            bank_numbers.setdefault(bank['bank_id'], set()).add(number)
+            bank_numbers.setdefault(bank['source_file'], set()).add(number)
+        with self._lock:
+            self.segments = segments
+            self.doc_count = doc_count
+            self.avg_length = sum(s.total_length for s in segments) / doc_count if doc_count else 0.0
+            self._bank_numbers = bank_numbers
+            self._readers = {}
+
+    def _save_manifest(self):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def _new_segment_name(self):
+        return f"segment-{datetime.now().strftime('%Y%m%d%H%M%S%f')}.bin"
+
+    def update(self, rebuild=False):
+        """Index MCQs added to the banks since the last update. Returns the number indexed."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with _writer_lock(os.path.join(self.index_dir, LOCK_NAME)):
+            # Another process may have added segments since this one last looked
+            self._read_manifest()
+            added = self._update(rebuild)
+            self._open_segments()
+        return added
+
+    def _update(self, rebuild):
+        paths = list_banks(self.bank_dirs)
+        # Copies; segments open in searches keep the current bank list unchanged
+        known = {bank['path']: dict(bank) for bank in self.manifest['banks']}
+        if not rebuild:
+            rebuild = len(self.manifest['segments']) >= MAX_SEGMENTS or any(p not in paths for p in known)
+
+        banks = [] if rebuild else list(known.values())
+        numbers = {bank['path']: i for i, bank in enumerate(banks)}
+        docs = []
+        for path in paths:
+            reader = BankReader(path)
+            entries = list(reader.entries())
+            bank = known.get(path) if not rebuild else None
+            if bank is not None:
+                indexed = bank['indexed']
+                unchanged = indexed <= len(entries) and (
+                    indexed == 0 or entries[indexed - 1][0].hex() == bank['last_id'])
+                if not unchanged:
+                    return self._update(rebuild=True)
+            else:
+                indexed = 0
+                first = reader.get(0) if len(entries) else {}
+                bank = {'path': path, 'bank_id': first.get('bank_id'), 'source_file': first.get('source_file')}
+                numbers[path] = len(banks)
+                banks.append(bank)
+            for mcq_id, offset in entries[indexed:]:
+                docs.append((mcq_id, numbers[path], offset, tokenize(mcq_text(reader.read_at(offset)))))
+            bank['indexed'] = len(entries)
+            bank['size'] = os.path.getsize(path)
+            bank['last_id'] = entries[-1][0].hex() if entries else None
+
+        if not docs and not rebuild:
+            return 0
+        segment_names = [] if rebuild else list(self.manifest['segments'])
+        if docs:
+            name = self._new_segment_name()
+            write_segment(os.path.join(self.index_dir, name), docs)
+            segment_names.append(name)
+
+        self.manifest = {'banks': banks, 'segments': segment_names}
+        self._save_manifest()
+        self._manifest_mtime = os.path.getmtime(self.manifest_path)
+        if rebuild:
+            # Also clears segments orphaned by writers that crashed before saving their manifest
+            for name in os.listdir(self.index_dir):
+                if name.startswith('segment-') and name not in segment_names:
+                    os.remove(os.path.join(self.index_dir, name))
+        return len(docs)
+
+    def search(self, query, banks=None, limit=20, prefix=False):
+        """Top (score, segment, doc) matches for query, best first.
+
+        Tokens ending in '*', and with prefix=True the last token, match every
+        term they start. `banks` restricts results to bank ids or source files.
+        """
+        words = query.lower().split()
+        tokens = []
+        for position, word in enumerate(words):
+            is_prefix = word.endswith('*') or (prefix and position == len(words) - 1)
+            for token in tokenize(word):
+                tokens.append((token, is_prefix))
+        with self._lock:
+            segments, doc_count, avg_length = self.segments, self.doc_count, self.avg_length
+            bank_numbers = self._bank_numbers
+        if not tokens or not doc_count:
+            return []
+
+        allowed = None
+        if banks:
+            allowed = set()
+            for bank in banks:
+                allowed |= bank_numbers.get(bank, set())
+        scores = {}
+        for token, is_prefix in tokens:
+            terms = {token}
+            if is_prefix:
+                for segment in segments:
+                    terms.update(segment.expand(token))
+            for term in terms:
+                found = [(s, segment, segment.find(term)) for s, segment in enumerate(segments)]
+                found = [(s, segment, i) for s, segment, i in found if i is not None]
+                df = sum(segment.df(i) for _, segment, i in found)
+                if not df:
+                    continue
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                for s, segment, i in found:
+                    for number, tf in segment.postings(i):
+                        _, bank, length, _ = segment.doc(number)
+                        if allowed is not None and bank not in allowed:
+                            continue
+                        norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+                        scores[(s, number)] = scores.get((s, number), 0.0) + idf * norm
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(score, segments[s], number) for (s, number), score in best]
+
+    def load(self, segment, number):
+        """The MCQ for a search hit, tagged with its bank and id."""
+        mcq_id, bank_number, _, offset = segment.doc(number)
+        bank = segment.banks[bank_number]
+        readers = self._readers
+        reader = readers.get(bank['path'])
+        if reader is None:
+            reader = readers[bank['path']] = BankReader(bank['path'])
+        mcq = reader.read_at(offset)
+        mcq.setdefault('id', mcq_id.hex())
+        return mcq
+
+    def is_stale(self):
+        """True if a bank was added, removed or changed size, or another process updated the index."""
+        if os.path.exists(self.manifest_path) and os.path.getmtime(self.manifest_path) != self._manifest_mtime:
+            return True
+        known = {bank['path']: bank.get('size') for bank in self.manifest['banks']}
+        paths = list_banks(self.bank_dirs)
+        if set(paths) != set(known):
+            return True
+        return any(os.path.getsize(path) != known[path] for path in paths)
+
+
+@contextmanager
+def _writer_lock(path):
+    """Exclusive lock on path shared by every process updating the index."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_index = None
+_index_lock = threading.Lock()
+_update_lock = threading.Lock()
+
+
+def get_search_index(bank_dirs=None):
+    """Shared SearchIndex, brought up to date when the banks have changed.
+
+    One caller runs the update while the others keep searching the
+    current segments instead of waiting for it.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex(bank_dirs=bank_dirs)
+        index = _index
+    if index.is_stale() and _update_lock.acquire(blocking=False):
+        try:
+            if index.is_stale():
+                index.update()
+        finally:
+            _update_lock.release()
+    return index
+
+
+def update_search_index(bank_dirs=None):
+    """Index any MCQs added to the banks since the last update."""
+    try:
+        added = SearchIndex(bank_dirs=bank_dirs).update()
+        if added:
+            print(f"🔎 Search index: added {added} MCQs")
+    except Exception as e:
+        print(f"⚠️  Could not update the search index: {str(e)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query the MCQ search index')
+    parser.add_argument('command', choices=['update', 'rebuild', 'search'])
+    parser.add_argument('query', nargs='?', default='')
+    parser.add_argument('--banks', default='', help='Comma-separated bank ids or source files')
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    index = SearchIndex()
+    if args.command in ('update', 'rebuild'):
+        added = index.update(rebuild=args.command == 'rebuild')
+        print(f"✅ Indexed {added} MCQs ({index.doc_count} total in {len(index.segments)} segments)")
+        return
+    banks = [b for b in args.banks.split(',') if b]
+    for score, segment, number in index.search(args.query, banks, args.limit, prefix=True):
+        mcq = index.load(segment, number)
+        print(f"{score:6.2f}  [{mcq.get('bank_id')}] {mcq.get('question', '')[:100]}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
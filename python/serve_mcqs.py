@@ -1,9 +1,20 @@
 import http.server
-import socketserver
+import argparse
+import base64
+import gzip
 import json
 import os
+import random
+import select
+import signal
 import sys
-from urllib.parse import parse_qs
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from bson import ObjectId
+from urllib.parse import parse_qs, unquote, urlsplit
 import webbrowser
 
 # Add the python directory to the path if needed
@@ -11,9 +22,272 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.append(current_dir)
 
-from db_utils import log_incorrect_answer
+from db_utils import get_db, get_answer_buffer, log_incorrect_answer, ensure_indexes, iter_incorrect_answers, INCORRECT_ANSWER_FIELDS
+from mcq_bank import BankReader, current_bank
+from question_index import get_question_index
+from search_index import get_search_index
+from review_scheduler import get_scheduler, card_to_json, INCORRECT_QUALITY
+import telemetry
+
+PORT = 8000
+
+# Requests handled at once; further connections wait for a free worker
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "16"))
+
+# Connections that may wait for a free worker; beyond that they are answered 503 straight away
+SERVER_QUEUE = int(os.getenv("SERVER_QUEUE", "64"))
+
+# Seconds an idle keep-alive connection may hold a worker, and how often it checks whether
+# another connection is waiting for that worker
+KEEPALIVE_TIMEOUT = float(os.getenv("KEEPALIVE_TIMEOUT", "5"))
+KEEPALIVE_POLL_SECONDS = 0.25
+
+REJECTED_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+                     b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+
+# Responses smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain')
+
+# Static files served with ETag revalidation and gzip
+CACHEABLE_SUFFIXES = {'.html': 'text/html; charset=utf-8', '.json': 'application/json',
+                      '.jsonl': 'application/json'}
+
+# Page size for /api/incorrect-answers
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Questions for /api/quiz come from the bank files ("files") or the mcqs collection ("mongo")
+QUIZ_SOURCE = os.getenv("QUIZ_SOURCE", "files")
+MAX_QUIZ_SIZE = 200
+
+# Directories searched for <source>_mcqs.jsonl (or legacy .json) banks
+BANK_DIRS = [os.path.join(current_dir, 'mcqs'), os.path.join(current_dir, 'COMPLETED_MCQS')]
+
+# Request paths timed under their own label; everything else is counted as "static"
+ROUTES = ('/api/banks', '/api/incorrect-answers', '/api/quiz', '/api/search', '/api/reviews/due',
+          '/api/reviews/grade', '/log_incorrect', '/metrics')
+
+# bank path -> (bank size when opened, BankReader)
+_bank_readers = {}
+
+def find_bank(source_name):
+    """Path of the bank for a source, or None; names that would leave BANK_DIRS are rejected."""
+    for bank_dir in BANK_DIRS:
+        path = current_bank(bank_dir, source_name)
+        if path is None:
+            continue
+        real_path = os.path.realpath(path)
+        if os.path.dirname(real_path) == os.path.realpath(bank_dir):
+            return real_path
+    return None
+
+def file_etag(path):
+    """Weak validator that changes whenever the file is rewritten or appended to."""
+    stat = os.stat(path)
+    return f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def encode_cursor(answer):
+    """Opaque page cursor for the (timestamp, _id) of the last answer on a page."""
+    raw = json.dumps([answer['timestamp'].isoformat(), str(answer['_id'])])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    timestamp, last_id = json.loads(raw)
+    if not ObjectId.is_valid(last_id):
+        raise ValueError(f"Invalid id in cursor: {last_id!r}")
+    return datetime.fromisoformat(timestamp), last_id
+
+def answer_to_json(answer):
+    answer = dict(answer, _id=str(answer['_id']))
+    if isinstance(answer.get('timestamp'), datetime):
+        answer['timestamp'] = answer['timestamp'].isoformat() + 'Z'
+    if 'userId' in answer:
+        answer['userId'] = str(answer['userId'])
+    return answer
+
+def route_label(path):
+    path = path.split('?')[0]
+    return next((route for route in ROUTES if path == route or path.startswith(route + '/')), 'static')
+
+def get_bank_reader(source_name):
+    """Cached (path, BankReader) for a source, reopened when the bank has grown."""
+    path = find_bank(source_name)
+    if path is None:
+        return None, None
+    size = os.path.getsize(path)
+    cached = _bank_readers.get(path)
+    if cached is None or cached[0] != size:
+        cached = _bank_readers[path] = (size, BankReader(path))
+    return path, cached[1]
+
+class MCQServer(http.server.ThreadingHTTPServer):
+    """Serves each connection on a bounded pool of worker threads.
+
+    At most `queue` accepted connections wait for a worker; further ones get
+    an immediate 503 instead of piling up in the pool's queue. While any
+    connection is waiting, idle keep-alive connections give up their worker.
+
+    server_close() stops accepting, lets keep-alive connections finish their
+    current request and waits for every in-flight request to complete.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, handler, workers=None, queue=SERVER_QUEUE):
+        super().__init__(address, handler)
+        self.draining = False
+        workers = workers or SERVER_WORKERS
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mcq-http')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+
+    @property
+    def busy(self):
+        """True while an accepted connection is waiting for a worker."""
+        return self._waiting > 0
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            telemetry.increment('http_rejected_total')
+            try:
+                request.sendall(REJECTED_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self._waiting_lock:
+            self._waiting += 1
+        self._pool.submit(self._serve, request, client_address)
+
+    def _serve(self, request, client_address):
+        with self._waiting_lock:
+            self._waiting -= 1
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+    def server_close(self):
+        self.draining = True
+        super().server_close()
+        self._pool.shutdown(wait=True)
 
 class MCQHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive; every response carries a length or is chunked
+    timeout = KEEPALIVE_TIMEOUT
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_timed_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_timed_request()
+
+    def wait_for_request(self):
+        """True once the next request on this keep-alive connection has started to arrive.
+
+        False closes the connection: after KEEPALIVE_TIMEOUT idle, or as soon
+        as the server drains or another connection is waiting for a worker.
+        """
+        # A pipelined request may already sit in rfile's buffer, where select() can't see it
+        self.connection.settimeout(0)
+        try:
+            if self.rfile.peek(1):
+                return True
+        except OSError:
+            pass
+        finally:
+            self.connection.settimeout(self.timeout)
+        deadline = time.monotonic() + self.timeout
+        while not self.server.draining and not self.server.busy:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if select.select([self.connection], [], [], min(remaining, KEEPALIVE_POLL_SECONDS))[0]:
+                return True
+        return False
+
+    def handle_timed_request(self):
+        self.started = None
+        self.handle_one_request()
+        if self.started is not None and self.command:
+            telemetry.metrics.observe('http_request_seconds', time.perf_counter() - self.started,
+                                      route=route_label(self.path), method=self.command)
+
+    def parse_request(self):
+        # Timing starts once the request line has arrived, not while the connection idles
+        self.started = time.perf_counter()
+        return super().parse_request()
+
+    def accepts_gzip(self):
+        return 'gzip' in self.headers.get('Accept-Encoding', '')
+
+    def not_modified(self, etag):
+        """Answer 304 if the client's cached copy is current."""
+        if etag and etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        return False
+
+    def send_body(self, status, body, content_type, etag=None):
+        """Send a complete response, gzipped when the client accepts it and it is worth it."""
+        compress = content_type.startswith(COMPRESSIBLE_TYPES) and len(body) >= GZIP_MIN_BYTES \
+            and self.accepts_gzip()
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status, payload, etag=None):
+        self.send_body(status, json.dumps(payload, default=str).encode(), 'application/json', etag)
+
+    def send_chunks(self, status, pieces, content_type='application/json', etag=None):
+        """Stream an iterable of byte strings with chunked encoding (and gzip when accepted)."""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if self.accepts_gzip() else None
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Vary', 'Accept-Encoding')
+        if compressor:
+            self.send_header('Content-Encoding', 'gzip')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+
+        def write_chunk(data):
+            if data:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        for piece in pieces:
+            write_chunk(compressor.compress(piece) if compressor else piece)
+        if compressor:
+            write_chunk(compressor.flush())
+        self.wfile.write(b"0\r\n\r\n")
+
+    def serve_file(self, path):
+        """Serve a static file with ETag revalidation and gzip."""
+        etag = file_etag(path)
+        if self.not_modified(etag):
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.send_body(200, body, CACHEABLE_SUFFIXES[os.path.splitext(path)[1]], etag)
+
     def do_POST(self):
         if self.path == '/log_incorrect':
             content_length = int(self.headers['Content-Length'])
@@ -26,53 +300,236 @@ class MCQHandler(http.server.SimpleHTTPRequestHandler):
                 data['factoid'],
                 data.get('userId')  # Get user ID from request
             )
+            # A miss puts the question back at the front of the user's reviews
+            if data.get('userId') is not None:
+                get_scheduler().record(data['userId'], data['mcq_id'], INCORRECT_QUALITY, data['factoid'])
             
             # Send response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'status': 'success'}).encode())
+            self.send_json(200, {'status': 'success'})
+        elif self.path == '/api/reviews/grade':
+            self.grade_review()
         else:
-            super().do_POST()
+            self.send_error(404)
+
+    def grade_review(self):
+        """POST /api/reviews/grade {userId, mcq_id, quality 0-5} records a review and returns the card."""
+        try:
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            user_id, mcq_id, quality = data['userId'], data['mcq_id'], int(data['quality'])
+        except (KeyError, TypeError, ValueError):
+            return self.send_json(400, {'error': 'Expected JSON with userId, mcq_id and quality'})
+        if not 0 <= quality <= 5:
+            return self.send_json(400, {'error': 'quality must be between 0 and 5'})
+        card = get_scheduler().record(user_id, mcq_id, quality, data.get('factoid'))
+        self.send_json(200, {'card': card_to_json(card)})
+
+    def serve_bank(self, parts):
+        """GET /api/banks/<source> streams a bank; /api/banks/<source>/<position or id> returns one MCQ."""
+        path, reader = get_bank_reader(unquote(parts[0]))
+        if reader is None:
+            return self.send_json(404, {'error': f"No bank named {unquote(parts[0])!r}"})
+        etag = file_etag(path)
+        if self.not_modified(etag):
+            return
+
+        if len(parts) == 1:
+            def pieces():
+                yield b'{"mcqs": ['
+                for i, mcq in enumerate(reader):
+                    yield (',' if i else '').encode() + json.dumps(mcq).encode()
+                yield b']}'
+            return self.send_chunks(200, pieces(), etag=etag)
+
+        key = unquote(parts[1])
+        mcq = None
+        if key.isdigit():
+            try:
+                mcq = reader.get(int(key))
+            except IndexError:
+                pass
+        else:
+            mcq = reader.by_id(key)
+        if mcq is None:
+            return self.send_json(404, {'error': f"No MCQ {key!r} in this bank"})
+        self.send_json(200, mcq, etag)
+
+    def serve_incorrect_answers(self, params):
+        """GET /api/incorrect-answers?userId=&limit=&cursor=&fields=a,b
+
+        Answers are returned newest first, one page at a time, and written to
+        the socket as they come off the MongoDB cursor. Pass the response's
+        nextCursor back as `cursor` for the following page; it is null on the
+        last page.
+        """
+        try:
+            limit = min(max(int(params.get('limit', [DEFAULT_PAGE_SIZE])[0]), 1), MAX_PAGE_SIZE)
+            after = decode_cursor(params['cursor'][0]) if params.get('cursor') else None
+        except (ValueError, TypeError):
+            return self.send_json(400, {'error': 'Invalid limit or cursor'})
+        fields = None
+        if params.get('fields'):
+            fields = [f for f in params['fields'][0].split(',') if f in INCORRECT_ANSWER_FIELDS]
+        user_id = params['userId'][0] if params.get('userId') else None
+        answers = iter_incorrect_answers(user_id, after, limit, fields)
+
+        def pieces():
+            yield b'{"incorrectAnswers": ['
+            last = None
+            next_cursor = None
+            for count, answer in enumerate(answers):
+                if count == limit:
+                    next_cursor = encode_cursor(last)
+                    break
+                yield (',' if count else '').encode() + json.dumps(answer_to_json(answer)).encode()
+                last = answer
+            answers.close()
+            yield b'], "nextCursor": ' + json.dumps(next_cursor).encode() + b'}'
+
+        self.send_chunks(200, pieces())
+
+    def serve_quiz(self, params):
+        """GET /api/quiz?banks=a,b&n=20&mode=random|stratified&seed=
+
+        `banks` matches bank ids or source files (all banks when omitted).
+        Stratified mode spreads the questions evenly across the chosen banks.
+        """
+        try:
+            n = min(max(int(params.get('n', ['20'])[0]), 1), MAX_QUIZ_SIZE)
+        except ValueError:
+            return self.send_json(400, {'error': 'n must be an integer'})
+        banks = [b for b in params.get('banks', [''])[0].split(',') if b]
+        mode = params.get('mode', ['random'])[0]
+        if mode not in ('random', 'stratified'):
+            return self.send_json(400, {'error': "mode must be 'random' or 'stratified'"})
+        rng = random.Random(params['seed'][0]) if params.get('seed') else random
+
+        index = get_question_index(BANK_DIRS, get_db()['mcqs'] if QUIZ_SOURCE == 'mongo' else None)
+        if banks and not index.select(banks):
+            return self.send_json(404, {'error': f"No banks match {', '.join(banks)}"})
+        rows = index.sample(n, banks, stratified=(mode == 'stratified'), rng=rng)
+        self.send_json(200, {'questions': index.load(rows), 'mode': mode})
+
+    def serve_search(self, params):
+        """GET /api/search?q=tropomyosin&banks=a,b&limit=20&prefix=1
+
+        BM25-ranked MCQs; `prefix=1` (the default) also matches words that
+        start with the last query word, and a trailing * does so for any word.
+        """
+        query = params.get('q', [''])[0].strip()
+        if not query:
+            return self.send_json(400, {'error': 'q is required'})
+        try:
+            limit = min(max(int(params.get('limit', ['20'])[0]), 1), 100)
+        except ValueError:
+            return self.send_json(400, {'error': 'limit must be an integer'})
+        banks = [b for b in params.get('banks', [''])[0].split(',') if b]
+        prefix = params.get('prefix', ['1'])[0] not in ('0', 'false')
+
+        index = get_search_index(BANK_DIRS)
+        results = []
+        for score, segment, number in index.search(query, banks, limit, prefix=prefix):
+            mcq = index.load(segment, number)
+            results.append({'score': round(score, 4), 'mcq': mcq})
+        self.send_json(200, {'query': query, 'results': results})
+
+    def serve_due_reviews(self, params):
+        """GET /api/reviews/due?userId=&n=10&upcoming=0
+
+        The user's reviews that are due now, soonest first; `upcoming=1`
+        lists the next n whether or not they are due yet.
+        """
+        if not params.get('userId'):
+            return self.send_json(400, {'error': 'userId is required'})
+        try:
+            n = min(max(int(params.get('n', ['10'])[0]), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            return self.send_json(400, {'error': 'n must be an integer'})
+        user_id = params['userId'][0]
+        scheduler = get_scheduler()
+        if params.get('upcoming', ['0'])[0] in ('1', 'true'):
+            cards = scheduler.upcoming(user_id, n)
+        else:
+            cards = scheduler.due(user_id, n)
+        self.send_json(200, {'reviews': [card_to_json(card) for card in cards]})
+
+    def serve_metrics(self):
+        """GET /metrics: this server's live metrics plus the latest pipeline run of each source."""
+        for name, buffer_stats in (('incorrect_answers', get_answer_buffer().stats()),
+                                   ('review_schedule', get_scheduler().stats())):
+            telemetry.metrics.set('write_buffer_queued', buffer_stats['queued'], buffer=name)
+            telemetry.metrics.set('write_buffer_written_total', buffer_stats['written'], buffer=name)
+            telemetry.metrics.set('write_buffer_failed_total', buffer_stats['failed'], buffer=name)
+        sources = [({}, telemetry.metrics.snapshot())]
+        sources += [({'source': summary['source']}, summary['metrics'])
+                    for summary in telemetry.load_run_summaries() if 'metrics' in summary]
+        body = telemetry.render_prometheus(sources).encode()
+        self.send_body(200, body, 'text/plain; version=0.0.4; charset=utf-8')
+
+    def do_HEAD(self):
+        # Same routes and headers as GET; send_body and send_chunks leave out the body
+        self.do_GET()
 
     def do_GET(self):
+        if self.path.startswith('/api/banks/'):
+            parts = [part for part in self.path.split('?')[0][len('/api/banks/'):].split('/') if part]
+            if parts and len(parts) <= 2:
+                return self.serve_bank(parts)
+            return self.send_json(404, {'error': 'Expected /api/banks/<source>[/<position or id>]'})
+        if self.path == '/metrics':
+            return self.serve_metrics()
         if self.path == '/mcq/incorrects':
             # Serve the incorrects.html file
             self.path = '/python/incorrects.html'
-        elif self.path == '/api/incorrect-answers':
-            # Get incorrect answers from MongoDB
-            db = get_db()
-            collection = db['incorrect_answers']
-            incorrect_answers = list(collection.find().sort('timestamp', -1))
-            
-            # Convert ObjectId to string for JSON serialization
-            for answer in incorrect_answers:
-                answer['_id'] = str(answer['_id'])
-                answer['userId'] = str(answer['userId'])
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'incorrectAnswers': incorrect_answers}).encode())
-            return
-            
+        elif urlsplit(self.path).path == '/api/search':
+            return self.serve_search(parse_qs(urlsplit(self.path).query))
+        elif urlsplit(self.path).path == '/api/quiz':
+            return self.serve_quiz(parse_qs(urlsplit(self.path).query))
+        elif urlsplit(self.path).path == '/api/incorrect-answers':
+            return self.serve_incorrect_answers(parse_qs(urlsplit(self.path).query))
+        elif urlsplit(self.path).path == '/api/reviews/due':
+            return self.serve_due_reviews(parse_qs(urlsplit(self.path).query))
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if os.path.splitext(path)[1] in CACHEABLE_SUFFIXES and os.path.isfile(path):
+            return self.serve_file(path)
+        if self.command == 'HEAD':
+            return http.server.SimpleHTTPRequestHandler.do_HEAD(self)
         return http.server.SimpleHTTPRequestHandler.do_GET(self)
 
-def start_server():
-    PORT = 8000
-    Handler = MCQHandler
-    httpd = socketserver.TCPServer(("", PORT), Handler)
+def start_server(port=PORT, workers=None, open_browser=True):
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print(f"⚠️  Could not create MongoDB indexes: {str(e)}")
+
+    httpd = MCQServer(("", port), MCQHandler, workers)
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM drains like Ctrl+C; shutdown() must run off the serving thread
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown).start())
     
-    print(f"\nStarting server at http://localhost:{PORT}")
+    print(f"\nStarting server at http://localhost:{port} ({workers or SERVER_WORKERS} workers)")
     print("Press Ctrl+C to stop the server")
     
-    webbrowser.open(f'http://localhost:{PORT}')
+    if open_browser:
+        webbrowser.open(f'http://localhost:{port}')
     
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\nShutting down server...")
+        pass
+    finally:
+        print("\nShutting down server, finishing in-flight requests...")
         httpd.server_close()
+        get_answer_buffer().close()
+        get_scheduler().close()
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Serve the MCQ viewer and API')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f'Requests handled at once (default: SERVER_WORKERS or {SERVER_WORKERS})')
+    parser.add_argument('--no-browser', action='store_true', help="Don't open a browser tab")
+    args = parser.parse_args()
+    start_server(args.port, args.workers, open_browser=not args.no_browser)
@@ -0,0 +1,223 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from transcribe_pdf import iter_pdf_pages, format_page
+from generate_factoids import build_factoid_request, parse_factoid_completion, write_factoids_file, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, MAX_FACTOIDS
+from generate_mcqs import build_mcq_request, parse_mcq_completion, save_mcqs_to_db, write_mcqs_file
+from llm_executor import LLMExecutor
+from mcq_journal import MCQJournal, factoid_hash
+from mcq_bank import BankWriter, derive_bank_id
+from llm_cache import print_cache_stats, forget_request
+from mcq_parser import print_parse_stats
+from text_chunker import ChunkPacker
+from factoid_dedup import NearDuplicateFilter
+import telemetry
+
+# Maximum items waiting between two stages; a full queue pauses the stage feeding it
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))
+
+# Concurrent chunk → factoid requests (MCQ workers use the executor's full concurrency)
+FACTOID_WORKERS = 2
+
+# MongoDB writes are batched by size, or flushed when no MCQ arrived for this long
+DB_BATCH_SIZE = 25
+DB_FLUSH_SECONDS = 2.0
+
+# Queue sentinel telling a consumer its producer is finished
+_DONE = object()
+
+
+async def produce_chunks(pdf_path, transcript_path, pool, chunk_queue):
+    """Stream transcribed pages to the transcript file and pack chunks as pages arrive.
+
+    Pages go through the same ChunkPacker as generate_factoids.chunk_transcript(),
+    so the chunks match those of the finished file.
+    """
+    pages = iter_pdf_pages(pdf_path, pool)
+    packer = ChunkPacker(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+    chunk_count = 0
+    with open(transcript_path, 'w', encoding='utf-8') as txt_file:
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                break
+            page_num, page_text = page
+            if not page_text.strip():
+                continue
+            txt_file.write(format_page(page_num, page_text))
+            for chunk in packer.add_page(page_num + 1, page_text):
+                await chunk_queue.put(chunk)
+                chunk_count += 1
+    for chunk in packer.finish():
+        await chunk_queue.put(chunk)
+        chunk_count += 1
+    return chunk_count
+
+
+async def factoid_worker(executor, chunk_queue, factoid_queue, state):
+    """Turn chunks into factoids and feed each one to the MCQ stage immediately."""
+    telemetry.set_stage('factoids')
+    while True:
+        chunk = await chunk_queue.get()
+        if chunk is _DONE:
+            return
+        if len(state['factoids']) >= MAX_FACTOIDS:
+            continue  # Cap reached; don't spend a request on this chunk
+        try:
+            completion = await executor.complete(build_factoid_request(chunk.text))
+        except Exception as e:
+            print(f"❌ Chunk {chunk.index + 1} (pages {chunk.start_page}–{chunk.end_page}) failed: {str(e)}")
+            continue
+        chunk_factoids = parse_factoid_completion(completion or '')
+        print(f"🎯 Chunk {chunk.index + 1} (pages {chunk.start_page}–{chunk.end_page}): {len(chunk_factoids)} factoids")
+        for factoid in chunk_factoids:
+            if len(state['factoids']) >= MAX_FACTOIDS:
+                break
+            factoid = state['dedup'].add(factoid)
+            if factoid is None:
+                continue
+            state['factoids'].append(factoid)
+            await factoid_queue.put(factoid)
+
+
+async def mcq_worker(executor, factoid_queue, mcq_queue, journal, bank):
+    """Generate an MCQ per factoid, journal it, append it to the bank, and hand it to the database writer."""
+    telemetry.set_stage('mcqs')
+    while True:
+        factoid = await factoid_queue.get()
+        if factoid is _DONE:
+            return
+        if journal.is_done(factoid):
+            if factoid_hash(factoid) not in journal.saved:
+                await mcq_queue.put((factoid, journal.completed[factoid_hash(factoid)]))
+            continue
+        try:
+            completion = await executor.complete(build_mcq_request(factoid))
+        except Exception as e:
+            print(f"  ❌ Error processing factoid: {str(e)}")
+            continue
+        mcq = parse_mcq_completion(completion).mcq
+        if not mcq:
+            forget_request(build_mcq_request(factoid))
+            continue
+        journal.record(factoid, mcq)
+        bank.append(mcq)
+        await mcq_queue.put((factoid, mcq))
+
+
+async def db_writer(mcq_queue, journal, source_name, state):
+    """Batch MCQs into MongoDB inserts that run while generation continues."""
+    source_file = f"{source_name}_factoids.json"
+    bank_id = derive_bank_id(source_name)
+    batch = []
+
+    async def flush():
+        mcqs = [dict(mcq, source_file=source_name, bank_id=bank_id) for _, mcq in batch]
+        if await asyncio.to_thread(save_mcqs_to_db, mcqs, source_file):
+            journal.mark_saved([factoid for factoid, _ in batch])
+            state['saved'] += len(batch)
+        batch.clear()
+
+    while True:
+        try:
+            item = await asyncio.wait_for(mcq_queue.get(), timeout=DB_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            item = None
+        if item is _DONE:
+            break
+        if item is not None:
+            batch.append(item)
+        if batch and (item is None or len(batch) >= DB_BATCH_SIZE):
+            await flush()
+    if batch:
+        await flush()
+
+
+async def run_source_pipelined(pdf_path, transcribed_dir, factoids_dir, mcqs_dir, pool,
+                               concurrency=None, queue_size=QUEUE_SIZE):
+    """Run transcription, factoids, MCQs and MongoDB writes for one PDF as overlapping stages."""
+    source_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    transcript_path = os.path.join(transcribed_dir, f"{source_name}.txt")
+    started = time.time()
+
+    executor = LLMExecutor(concurrency=concurrency)
+    journal = MCQJournal(source_name)
+    mcqs_path = os.path.join(mcqs_dir, f"{source_name}_mcqs.jsonl")
+    bank = BankWriter(mcqs_path, source_name, derive_bank_id(source_name))
+    state = {'factoids': [], 'saved': 0, 'dedup': NearDuplicateFilter()}
+
+    chunk_queue = asyncio.Queue(queue_size)
+    factoid_queue = asyncio.Queue(queue_size)
+    mcq_queue = asyncio.Queue(queue_size)
+
+    producer = asyncio.create_task(produce_chunks(pdf_path, transcript_path, pool, chunk_queue))
+    factoid_tasks = [asyncio.create_task(factoid_worker(executor, chunk_queue, factoid_queue, state))
+                     for _ in range(FACTOID_WORKERS)]
+    mcq_tasks = [asyncio.create_task(mcq_worker(executor, factoid_queue, mcq_queue, journal, bank))
+                 for _ in range(executor.concurrency)]
+    writer = asyncio.create_task(db_writer(mcq_queue, journal, source_name, state))
+    tasks = [producer, writer] + factoid_tasks + mcq_tasks
+
+    def stage_finished(name):
+        # Stages overlap, so each one's wall time runs from the start of the source
+        telemetry.observe('stage_seconds', time.time() - started, stage=name)
+
+    try:
+        # Shut the stages down in order: each finishes draining before the next is told to stop
+        chunk_count = await producer
+        stage_finished('transcribe')
+        for _ in factoid_tasks:
+            await chunk_queue.put(_DONE)
+        await asyncio.gather(*factoid_tasks)
+        stage_finished('factoids')
+        for _ in mcq_tasks:
+            await factoid_queue.put(_DONE)
+        await asyncio.gather(*mcq_tasks)
+        stage_finished('mcqs')
+        await mcq_queue.put(_DONE)
+        await writer
+        stage_finished('db_write')
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        await executor.aclose()
+        bank.close()
+
+    # Keep the on-disk artifacts in the same shape as the staged pipeline
+    factoids = state['factoids']
+    write_factoids_file(transcript_path, factoids_dir, factoids)
+    mcqs = journal.mcqs_for(factoids)
+    write_mcqs_file(mcqs_path, source_name, mcqs)
+
+    print(f"✅ {source_name}: {chunk_count} chunks → {len(factoids)} factoids → {len(mcqs)} MCQs "
+          f"({state['saved']} saved to MongoDB, {state['dedup'].dropped} duplicate factoids dropped) "
+          f"in {time.time() - started:.1f}s")
+    return mcqs
+
+
+def process_pdf_pipelined(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, concurrency=None):
+    """Process every PDF with the stages connected by bounded queues instead of run back to back."""
+    print("\n=== Starting Pipelined PDF Processing ===")
+    pdfs = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
+
+    async def _run():
+        success = True
+        with ProcessPoolExecutor() as pool:
+            for pdf in pdfs:
+                print(f"\nProcessing: {pdf}")
+                try:
+                    with telemetry.run(os.path.splitext(pdf)[0]):
+                        await run_source_pipelined(os.path.join(pdf_dir, pdf), transcribed_dir, factoids_dir,
+                                                   mcqs_dir, pool, concurrency=concurrency)
+                except Exception as e:
+                    print(f"❌ Failed to process {pdf}: {str(e)}")
+                    success = False
+        return success
+
+    success = asyncio.run(_run())
+    print_parse_stats()
+    print_cache_stats()
+    return success
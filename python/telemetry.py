@@ -0,0 +1,397 @@
+import os
+import re
+import json
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+
+# Per-source run summaries (<source>.json), also exported by serve_mcqs at /metrics
+TELEMETRY_DIR = os.getenv(
+    "TELEMETRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telemetry'))
+
+# Optional prices (per 1K tokens) used to estimate what each run cost
+PROMPT_COST_PER_1K = float(os.getenv("LLM_PROMPT_COST_PER_1K", "0"))
+COMPLETION_COST_PER_1K = float(os.getenv("LLM_COMPLETION_COST_PER_1K", "0"))
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+STAGE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+# Help text and type for every metric family this module knows about
+METRICS = {
+    'llm_request_seconds': ('histogram', 'Latency of each chat completion API call'),
+    'llm_prompt_tokens': ('histogram', 'Prompt tokens per chat completion'),
+    'llm_completion_tokens': ('histogram', 'Completion tokens per chat completion'),
+    'llm_requests_total': ('counter', 'Chat completion requests by finish reason (cached and error included)'),
+    'llm_retries_total': ('counter', 'Chat completion attempts that failed and were retried'),
+    'llm_throttled_total': ('counter', 'Chat completion attempts rejected with 429 and retried'),
+    'llm_concurrency_limit': ('gauge', 'Requests the rate governor currently lets into flight'),
+    'stage_seconds': ('histogram', 'Wall time of a pipeline stage'),
+    'db_write_seconds': ('histogram', 'Latency of a MongoDB write'),
+    'db_documents_written_total': ('counter', 'Documents written to MongoDB'),
+    'http_request_seconds': ('histogram', 'Time to handle an HTTP request'),
+    'write_buffer_queued': ('gauge', 'Documents waiting in a write-behind buffer'),
+    'write_buffer_written_total': ('counter', 'Documents written by a write-behind buffer'),
+    'write_buffer_failed_total': ('counter', 'Documents a write-behind buffer failed to write'),
+}
+
+BUCKETS = {
+    'llm_request_seconds': LATENCY_BUCKETS,
+    'llm_prompt_tokens': TOKEN_BUCKETS,
+    'llm_completion_tokens': TOKEN_BUCKETS,
+    'stage_seconds': STAGE_BUCKETS,
+}
+
+# Stage that LLM calls made in the current thread or task are attributed to
+_stage = contextvars.ContextVar('telemetry_stage', default='other')
+
+# Metrics of the source being processed, if any (see run())
+_run = contextvars.ContextVar('telemetry_run', default=None)
+
+
+class Histogram:
+    """Counts of observations at or below each bucket bound, plus their sum."""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated within its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def to_dict(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['bounds'])
+        histogram.counts = list(data['counts'])
+        histogram.sum = data['sum']
+        histogram.count = data['count']
+        return histogram
+
+
+class Metrics:
+    """Thread-safe histograms, counters and gauges keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(BUCKETS.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self):
+        """JSON-serializable copy of every metric."""
+        entry = lambda key, value: {'name': key[0], 'labels': dict(key[1]), 'value': value}
+        with self._lock:
+            return {
+                'histograms': [entry(key, h.to_dict()) for key, h in self.histograms.items()],
+                'counters': [entry(key, v) for key, v in self.counters.items()],
+                'gauges': [entry(key, v) for key, v in self.gauges.items()],
+            }
+
+
+# Process-wide metrics, served live by serve_mcqs
+metrics = Metrics()
+
+
+def _targets():
+    current = _run.get()
+    return (metrics,) if current is None else (metrics, current['metrics'])
+
+
+def observe(name, value, **labels):
+    for target in _targets():
+        target.observe(name, value, **labels)
+
+
+def increment(name, amount=1, **labels):
+    for target in _targets():
+        target.increment(name, amount, **labels)
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observe the wall time of the block under `name`, even when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def current_stage():
+    return _stage.get()
+
+
+def set_stage(name):
+    """Attribute LLM calls in the current task (or thread) to a stage; returns a reset token."""
+    return _stage.set(name)
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage and attribute the LLM calls made inside it to the stage."""
+    token = _stage.set(name)
+    try:
+        with timed('stage_seconds', stage=name):
+            yield
+    finally:
+        _stage.reset(token)
+
+
+def record_llm_call(latency, response=None, error=None, cached=False):
+    """Record one chat completion attempt: latency, token usage and finish reason."""
+    stage_name = _stage.get()
+    if cached:
+        increment('llm_requests_total', stage=stage_name, finish_reason='cached')
+        return
+    observe('llm_request_seconds', latency, stage=stage_name)
+    if error is not None or response is None:
+        increment('llm_requests_total', stage=stage_name, finish_reason='error')
+        return
+    choices = getattr(response, 'choices', None) or []
+    finish_reason = getattr(choices[0], 'finish_reason', None) if choices else None
+    increment('llm_requests_total', stage=stage_name, finish_reason=finish_reason or 'unknown')
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        if getattr(usage, 'prompt_tokens', None) is not None:
+            observe('llm_prompt_tokens', usage.prompt_tokens, stage=stage_name)
+        if getattr(usage, 'completion_tokens', None) is not None:
+            observe('llm_completion_tokens', usage.completion_tokens, stage=stage_name)
+
+
+def record_retry():
+    increment('llm_retries_total', stage=_stage.get())
+
+
+def record_throttle():
+    increment('llm_throttled_total', stage=_stage.get())
+
+
+@contextmanager
+def run(source_name, output_dir=None):
+    """Collect the metrics of one source file's run and write its JSON summary on exit.
+
+    Work started from inside the block (including asyncio tasks and
+    asyncio.to_thread calls) is attributed to the source. Writes made by
+    background write-behind threads only reach the process-wide metrics.
+    """
+    current = {'source': source_name, 'started': datetime.utcnow(), 'metrics': Metrics()}
+    token = _run.set(current)
+    started = time.perf_counter()
+    status = 'failed'
+    try:
+        yield current
+        status = 'ok'
+    finally:
+        _run.reset(token)
+        summary = build_run_summary(current, time.perf_counter() - started, status)
+        try:
+            path = write_run_summary(summary, output_dir)
+            print_run_summary(summary, path)
+        except OSError as e:
+            print(f"⚠️  Could not write telemetry summary for {source_name}: {str(e)}")
+
+
+def _histograms(snapshot, name):
+    for entry in snapshot['histograms']:
+        if entry['name'] == name:
+            yield entry['labels'], Histogram.from_dict(entry['value'])
+
+
+def build_run_summary(current, wall_seconds, status='ok'):
+    """Per-stage LLM usage, stage wall times and database write latency for a run."""
+    snapshot = current['metrics'].snapshot()
+    llm = {}
+
+    def stage_entry(stage_name):
+        return llm.setdefault(stage_name, {
+            'calls': 0, 'cached': 0, 'errors': 0, 'retries': 0, 'finish_reasons': {},
+            'prompt_tokens': 0, 'completion_tokens': 0
+        })
+
+    for entry in snapshot['counters']:
+        labels, value = entry['labels'], entry['value']
+        if entry['name'] == 'llm_requests_total':
+            totals = stage_entry(labels.get('stage'))
+            reason = labels.get('finish_reason')
+            if reason == 'cached':
+                totals['cached'] += value
+            elif reason == 'error':
+                totals['errors'] += value
+            else:
+                totals['calls'] += value
+                totals['finish_reasons'][reason] = totals['finish_reasons'].get(reason, 0) + value
+        elif entry['name'] == 'llm_retries_total':
+            stage_entry(labels.get('stage'))['retries'] += value
+    for field, name in (('prompt_tokens', 'llm_prompt_tokens'), ('completion_tokens', 'llm_completion_tokens')):
+        for labels, histogram in _histograms(snapshot, name):
+            stage_entry(labels.get('stage'))[field] += int(histogram.sum)
+    for labels, histogram in _histograms(snapshot, 'llm_request_seconds'):
+        stage_entry(labels.get('stage'))['latency_seconds'] = _latency_summary(histogram)
+
+    totals = {
+        'calls': sum(s['calls'] for s in llm.values()),
+        'cached': sum(s['cached'] for s in llm.values()),
+        'retries': sum(s['retries'] for s in llm.values()),
+        'prompt_tokens': sum(s['prompt_tokens'] for s in llm.values()),
+        'completion_tokens': sum(s['completion_tokens'] for s in llm.values()),
+    }
+    if PROMPT_COST_PER_1K or COMPLETION_COST_PER_1K:
+        totals['estimated_cost'] = round(totals['prompt_tokens'] / 1000 * PROMPT_COST_PER_1K
+                                         + totals['completion_tokens'] / 1000 * COMPLETION_COST_PER_1K, 4)
+
+    return {
+        'source': current['source'],
+        'status': status,
+        'started': current['started'].isoformat() + 'Z',
+        'wall_seconds': round(wall_seconds, 3),
+        'totals': totals,
+        'llm': llm,
+        'stages': {labels.get('stage'): round(h.sum, 3) for labels, h in _histograms(snapshot, 'stage_seconds')},
+        'db_writes': {labels.get('collection'): _latency_summary(h) for labels, h in _histograms(snapshot, 'db_write_seconds')},
+        'metrics': snapshot,
+    }
+
+
+def _latency_summary(histogram):
+    round_or_none = lambda value: None if value is None else round(value, 4)
+    return {
+        'count': histogram.count,
+        'total': round(histogram.sum, 3),
+        'p50': round_or_none(histogram.quantile(0.5)),
+        'p95': round_or_none(histogram.quantile(0.95)),
+    }
+
+
+def summary_path(source_name, output_dir=None):
+    safe_name = re.sub(r'[^\w.-]+', '_', source_name)
+    return os.path.join(output_dir or TELEMETRY_DIR, f"{safe_name}.json")
+
+
+def write_run_summary(summary, output_dir=None):
+    path = summary_path(summary['source'], output_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def print_run_summary(summary, path=None):
+    totals = summary['totals']
+    stages = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in summary['stages'].items())
+    cost = f", ~{totals['estimated_cost']:.2f} estimated cost" if 'estimated_cost' in totals else ''
+    print(f"📈 {summary['source']}: {totals['calls']} LLM calls ({totals['cached']} cached, {totals['retries']} retries), "
+          f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens{cost} "
+          f"in {summary['wall_seconds']:.1f}s" + (f" [{stages}]" if stages else ''))
+    if path:
+        print(f"   Telemetry summary: {path}")
+
+
+# path -> (mtime, summary); summaries are re-read only when rewritten
+_summary_cache = {}
+
+
+def load_run_summaries(output_dir=None):
+    """The latest summary of every source, newest files re-read on change."""
+    directory = output_dir or TELEMETRY_DIR
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            mtime = os.path.getmtime(path)
+            cached = _summary_cache.get(path)
+            if cached is None or cached[0] != mtime:
+                with open(path, 'r', encoding='utf-8') as f:
+                    cached = _summary_cache[path] = (mtime, json.load(f))
+        except (OSError, ValueError):
+            continue
+        summaries.append(cached[1])
+    return summaries
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items())) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(sources):
+    """Prometheus text exposition for (extra_labels, snapshot) pairs, grouped by metric family."""
+    families = {}
+    for extra_labels, snapshot in sources:
+        for kind in ('histograms', 'counters', 'gauges'):
+            for entry in snapshot[kind]:
+                labels = dict(entry['labels'], **extra_labels)
+                families.setdefault(entry['name'], []).append((kind, labels, entry['value']))
+
+    lines = []
+    for name in sorted(families):
+        kind, help_text = METRICS.get(name, ('untyped', name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_kind, labels, value in families[name]:
+            if sample_kind != 'histograms':
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(value['bounds'] + ['+Inf'], value['counts']):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(value['sum']))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return '\n'.join(lines) + '\n'
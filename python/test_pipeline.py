@@ -1,11 +1,19 @@
 import os
 import time
-from transcribe_pdf import main as transcribe_pdf_main
-from generate_factoids import main as generate_factoids_main
-from generate_mcqs import main as generate_mcqs_main
+import argparse
+from transcribe_pdf import transcribe_pdf_file
+from generate_factoids import chunk_transcript, generate_factoids_for_chunks, write_factoids_file, MAX_FACTOIDS
+from generate_mcqs import generate_mcqs_file
+from mcq_sync import sync_mcqs, print_sync_result
+from mcq_bank import iter_bank, derive_bank_id
+from mcq_journal import MCQJournal, factoid_hash
+from factoid_dedup import dedupe_factoids
+from pipeline_manifest import PipelineManifest, hash_file, hash_text
+from streaming_pipeline import process_pdf_pipelined
 from serve_mcqs import start_server
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from search_index import update_search_index
+from db_utils import get_db
+import telemetry
 import json
 
 def get_project_root():
@@ -33,43 +41,19 @@ def ensure_directories():
 def import_to_mongodb(mcqs_file, source_name):
     """Import MCQs to MongoDB."""
     try:
-        load_dotenv()
-        MONGODB_URI = os.getenv("MONGODB_URI")
-        MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
-        
         print(f"\nConnecting to MongoDB...")
-        client = MongoClient(MONGODB_URI)
-        db = client[MONGO_DB_NAME]
-        mcqs_collection = db['mcqs']
+        mcqs_collection = get_db()['mcqs']
         
         print(f"Reading MCQs from {mcqs_file}")
-        with open(mcqs_file, 'r') as f:
-            data = json.load(f)
-        
-        # Add source_file to each MCQ based on the bank ID
-        mcqs = data.get('mcqs', [])
+        mcqs = list(iter_bank(mcqs_file))
         source_file = f"{source_name}_factoids.json"
-        print(f"Using source file: {source_file}")
-        
-        # Add metadata to each MCQ
-        for mcq in mcqs:
-            mcq['source_file'] = source_file
-            mcq['bank_id'] = 'mehlman-microbiology'  # Add bank_id for frontend
+        bank_id = derive_bank_id(source_name)
+        print(f"Using source file: {source_file} (bank {bank_id})")
         
         if mcqs:
-            # Remove any existing MCQs for this source
-            print(f"Removing existing MCQs for {source_file}")
-            mcqs_collection.delete_many({
-                '$or': [
-                    {'source_file': source_file},
-                    {'bank_id': 'mehlman-microbiology'}
-                ]
-            })
-            
-            # Insert new MCQs
-            print(f"Inserting {len(mcqs)} new MCQs")
-            result = mcqs_collection.insert_many(mcqs)
-            print(f"✅ Successfully imported {len(result.inserted_ids)} MCQs to MongoDB")
+            # Only write MCQs that were added, changed or removed since the last import
+            result = sync_mcqs(mcqs_collection, mcqs, source_file, bank_id)
+            print_sync_result(result, source_file)
             return True
         else:
             print("❌ No MCQs found in the data")
@@ -82,46 +66,161 @@ def import_to_mongodb(mcqs_file, source_name):
         traceback.print_exc()
         return False
 
-def process_pdf(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir):
-    """Process PDFs through the entire pipeline."""
+def transcribe_stage(entry, manifest, pdf_path, transcribed_dir, force=False):
+    """Re-transcribe the PDF only if its bytes changed or the transcript was modified."""
+    source_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    transcript_path = os.path.join(transcribed_dir, f"{source_name}.txt")
+    pdf_hash = hash_file(pdf_path)
+
+    if not force and entry.get('pdf_hash') == pdf_hash \
+            and manifest.artifact_current(entry, 'transcript', transcript_path):
+        print("\n1. ⏭️  Transcript is up to date")
+        return transcript_path
+
+    print("\n1. 📝 Transcribing PDF to text...")
+    transcribe_pdf_file(pdf_path, transcribed_dir)
+
+    entry['pdf_hash'] = pdf_hash
+    entry.pop('pages', None)  # Written by older builds; pages are never reused
+    manifest.record_artifact(entry, 'transcript', transcript_path)
+    manifest.save()
+    return transcript_path
+
+def factoids_stage(entry, manifest, transcript_path, factoids_dir, force=False):
+    """Regenerate factoids only for transcript chunks whose text changed."""
+    source_name = os.path.splitext(os.path.basename(transcript_path))[0]
+    factoids_path = os.path.join(factoids_dir, f"{source_name}_factoids.json")
+    transcript_hash = entry['transcript']['hash']
+
+    if not force and manifest.artifact_current(entry, 'factoids_file', factoids_path) \
+            and entry['factoids_file'].get('transcript_hash') == transcript_hash:
+        print("\n2. ⏭️  Factoids are up to date")
+        return factoids_path
+
+    print("\n2. 🎯 Generating factoids from text...")
+    chunks = chunk_transcript(transcript_path)
+    chunk_hashes = [hash_text(chunk.text) for chunk in chunks]
+    known = {} if force else entry.get('chunks', {})
+    stale = [i for i, chunk_hash in enumerate(chunk_hashes) if chunk_hash not in known]
+    print(f"   {len(chunks) - len(stale)}/{len(chunks)} chunks unchanged, generating {len(stale)}")
+
+    if stale:
+        for i, chunk_factoids in zip(stale, generate_factoids_for_chunks([chunks[i] for i in stale])):
+            if chunk_factoids is not None:
+                known[chunk_hashes[i]] = chunk_factoids
+
+    # Keep only chunks still present in the transcript
+    entry['chunks'] = {h: known[h] for h in chunk_hashes if h in known}
+    complete = len(entry['chunks']) == len(set(chunk_hashes))
+
+    all_factoids = []
+    for chunk_hash in chunk_hashes:
+        all_factoids.extend(entry['chunks'].get(chunk_hash, []))
+    all_factoids, _ = dedupe_factoids(all_factoids)
+    all_factoids = all_factoids[:MAX_FACTOIDS]
+    write_factoids_file(transcript_path, factoids_dir, all_factoids)
+
+    previous = entry.get('factoids', {})
+    entry['factoids'] = {h: previous.get(h) for h in map(factoid_hash, all_factoids)}
+    # Leaving transcript_hash unset when a chunk failed makes the next rebuild retry it
+    manifest.record_artifact(entry, 'factoids_file', factoids_path,
+                             transcript_hash=transcript_hash if complete else None)
+    manifest.save()
+    return factoids_path
+
+def mcqs_stage(entry, manifest, factoids_path, mcqs_dir, force=False):
+    """Regenerate the MCQ bank when the factoids changed; only new factoids cost a call."""
+    source_name = os.path.basename(factoids_path).replace('_factoids.json', '')
+    mcqs_path = os.path.join(mcqs_dir, f"{source_name}_mcqs.jsonl")
+    factoids_hash = entry['factoids_file']['hash']
+
+    if not force and manifest.artifact_current(entry, 'mcqs_file', mcqs_path) \
+            and entry['mcqs_file'].get('factoids_hash') == factoids_hash:
+        print("\n3. ⏭️  MCQs are up to date")
+        return mcqs_path
+
+    print("\n3. ❓ Creating MCQs from factoids...")
+    generate_mcqs_file(factoids_path, mcqs_path)
+
+    journal = MCQJournal(source_name)
+    for key in entry['factoids']:
+        mcq = journal.completed.get(key)
+        entry['factoids'][key] = hash_text(json.dumps(mcq, sort_keys=True)) if mcq else None
+    complete = all(entry['factoids'].values())
+    manifest.record_artifact(entry, 'mcqs_file', mcqs_path,
+                             factoids_hash=factoids_hash if complete else None)
+    manifest.save()
+    return mcqs_path
+
+def rebuild_source(pdf, pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, manifest, force=False):
+    """Bring one PDF's transcript, factoids, MCQs and database import up to date."""
+    source_name = os.path.splitext(pdf)[0]
+    entry = manifest.source(pdf)
+
+    with telemetry.stage('transcribe'):
+        transcript_path = transcribe_stage(entry, manifest, os.path.join(pdf_dir, pdf), transcribed_dir, force)
+    factoids_path = factoids_stage(entry, manifest, transcript_path, factoids_dir, force)
+    mcqs_path = mcqs_stage(entry, manifest, factoids_path, mcqs_dir, force)
+
+    # Step 4: Import to MongoDB
+    if not force and entry.get('imported_hash') == entry['mcqs_file']['hash']:
+        print("\n4. ⏭️  MongoDB already has this MCQ bank")
+        return True
+
+    print("\n4. 📦 Importing MCQs to MongoDB...")
+    with telemetry.stage('import'):
+        imported = import_to_mongodb(mcqs_path, source_name)
+    if not imported:
+        return False
+    entry['imported_hash'] = entry['mcqs_file']['hash']
+    manifest.save()
+    return True
+
+def process_pdf(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, force=False):
+    """Process PDFs through the entire pipeline.
+
+    Each PDF is rebuilt on its own, and the pipeline manifest lets every stage
+    skip work whose inputs are unchanged since the last run. Pass force=True
+    to rebuild everything.
+    """
     print("\n=== Starting PDF Processing Pipeline ===")
     
     # Get list of PDFs
     pdfs = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
-    
-    # Get the project root directory
-    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    manifest = PipelineManifest()
+    success = True
     
     for pdf in pdfs:
         print(f"\nProcessing: {pdf}")
-        source_name = os.path.splitext(pdf)[0]
-        
-        # Step 1: Transcribe PDF
-        print("\n1. 📝 Transcribing PDF to text...")
-        transcribe_pdf_main(pdf_dir=pdf_dir, output_dir=transcribed_dir)
-        
-        # Step 2: Generate Factoids
-        print("\n2. 🎯 Generating factoids from text...")
-        generate_factoids_main(input_dir=transcribed_dir, output_dir=factoids_dir)
-        
-        # Step 3: Generate MCQs
-        print("\n3. ❓ Creating MCQs from factoids...")
-        generate_mcqs_main(
-            input_dir=os.path.join(factoids_dir),
-            output_dir=os.path.join(mcqs_dir)
-        )
-        
-        # Step 4: Import to MongoDB
-        mcqs_file = os.path.join(mcqs_dir, f"{source_name}_mcqs.json")
-        print("\n4. 📦 Importing MCQs to MongoDB...")
-        if import_to_mongodb(mcqs_file, source_name):
-            print(f"✅ Successfully processed {pdf}")
-        else:
-            print(f"❌ Failed to process {pdf}")
+        try:
+            with telemetry.run(os.path.splitext(pdf)[0]):
+                rebuilt = rebuild_source(pdf, pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, manifest, force)
+            if rebuilt:
+                print(f"✅ Successfully processed {pdf}")
+                continue
+        except Exception as e:
+            print(f"❌ Error processing {pdf}: {str(e)}")
+        print(f"❌ Failed to process {pdf}")
+        success = False
     
-    return True
+    return success
 
-def main():
+def process_pdf_queued(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, workers, force=False):
+    """Queue the PDFs as leased jobs and drain them with worker processes (see pipeline_jobs).
+
+    Books are processed in parallel, and a crashed worker's job is picked up
+    again once its lease expires, so an interrupted run resumes where it left off.
+    """
+    from pipeline_jobs import enqueue_pdfs, run_workers
+    from job_queue import print_status
+
+    print(f"\n=== Starting PDF Processing Pipeline ({workers} workers) ===")
+    enqueue_pdfs(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, force=force)
+    status = run_workers(workers)
+    print_status(status)
+    return not any(counts['failed'] for counts in status['stages'].values())
+
+def main(pipelined=False, force=False, workers=0):
     # Ensure all directories exist
     pdf_dir, transcribed_dir, factoids_dir, mcqs_dir = ensure_directories()
     
@@ -135,7 +234,14 @@ def main():
     print(f"\nFound PDFs: {pdfs}")
     
     # Process the PDFs
-    success = process_pdf(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir)
+    if workers:
+        success = process_pdf_queued(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, workers, force=force)
+    elif pipelined:
+        success = process_pdf_pipelined(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir)
+    else:
+        success = process_pdf(pdf_dir, transcribed_dir, factoids_dir, mcqs_dir, force=force)
+    # Make new MCQs searchable even if some sources failed
+    update_search_index()
     if success:
         print("\n✨ Pipeline completed successfully!")
         print("\n🌐 Starting local server to view MCQs...")
@@ -144,4 +250,11 @@ def main():
         print("\n❌ Pipeline failed to complete")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the PDF → factoids → MCQs pipeline.")
+    parser.add_argument('--pipelined', action='store_true',
+                        help="overlap all stages through bounded queues instead of running them in turn")
+    parser.add_argument('--force', action='store_true', help="ignore the manifest and rebuild everything")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="drain a job queue with this many worker processes, books in parallel")
+    args = parser.parse_args()
+    main(pipelined=args.pipelined, force=args.force, workers=args.workers) 
\ No newline at end of file
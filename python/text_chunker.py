@@ -0,0 +1,148 @@
+import os
+import re
+import mmap
+from collections import namedtuple
+
+# Rough characters-per-token ratio used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+# A chunk this full is closed at the next page boundary rather than split mid-page
+MIN_FILL = 0.75
+
+PAGE_MARKER = re.compile(rb'^--- Page (\d+) ---$', re.MULTILINE)
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # Not installed, or its encoding files can't be fetched
+    _encoding = None
+
+# start_page/end_page are None for text without --- Page N --- markers
+Chunk = namedtuple('Chunk', ['index', 'text', 'start_page', 'end_page', 'tokens'])
+
+
+def estimate_tokens(text):
+    """Token count for text, exact with tiktoken and approximate without it."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_oversized(paragraph, max_tokens):
+    """Break a paragraph that alone exceeds max_tokens at sentence, then character, boundaries."""
+    if estimate_tokens(paragraph) <= max_tokens:
+        return [paragraph]
+    pieces = []
+    current = ''
+    for sentence in SENTENCE_BREAK.split(paragraph):
+        candidate = f"{current} {sentence}" if current else sentence
+        if estimate_tokens(candidate) <= max_tokens:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        if estimate_tokens(sentence) <= max_tokens:
+            current = sentence
+        else:
+            step = max_tokens * CHARS_PER_TOKEN
+            pieces.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+            current = ''
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class ChunkPacker:
+    """Packs pages of text into chunks of at most max_tokens.
+
+    Paragraphs are never split unless one alone is over budget. A chunk that is
+    at least MIN_FILL full is closed at the next page boundary. The last
+    paragraphs of each chunk, up to overlap_tokens, are repeated at the start
+    of the next one.
+    """
+
+    def __init__(self, max_tokens, overlap_tokens=0):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self._units = []  # (page, text, tokens)
+        self._tokens = 0
+        self._fresh = 0  # Units not carried over as overlap
+        self._index = 0
+
+    def add_page(self, page, text):
+        """Add one page and yield every chunk it completes."""
+        starts_page = True
+        for paragraph in PARAGRAPH_BREAK.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            for piece in split_oversized(paragraph, self.max_tokens):
+                tokens = estimate_tokens(piece)
+                # Overlap alone must never push a fresh paragraph out of its chunk
+                while not self._fresh and self._units and self._tokens + tokens > self.max_tokens:
+                    self._tokens -= self._units.pop(0)[2]
+                if self._fresh and (self._tokens + tokens > self.max_tokens or
+                                    (starts_page and self._tokens >= MIN_FILL * self.max_tokens)):
+                    yield self._emit()
+                self._units.append((page, piece, tokens))
+                self._tokens += tokens
+                self._fresh += 1
+                starts_page = False
+
+    def finish(self):
+        """Yield the final partial chunk, if any new text is pending."""
+        if self._fresh:
+            yield self._emit()
+
+    def _emit(self):
+        units = self._units
+        chunk = Chunk(
+            self._index,
+            '\n\n'.join(text for _, text, _ in units),
+            units[0][0],
+            units[-1][0],
+            self._tokens
+        )
+        self._index += 1
+
+        carried = []
+        carried_tokens = 0
+        for unit in reversed(units):
+            if carried_tokens + unit[2] > self.overlap_tokens:
+                break
+            carried.insert(0, unit)
+            carried_tokens += unit[2]
+        self._units = carried
+        self._tokens = carried_tokens
+        self._fresh = 0
+        return chunk
+
+
+def iter_transcript_pages(path):
+    """Lazily yield (page_number, text) from a memory-mapped transcript.
+
+    Text before the first marker, or in a file with no markers, has page None.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            page, start = None, 0
+            for marker in PAGE_MARKER.finditer(mm):
+                text = mm[start:marker.start()].decode('utf-8', errors='replace')
+                if text.strip():
+                    yield page, text
+                page, start = int(marker.group(1)), marker.end()
+            text = mm[start:].decode('utf-8', errors='replace')
+            if text.strip():
+                yield page, text
+
+
+def iter_chunks(path, max_tokens, overlap_tokens=0):
+    """Lazily yield Chunks packed from a transcript file."""
+    packer = ChunkPacker(max_tokens, overlap_tokens)
+    for page, text in iter_transcript_pages(path):
+        yield from packer.add_page(page, text)
+    yield from packer.finish()
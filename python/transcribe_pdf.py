@@ -1,33 +1,128 @@
 import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from PyPDF2 import PdfReader
+from page_normalizer import PageNormalizer, strip_patterns
+from text_chunker import estimate_tokens
+
+# Pages handed to a worker process at a time
+PAGES_PER_TASK = 16
 
 def clean_text(text):
-    """Clean the extracted text by removing unwanted patterns."""
-    # Remove "MEHLMANMEDICAL.COM" (case insensitive)
-    cleaned = text.replace("MEHLMANMEDICAL.COM", "").replace("mehlmanmedical.com", "")
-    # Remove multiple consecutive newlines and spaces
-    while "\n\n\n" in cleaned:
-        cleaned = cleaned.replace("\n\n\n", "\n\n")
-    return cleaned.strip()
-
-def main(pdf_dir="python/pdfs", output_dir="python/transcribed"):
+    """Remove watermark and page-number patterns; repeated headers are dropped later by PageNormalizer."""
+    return strip_patterns(text)
+
+def extract_page_range(pdf_path, start, end):
+    """Extract pages [start, end) of a PDF as (page_num, cleaned_text, raw_chars, raw_tokens).
+
+    Runs in a worker process, so the raw size is measured here rather than
+    shipping the raw text back.
+    """
+    reader = PdfReader(pdf_path)
+    pages = []
+    for page_num in range(start, end):
+        raw = reader.pages[page_num].extract_text() or ''
+        pages.append((page_num, clean_text(raw), len(raw), estimate_tokens(raw) if raw else 0))
+    return pages
+
+def iter_pdf_pages(pdf_path, pool, pages_per_task=PAGES_PER_TASK, normalizer=None):
+    """Yield (page_num, cleaned_text) for every page in order, extracting ranges in `pool`.
+
+    Running headers, footers and watermarks are stripped by a PageNormalizer,
+    which holds back the first few pages to learn them; how much it saved is
+    printed once the document is done.
+    """
+    normalizer = normalizer or PageNormalizer()
+    page_count = len(PdfReader(pdf_path).pages)
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    # map() yields ranges in submission order, so pages come out in order
+    # while later ranges are still being extracted
+    results = pool.map(
+        extract_page_range,
+        [pdf_path] * len(ranges),
+        [start for start, _ in ranges],
+        [end for _, end in ranges]
+    )
+    for pages in results:
+        for page in pages:
+            yield from normalizer.add(*page)
+    yield from normalizer.finish()
+    normalizer.print_report(os.path.basename(pdf_path))
+
+def format_page(page_num, page_text):
+    """Render a page the way it appears in a transcript, with its --- Page N --- marker."""
+    return f"\n--- Page {page_num + 1} ---\n\n{page_text}\n"
+
+def transcribe_pdf_file(pdf_path, output_dir, pool=None, pages_per_task=PAGES_PER_TASK):
+    """Transcribe one PDF, extracting page ranges in parallel and writing pages in order.
+
+    Returns (output_path, page_count, seconds).
+    """
+    started = time.time()
+    txt_filename = os.path.splitext(os.path.basename(pdf_path))[0] + '.txt'
+    output_path = os.path.join(output_dir, txt_filename)
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ProcessPoolExecutor()
+    page_count = 0
+    try:
+        with open(output_path, 'w', encoding='utf-8') as txt_file:
+            for page_num, page_text in iter_pdf_pages(pdf_path, pool, pages_per_task):
+                page_count += 1
+                if page_text.strip():  # Only write if there's content after cleaning
+                    txt_file.write(format_page(page_num, page_text))
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+    return output_path, page_count, time.time() - started
+
+def transcribe_all(pdf_dir="python/pdfs", output_dir="python/transcribed", workers=None):
+    """Transcribe every PDF in pdf_dir without prompting, sharing one process pool."""
+    os.makedirs(pdf_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    pdf_files = sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf'))
+    if not pdf_files:
+        print(f"\n❌ No PDF files found in {pdf_dir} directory!")
+        return []
+
+    outputs = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for pdf_file in pdf_files:
+            print(f"\n📄 Processing: {pdf_file}")
+            try:
+                output_path, page_count, seconds = transcribe_pdf_file(os.path.join(pdf_dir, pdf_file), output_dir, pool=pool)
+                rate = page_count / seconds if seconds > 0 else float('inf')
+                print(f"✅ Transcribed {page_count} pages in {seconds:.1f}s ({rate:.1f} pages/sec) → {output_path}")
+                outputs.append(output_path)
+            except Exception as e:
+                print(f"❌ Error processing {pdf_file}: {str(e)}")
+    return outputs
+
+def main(pdf_dir="python/pdfs", output_dir="python/transcribed", batch=False, workers=None):
+    if batch:
+        return transcribe_all(pdf_dir, output_dir, workers=workers)
+
     # Ensure directories exist
     os.makedirs(pdf_dir, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
-    
+
     # Get list of PDF files
     pdf_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
-    
+
     if not pdf_files:
         print("\n❌ No PDF files found in python/pdfs directory!")
         return
-    
+
     # If multiple files exist, let user choose
     if len(pdf_files) > 1:
         print("\n📚 Available PDF files:")
         for i, file in enumerate(pdf_files, 1):
             print(f"{i}. {file}")
-        
+
         while True:
             try:
                 choice = int(input("\nChoose a file number to process (or 0 to exit): "))
@@ -41,33 +136,25 @@ def main(pdf_dir="python/pdfs", output_dir="python/transcribed"):
                 print("Please enter a valid number.")
     else:
         pdf_file = pdf_files[0]
-    
+
     pdf_path = os.path.join(pdf_dir, pdf_file)
     print(f"\n📄 Processing: {pdf_file}")
-    
+
     try:
-        # Create PDF reader object
-        reader = PdfReader(pdf_path)
-        
-        # Create output file path
-        txt_filename = os.path.splitext(pdf_file)[0] + '.txt'
-        output_path = os.path.join(output_dir, txt_filename)
-        
-        # Extract text from all pages
-        with open(output_path, 'w', encoding='utf-8') as txt_file:
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                # Clean the extracted text before writing
-                page_text = clean_text(page.extract_text())
-                if page_text.strip():  # Only write if there's content after cleaning
-                    txt_file.write(f"\n--- Page {page_num + 1} ---\n\n")
-                    txt_file.write(page_text)
-                    txt_file.write("\n")
-        
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            output_path, page_count, seconds = transcribe_pdf_file(pdf_path, output_dir, pool=pool)
+
         print(f"✅ Transcription complete. Text saved to: {output_path}")
-        
+        print(f"⏱️  {page_count} pages in {seconds:.1f}s ({page_count / max(seconds, 1e-9):.1f} pages/sec)")
+
     except Exception as e:
         print(f"❌ Error processing {pdf_file}: {str(e)}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Transcribe PDFs to text.")
+    parser.add_argument('--all', action='store_true', help="transcribe every PDF without prompting")
+    parser.add_argument('--workers', type=int, default=None, help="number of extraction processes")
+    parser.add_argument('--pdf-dir', default="python/pdfs")
+    parser.add_argument('--output-dir', default="python/transcribed")
+    args = parser.parse_args()
+    main(pdf_dir=args.pdf_dir, output_dir=args.output_dir, batch=args.all, workers=args.workers)